@@ -0,0 +1,1067 @@
+'''
+Performance benchmarks for the network_3 / link_3 data plane.
+
+Run every benchmark with
+    python benchmark.py
+or only some of them by name, e.g.
+    python benchmark.py wakeup
+'''
+
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import capture
+import link_3
+import log
+import network_3 as network
+import qdisc
+import quiescence
+import replay
+import routing
+import runtimes
+import sharding
+import simulation_3
+import telemetry
+import topology
+import traffic
+
+## benchmarks registered by name
+benchmark_D = {}
+
+
+## payload used for the simulation_3 workloads
+message_S = "STARTC1-ABCDEFGHIJKLMNOPQRSTUVWXYZ-0123456789-ABCDEFGHIJKLMNOPQRSTUVWXYZ-ENDC1"
+
+
+## register a bench_<name> function under <name>
+def benchmark(fn):
+    benchmark_D[fn.__name__[len('bench_'):]] = fn
+    return fn
+
+
+## silence the per-packet trace while benchmarking
+@contextlib.contextmanager
+def quiet():
+    saved_level = log.level
+    log.level = log.OFF
+    try:
+        yield
+    finally:
+        log.level = saved_level
+
+
+## raise RuntimeError with message unless ok, a correctness check of a benchmark that, unlike assert, also runs
+# under python -O
+def check(ok, message):
+    if not ok:
+        raise RuntimeError('check failed: ' + message)
+
+
+## start a thread for every object
+# @return list of started threads
+def start_threads(object_L):
+    thread_L = [threading.Thread(name=str(o), target=o.run, daemon=True) for o in object_L]
+    for t in thread_L:
+        t.start()
+    return thread_L
+
+
+## stop and join the threads of all objects
+def stop_threads(object_L, thread_L):
+    for o in object_L:
+        o.stop = True
+    for t in thread_L:
+        t.join()
+
+
+## send messages from both clients of simulation_3 and wait until all of them are reassembled by the servers
+# @return number of packets received
+def run_simulation_3_load(host_L, messages, timeout=60):
+    client_1, client_2, server_1, server_2 = host_L
+    for _ in range(messages):
+        for client, dst in ((client_1, 3), (client_2, 4)):
+            client.udt_send(dst, message_S)
+    expected = client_1.snd_pkt_count + client_2.snd_pkt_count
+    deadline = time.time() + timeout
+    while server_1.rcv_pkt_count + server_2.rcv_pkt_count < expected and time.time() < deadline:
+        time.sleep(0.001)
+    return server_1.rcv_pkt_count + server_2.rcv_pkt_count
+
+
+## packets/sec and CPU usage of busy polling vs event-driven wakeup on the simulation_3 topology
+# @param messages: number of messages sent by each client
+# @param idle_time: seconds the idle network is observed for
+@benchmark
+def bench_wakeup(messages=200, idle_time=1.0):
+    for busy_poll in (True, False):
+        host_L, router_L, link_layer = simulation_3.build_network()
+        object_L = host_L + router_L + [link_layer]
+        for o in object_L:
+            o.busy_poll = busy_poll
+        with quiet():
+            thread_L = start_threads(object_L)
+            cpu_start = time.process_time()
+            time.sleep(idle_time)
+            idle_cpu = (time.process_time() - cpu_start) / idle_time
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            received = run_simulation_3_load(host_L, messages)
+            wall = time.perf_counter() - wall_start
+            load_cpu = (time.process_time() - cpu_start) / wall
+            stop_threads(object_L, thread_L)
+        print('wakeup %-5s: idle cpu %6.1f%%, %8.0f pkts/s, cpu under load %6.1f%%'
+              % ('poll' if busy_poll else 'event', 100 * idle_cpu, received / wall, 100 * load_cpu))
+
+
+## serialize, parse and dst_addr peek rates of the text and binary packet wire formats
+# @param packets: number of packets encoded and decoded per format
+@benchmark
+def bench_wire_format(packets=100000):
+    # round trip check, including field values only the binary format can carry
+    for wire_format, dst_addr, pkt_id, frag_offset in (('text', 3, 42, 18), ('binary', 65535, 2 ** 32 - 1, 65536)):
+        p = network.NetworkPacket(dst_addr, message_S, pkt_id, 1, frag_offset)
+        pkt = p.encode(wire_format)
+        q = network.NetworkPacket.decode(pkt)
+        data_S = q.data_S if wire_format == 'text' else bytes(q.data_S).decode()
+        check((q.dst_addr, q.pkt_id, q.frag_flag, q.frag_offset) == (dst_addr, pkt_id, 1, frag_offset)
+              and data_S == message_S, '%s packet round trip' % wire_format)
+        check(network.NetworkPacket.peek_dst_addr(pkt) == dst_addr, '%s dst_addr peek' % wire_format)
+    for wire_format in ('text', 'binary'):
+        payload = message_S if wire_format == 'text' else message_S.encode()
+        p = network.NetworkPacket(3, payload, 42, 1, 18)
+        start = time.perf_counter()
+        for _ in range(packets):
+            pkt = p.encode(wire_format)
+        serialize = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(packets):
+            network.NetworkPacket.decode(pkt)
+        parse = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(packets):
+            network.NetworkPacket.peek_dst_addr(pkt)
+        peek = time.perf_counter() - start
+        print('wire_format %-6s: serialize %9.0f pkts/s, parse %9.0f pkts/s, peek dst_addr %9.0f pkts/s'
+              % (wire_format, packets / serialize, packets / parse, packets / peek))
+
+
+## fragmentation loop of Router.forward before it walked the payload by offset, kept as a baseline
+def fragment_by_reslicing(p, max_load, wire_format):
+    frag_L = []
+    frag_flag = 1
+    frag_offset = 0
+    buffer = p.data_S
+    while len(buffer) > 0:
+        if len(buffer) <= max_load:
+            frag_flag = 0
+        frag_pkt = network.NetworkPacket(p.dst_addr, buffer[:max_load], p.pkt_id, frag_flag, frag_offset)
+        frag_L.append(frag_pkt.encode(wire_format))
+        frag_offset += len(buffer[:max_load])
+        buffer = buffer[max_load:]
+    return frag_L
+
+
+## time to fragment a large payload by reslicing the remaining buffer vs walking it by offset, and to split
+# fragments again for a smaller mtu with and without parsing them
+# @param payload_length: payload size in bytes
+# @param mtu: mtu of the out interface
+# @param repeat: number of times each payload is fragmented
+@benchmark
+def bench_fragment(payload_length=64 * 1024, mtu=30, repeat=10):
+    # binary format, the 3 digit text offset field cannot address a 64 KB payload
+    wire_format = 'binary'
+    max_load = mtu - network.NetworkPacket.header_length_of(wire_format)
+    p = network.NetworkPacket(3, bytes(range(256)) * (payload_length // 256), 42)
+    frag_L = p.fragment(max_load, wire_format)
+    check(all(len(frag_S) <= mtu for frag_S in frag_L), 'fragments fit the mtu')
+    frag_L = [network.NetworkPacket.decode(frag_S) for frag_S in frag_L]
+    check([f.frag_offset for f in frag_L] == list(range(0, payload_length, max_load)), 'fragment offsets')
+    check([f.frag_flag for f in frag_L] == [1] * (len(frag_L) - 1) + [0], 'fragment flags')
+    check(b''.join(f.data_S for f in frag_L) == p.data_S, 'fragments carry the payload')
+    for name, fragment in (('reslicing', fragment_by_reslicing), ('offset', network.NetworkPacket.fragment)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fragment(p, max_load, wire_format)
+        elapsed = (time.perf_counter() - start) / repeat
+        print('fragment %d B at mtu %d by %-9s: %8.2f ms per packet, %9.0f fragments/s'
+              % (payload_length, mtu, name, 1000 * elapsed, len(frag_L) / elapsed))
+    # per hop work of a router splitting the fragments of an upstream 50 byte mtu for a 30 byte mtu, as router A of
+    # simulation_3 does, by parsing every fragment into a NetworkPacket vs splitting the encoded fragment
+    for wire_format in ('text', 'binary'):
+        header_length = network.NetworkPacket.header_length_of(wire_format)
+        payload = message_S * 10 if wire_format == 'binary' else message_S[:72]  # 3 digit text offsets
+        pkt_L = network.NetworkPacket(3, payload, 42).fragment(50 - header_length, wire_format)
+        for name in ('parsing', 'encoded'):
+            start = time.perf_counter()
+            for _ in range(repeat * 1000):
+                for pkt in pkt_L:
+                    if name == 'parsing':
+                        frag_L = network.NetworkPacket.decode(pkt).fragment(30 - header_length, wire_format)
+                    else:
+                        frag_L = network.NetworkPacket.fragment_encoded(pkt, 30 - header_length)
+            elapsed = time.perf_counter() - start
+            print('refragment %-6s mtu 50 -> 30 by %-7s: %9.0f fragments/s split'
+                  % (wire_format, name, repeat * 1000 * len(pkt_L) / elapsed))
+
+
+## Router.forward before the forwarding information base, routing every packet through the routing table and
+# the out interface list, kept as a baseline
+def forward_without_fib(router):
+    busy = False
+    for i in range(len(router.in_intf_L)):
+        pkt_L = router.in_intf_L[i].get_many(router.batch_size)
+        if not pkt_L:
+            continue
+        busy = True
+        router.rcv_pkt_count += len(pkt_L)
+        out_pkt_D = {}  # out interface num -> packets to enqueue on it
+        # make a forwarding decision for every packet of the batch
+        for pkt_S in pkt_L:
+            # lookup forwarding out interface num from the header only
+            fwd_out_intf = router.routing_table.get(network.NetworkPacket.peek_dst_addr(pkt_S))
+            if fwd_out_intf is None:
+                router.no_route_count += 1
+                log.warn("There is no forwarding information for such destination.")
+                continue
+            mtu = router.out_intf_L[fwd_out_intf].mtu  # single mtu lookup for the packet and all its fragments
+            # begin fragmentation if current packet exceeds the out interface mtu
+            if len(pkt_S) > mtu:
+                # calculate max load of data interface can handle
+                max_load = mtu - network.NetworkPacket.header_length_of(network.NetworkPacket.wire_format_of(pkt_S))
+                if max_load <= 0:
+                    router.mtu_drop_count += 1
+                    log.warn('%s: packet "%s" dropped, mtu %d too small for the header', router, pkt_S, mtu)
+                    continue
+                # split the encoded packet, which may be a fragment already, keeping its offset and flag
+                frag_L = network.NetworkPacket.fragment_encoded(pkt_S, max_load)
+                router.frag_pkt_count += 1
+                router.frag_count += len(frag_L)
+            # otherwise just forward packet as it came in
+            else:
+                frag_L = [pkt_S]
+            if log.enabled(log.TRACE):
+                for frag_S in frag_L:
+                    log.trace('%s: forwarding packet "%s" from interface %d to %d with mtu %d',
+                              router, frag_S, i, fwd_out_intf, mtu)
+            out_pkt_D.setdefault(fwd_out_intf, []).extend(frag_L)
+        # enqueue everything headed for the same out interface as one batch, dropping what does not fit
+        for fwd_out_intf, out_pkt_L in out_pkt_D.items():
+            sent = router.out_intf_L[fwd_out_intf].put_many(out_pkt_L, partial=True)
+            router.fwd_pkt_count += sent
+            router.drop_pkt_count += len(out_pkt_L) - sent
+            for pkt_S in out_pkt_L[sent:]:
+                log.warn('%s: packet "%s" lost on interface %d', router, pkt_S, i)
+    return busy
+
+
+## packets/s through Router.forward with the forwarding information base vs forward_without_fib, for a dict and a
+# longest prefix match routing table, with packets that fit the out mtu and packets that are fragmented
+# @param packets: packets forwarded per case
+# @param intf_count: interfaces of the router, each with routes to dst_count / intf_count destinations
+# @param dst_count: destinations in the routing table
+# @param batch_size: packets taken off the in interface per forward call
+@benchmark
+def bench_fib(packets=200000, intf_count=8, dst_count=1024, batch_size=32):
+    rng = random.Random(1)
+    route_D = {dst_addr: dst_addr % intf_count for dst_addr in range(1, dst_count + 1)}
+    for table_name in ('dict', 'longest prefix'):
+        for pkt_name, length in (('fit', 39), ('fragmented', 100)):
+            pkt_L = [network.NetworkPacket(rng.randrange(1, dst_count + 1), traffic.payload(length, 'binary'), 1)
+                     .to_byte_B() for _ in range(batch_size)]
+            rate_D = {}
+            for name, forward in (('without fib', forward_without_fib), ('fib', network.Router.forward)):
+                table = dict(route_D) if table_name == 'dict' else routing.RoutingTable(route_D)
+                router = network.Router('A', intf_count, 0, table)
+                router.batch_size = batch_size
+                for intf in router.out_intf_L:
+                    intf.mtu = 50
+                in_intf = router.in_intf_L[0]
+                with quiet():
+                    start = time.perf_counter()
+                    for _ in range(packets // batch_size):
+                        in_intf.put_many(pkt_L)
+                        forward(router)
+                        for intf in router.out_intf_L:
+                            intf.get_many(1 << 20)
+                    rate_D[name] = router.rcv_pkt_count / (time.perf_counter() - start)
+            print('fib %-14s table, %-10s packets: %8.0f pkts/s without fib, %8.0f pkts/s with fib (%.2fx)'
+                  % (table_name, pkt_name, rate_D['without fib'], rate_D['fib'], rate_D['fib'] / rate_D['without fib']))
+
+
+## build time and lookup rate of a longest prefix match table with many routes, next to exact match in a dict
+# @param routes: number of prefix routes
+# @param lookups: number of destination lookups
+@benchmark
+def bench_routing(routes=100000, lookups=200000):
+    rng = random.Random(1)
+    start = time.perf_counter()
+    routing_table = routing.RoutingTable(addr_bits=32)
+    routing_table.set_default(0)
+    for i in range(routes):
+        prefix_len = rng.randint(8, 32)
+        routing_table.add_route(rng.getrandbits(32), prefix_len, i % 64)
+    build = time.perf_counter() - start
+    route_D = {rng.getrandbits(32): i % 64 for i in range(routes)}
+    for name, table in (('dict exact', route_D), ('longest prefix', routing_table)):
+        addr_L = rng.sample(list(route_D), min(lookups, len(route_D))) if table is route_D else \
+            [rng.getrandbits(32) for _ in range(lookups)]
+        start = time.perf_counter()
+        for addr in addr_L:
+            table.get(addr)
+        elapsed = time.perf_counter() - start
+        print('routing %-14s: %d routes, %9.0f lookups/s' % (name, len(table), len(addr_L) / elapsed))
+    print('routing longest prefix: built in %.2f s over %d prefix lengths' % (build, len(routing_table.length_L)))
+
+
+## packets/sec on the simulation_3 topology under saturating load for several router and link batch sizes
+# @param messages: number of messages sent by each client, all of them enqueued at once
+@benchmark
+def bench_batch(messages=2000, batch_size_L=(1, 8, 32)):
+    base_pps = None
+    for batch_size in batch_size_L:
+        host_L, router_L, link_layer = simulation_3.build_network()
+        object_L = host_L + router_L + [link_layer]
+        for o in router_L + [link_layer]:
+            o.batch_size = batch_size
+        with quiet():
+            thread_L = start_threads(object_L)
+            start = time.perf_counter()
+            received = run_simulation_3_load(host_L, messages)
+            wall = time.perf_counter() - start
+            stop_threads(object_L, thread_L)
+        pps = received / wall
+        base_pps = base_pps or pps
+        print('batch_size %3d: %8.0f pkts/s (x%.2f)' % (batch_size, pps, pps / base_pps))
+
+
+## topology of chain_count independent chains of client -> chain_length routers -> server
+# client c has address 2c + 1 and sends to server c with address 2c + 2
+def chain_topology(chain_count, chain_length, mtu=50):
+    topo = topology.Topology()
+    for c in range(chain_count):
+        client = topo.add_host(2 * c + 1, 'binary')
+        server = topo.add_host(2 * c + 2, 'binary')
+        key_L = [client] + [topo.add_router('%d.%d' % (c, r), 1, {2 * c + 2: 0}) for r in range(chain_length)]
+        key_L.append(server)
+        for from_key, to_key in zip(key_L, key_L[1:]):
+            topo.add_link(from_key, 0, to_key, 0, mtu)
+    return topo
+
+
+## build the objects of chain_topology, sharing one link layer
+# @return client_L, server_L, router_L, link_layer
+def build_chains(chain_count, chain_length, mtu=50):
+    node_D, link_layer = chain_topology(chain_count, chain_length, mtu).build()
+    client_L = [node_D['Host_%d' % (2 * c + 1)] for c in range(chain_count)]
+    server_L = [node_D['Host_%d' % (2 * c + 2)] for c in range(chain_count)]
+    router_L = [o for o in node_D.values() if isinstance(o, network.Router)]
+    return client_L, server_L, router_L, link_layer
+
+
+## child process of bench_scaling and bench_pool, runs one topology size on one runtime
+# @param runtime_args: arguments of the runtime's constructor
+def _run_scaling(runtime, chain_count, chain_length, messages, result_q, runtime_args=()):
+    client_L, server_L, router_L, link_layer = build_chains(chain_count, chain_length)
+    object_L = client_L + server_L + router_L + [link_layer]
+    sim = runtimes.runtime_D[runtime](*runtime_args)
+    with quiet():
+        start = time.perf_counter()
+        sim.start(object_L)
+        for _ in range(messages):
+            for client, server in zip(client_L, server_L):
+                client.udt_send(server.addr, message_S)
+        expected = 2 * messages * chain_count  # message_S takes two packets at a 50 byte MTU
+        deadline = start + 120
+        while sum(s.rcv_pkt_count for s in server_L) < expected and time.perf_counter() < deadline:
+            sim.wait(0.01)
+        wall = time.perf_counter() - start
+        received = sum(s.rcv_pkt_count for s in server_L)
+        sim.stop()
+    result_q.put((received / wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+## node count vs peak memory and throughput of the thread per object and asyncio runtimes
+# @param chain_count_L: numbers of client -> routers -> server chains to simulate
+# @param chain_length: routers per chain
+# @param messages: messages sent by every client
+# @param max_threads: largest node count run with a thread per object
+@benchmark
+def bench_scaling(chain_count_L=(10, 100, 400, 1000, 2000), chain_length=3, messages=5, max_threads=2000):
+    ctx = multiprocessing.get_context('fork')  # fresh process per run, so peak memory is per run
+    for chain_count in chain_count_L:
+        node_count = chain_count * (chain_length + 2)
+        for runtime in ('threads', 'asyncio'):
+            if runtime == 'threads' and node_count > max_threads:
+                continue
+            result_q = ctx.Queue()
+            proc = ctx.Process(target=_run_scaling, args=(runtime, chain_count, chain_length, messages, result_q))
+            proc.start()
+            pps, max_rss = result_q.get()
+            proc.join()
+            print('scaling %-7s %6d nodes: %8.0f pkts/s, peak rss %7.1f MB' % (runtime, node_count, pps, max_rss))
+
+
+## thread per object vs a fixed pool of workers stepping only the nodes with pending input, on about 1k nodes
+# Every runtime runs in a forked child, so peak memory is per runtime.
+# @param chain_count: number of client -> routers -> server chains, chain_length + 2 nodes each
+# @param chain_length: routers per chain
+# @param messages: messages sent by every client
+# @param workers_L: worker counts of runtimes.PoolRuntime
+@benchmark
+def bench_pool(chain_count=200, chain_length=3, messages=20, workers_L=(1, 2, 4, 8)):
+    ctx = multiprocessing.get_context('fork')
+    node_count = chain_count * (chain_length + 2)
+    for runtime, args in [('threads', ())] + [('pool', (workers,)) for workers in workers_L]:
+        result_q = ctx.Queue()
+        proc = ctx.Process(target=_run_scaling, args=(runtime, chain_count, chain_length, messages, result_q, args))
+        proc.start()
+        pps, max_rss = result_q.get()
+        proc.join()
+        name = runtime if not args else 'pool/%d' % args[0]
+        print('pool %-8s %5d nodes: %8.0f pkts/s, peak rss %7.1f MB' % (name, node_count, pps, max_rss))
+
+
+## packets/sec vs number of worker processes of a partitioned simulation
+# @param chain_count: number of client -> routers -> server chains
+# @param chain_length: routers per chain
+# @param messages: messages sent by every client
+# @param part_count_L: worker process counts, by default 1, 2, 4 and the number of cores
+@benchmark
+def bench_sharding(chain_count=64, chain_length=6, messages=100, part_count_L=None):
+    part_count_L = part_count_L or sorted({1, 2, 4, os.cpu_count()})
+    topo = chain_topology(chain_count, chain_length)
+    send_L = [(2 * c + 1, 2 * c + 2, message_S) for _ in range(messages) for c in range(chain_count)]
+    expected = 2 * len(send_L)  # message_S takes two packets at a 50 byte MTU
+    print('sharding on %d cores' % os.cpu_count())
+    for part_count in part_count_L:
+        sim = sharding.ShardedRuntime(topo, part_count)
+        with quiet():
+            start = time.perf_counter()
+            sim.start(send_L)
+            sim.wait(120, expected)
+            wall = time.perf_counter() - start
+            received = sim.received()
+            sim.stop()
+        print('sharding %2d processes: %3d links between partitions, %8.0f pkts/s'
+              % (part_count, sim.cut_count(), received / wall))
+
+
+## put/get pairs per second of the locked deque of Interface vs the lock-free RingInterface
+# @param pairs: number of put/get pairs
+@benchmark
+def bench_ring(pairs=200000):
+    for intf_class in (network.Interface, network.RingInterface):
+        # one thread putting and getting in turn
+        intf = intf_class(1024)
+        start = time.perf_counter()
+        for _ in range(pairs):
+            intf.put(message_S)
+            intf.get()
+        same_thread = pairs / (time.perf_counter() - start)
+        # a producer and a consumer thread
+        intf = intf_class(1024)
+
+        def produce():
+            for _ in range(pairs):
+                intf.put(message_S, True)
+
+        producer = threading.Thread(target=produce)
+        start = time.perf_counter()
+        producer.start()
+        for _ in range(pairs):
+            intf.get(True)
+        producer.join()
+        two_threads = pairs / (time.perf_counter() - start)
+        print('%-13s: %9.0f put/get pairs/s in one thread, %9.0f pkts/s from a producer to a consumer thread'
+              % (intf_class.__name__, same_thread, two_threads))
+
+
+## packets/sec of the threaded runtime with the link layer sweeping all links vs transmit worker pools
+# @param chain_count: number of client -> routers -> server chains
+# @param chain_length: routers per chain
+# @param messages: messages sent by every client
+@benchmark
+def bench_link_workers(chain_count=50, chain_length=3, messages=20, workers_L=(0, 1, 4, 16)):
+    for workers in workers_L:
+        client_L, server_L, router_L, link_layer = build_chains(chain_count, chain_length)
+        link_layer.workers = workers
+        object_L = client_L + server_L + router_L + [link_layer]
+        expected = 2 * messages * chain_count  # message_S takes two packets at a 50 byte MTU
+        with quiet():
+            thread_L = start_threads(object_L)
+            start = time.perf_counter()
+            for _ in range(messages):
+                for client, server in zip(client_L, server_L):
+                    client.udt_send(server.addr, message_S)
+            deadline = start + 120
+            while sum(s.rcv_pkt_count for s in server_L) < expected and time.perf_counter() < deadline:
+                time.sleep(0.001)
+            wall = time.perf_counter() - start
+            received = sum(s.rcv_pkt_count for s in server_L)
+            stop_threads(object_L, thread_L)
+        print('link workers %2d: %4d links, %8.0f pkts/s' % (workers, len(link_layer.link_L), received / wall))
+
+
+## packets/sec on the simulation_3 topology with per packet tracing written to /dev/null, as JSON lines, or off
+# @param messages: number of messages sent by each client
+@benchmark
+def bench_logging(messages=500):
+    with open(os.devnull, 'w') as devnull:
+        for name, level, json_output in (('trace', log.TRACE, False), ('trace json', log.TRACE, True),
+                                         ('warn', log.WARN, False)):
+            host_L, router_L, link_layer = simulation_3.build_network()
+            object_L = host_L + router_L + [link_layer]
+            saved = log.level, log.json_output, log.stream
+            log.level, log.json_output, log.stream = level, json_output, devnull
+            try:
+                thread_L = start_threads(object_L)
+                start = time.perf_counter()
+                received = run_simulation_3_load(host_L, messages)
+                wall = time.perf_counter() - start
+                stop_threads(object_L, thread_L)
+                log.flush()
+            finally:
+                log.level, log.json_output, log.stream = saved
+            print('logging %-10s: %8.0f pkts/s' % (name, received / wall))
+
+
+## stress Host reassembly with shuffled, duplicated and lost fragments
+# @param packets: number of packets reassembled
+# @param window: number of packets whose fragments are shuffled together
+# @param max_load: fragment payload size
+@benchmark
+def bench_reassembly(packets=1000000, window=64, max_load=21):
+    rng = random.Random(1)
+    payload_B = (message_S * 4).encode()
+    bound_L = [(offset, int(offset + max_load < len(payload_B)))
+               for offset in range(0, len(payload_B), max_load)]
+    clock = [0.0]
+    reassembler = network.Reassembler(timeout=1.0, max_bytes=window * 4096, clock=lambda: clock[0])
+    completed = lost = peak_bytes = 0
+    start = time.perf_counter()
+    for first_id in range(0, packets, window):
+        frag_L = []
+        for pkt_id in range(first_id, min(first_id + window, packets)):
+            if pkt_id % 1000 == 999:
+                lost += 1  # drop one fragment, so the packet can only expire
+                frag_L.extend((pkt_id, offset, flag) for offset, flag in bound_L[1:])
+                continue
+            frag_L.extend((pkt_id, offset, flag) for offset, flag in bound_L)
+        frag_L.extend(rng.sample(frag_L, len(frag_L) // 10))  # 10% duplicates
+        rng.shuffle(frag_L)
+        for pkt_id, offset, flag in frag_L:
+            data_B = reassembler.add(pkt_id, offset, flag, payload_B[offset:offset + max_load])
+            if data_B is not None:
+                check(data_B == payload_B, 'reassembled payload of packet %d' % pkt_id)
+                completed += 1
+        peak_bytes = max(peak_bytes, reassembler.buffered_bytes)
+        clock[0] += 0.1
+    elapsed = time.perf_counter() - start
+    # duplicates arriving after their packet completed open partial packets of their own, which expire as well
+    check(completed == packets - lost, '%d packets reassembled, %d expected' % (completed, packets - lost))
+    print('reassembly: %d packets of %d fragments in %.1f s, %8.0f fragments/s, %d expired, %d evicted, '
+          'peak %d KB buffered' % (packets, len(bound_L), elapsed, packets * len(bound_L) * 1.1 / elapsed,
+                                   reassembler.expired_count, reassembler.evicted_count, peak_bytes // 1024))
+
+
+## time to generate, route and build the objects of networks of about 10k nodes
+@benchmark
+def bench_topology():
+    for name, generate in (('fat_tree k=32', lambda: topology.fat_tree_topology(32)),
+                           ('grid 70x70', lambda: topology.grid_topology(70, 70)),
+                           ('random 5000+5000', lambda: topology.random_topology(5000, 5000, seed=1))):
+        start = time.perf_counter()
+        topo = generate()
+        routed = time.perf_counter()
+        node_D, link_layer = topo.build()
+        built = time.perf_counter()
+        route_count = sum(len(table) for _, _, _, table in topo.router_D.values())
+        print('topology %-16s: %5d nodes, %8d routes, generated and routed in %5.2f s, built in %5.2f s'
+              % (name, len(node_D), route_count, routed - start, built - routed))
+
+
+## messages/sec and router fragmentation on the simulation_3 topology with packets sized by the first hop MTU vs
+# the path MTU (Host.path_mtu_discovery)
+# @param messages: number of messages sent by each client, all of them enqueued at once
+@benchmark
+def bench_path_mtu(messages=2000):
+    for path_mtu_discovery in (False, True):
+        host_L, router_L, link_layer = simulation_3.build_network()
+        object_L = host_L + router_L + [link_layer]
+        client_1, client_2, server_1, server_2 = host_L
+        with quiet():
+            thread_L = start_threads(object_L)
+            start, cpu_start = time.perf_counter(), time.process_time()
+            for _ in range(messages):
+                for client, dst in ((client_1, 3), (client_2, 4)):
+                    client.path_mtu_discovery = path_mtu_discovery
+                    client.udt_send(dst, message_S)
+            expected = client_1.snd_pkt_count + client_2.snd_pkt_count
+            deadline = start + 120
+            while server_1.rcv_pkt_count + server_2.rcv_pkt_count < expected and time.perf_counter() < deadline:
+                time.sleep(0.001)
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+            stop_threads(object_L, thread_L)
+        print('path mtu %-3s: %d packets per message, %6d fragments made by routers, %7.0f messages/s, '
+              '%.2f s cpu' % ('on' if path_mtu_discovery else 'off', expected // (2 * messages),
+                              sum(r.frag_count for r in router_L), 2 * messages / wall, cpu))
+
+
+## goodput over the 30 byte MTU links of simulation_3 with bandwidth limited links, on the event runtime's virtual
+# clock, with host packets sized by the first hop MTU (fragmented by router A) vs the path MTU
+# @param messages: number of messages sent by each client
+# @param bandwidth: bytes/s of every link
+# @param delay: seconds every packet takes to cross a link
+@benchmark
+def bench_shaping(messages=500, bandwidth=10000, delay=0.005):
+    saved = simulation_3.wire_format, simulation_3.link_bandwidth, simulation_3.link_delay
+    simulation_3.wire_format, simulation_3.link_bandwidth, simulation_3.link_delay = 'binary', bandwidth, delay
+    try:
+        for path_mtu_discovery in (False, True):
+            host_L, router_L, link_layer = simulation_3.build_network()
+            sim = runtimes.EventRuntime()
+            payload = [0, 0.0]  # bytes delivered, virtual time of the last delivery
+            def deliver(data_B):
+                payload[0] += len(data_B)
+                payload[1] = sim.now
+            for h in host_L:
+                h.deliver = deliver
+                h.path_mtu_discovery = path_mtu_discovery
+            with quiet():
+                sim.start(host_L + router_L + [link_layer])
+                for _ in range(messages):
+                    host_L[0].udt_send(3, message_S)
+                    host_L[1].udt_send(4, message_S)
+                sim.wait()
+                sim.stop()
+            # the two flows share no link, so each gets the full bandwidth
+            goodput = payload[0] / 2 / payload[1]
+            print('shaping path mtu %-3s: %6.0f payload bytes/s per flow, %5.1f%% of the link bandwidth'
+                  % ('on' if path_mtu_discovery else 'off', goodput, 100 * goodput / bandwidth))
+    finally:
+        simulation_3.wire_format, simulation_3.link_bandwidth, simulation_3.link_delay = saved
+
+
+## queueing delay, utilization and loss synchronization at a bottleneck shared by senders that halve their burst
+# after a loss and grow it by one packet otherwise (as TCP does per round trip), with tail drop vs RED, CoDel and
+# strict priority on the router's out interface, on the event runtime's virtual clock
+# @param senders: number of hosts sending through the bottleneck
+# @param periods: bursts sent by each host
+# @param period: seconds between the bursts of a host, about a round trip time
+# @param bandwidth: bytes/s of the bottleneck link
+@benchmark
+def bench_qdisc(senders=4, periods=300, period=0.1, bandwidth=40000):
+    server_addr = senders + 1
+    payload_start = network.NetworkPacket.header_length_B  # the sender number follows the time stamp
+    for name, make_qdisc in (('tail drop', lambda: qdisc.FIFO(limit=100)),
+                             ('RED', lambda: qdisc.RED(min_th=10, max_th=60, weight=0.02, limit=100, seed=1)),
+                             ('CoDel', lambda: qdisc.CoDel(limit=100)),
+                             ('priority', lambda: qdisc.StrictPriority(
+                                 [qdisc.FIFO(limit=100), qdisc.FIFO(limit=100)],
+                                 lambda pkt: 0 if pkt[payload_start + 21:payload_start + 23] == b'00' else 1))):
+        host_L = [network.Host(addr, 'binary') for addr in range(1, senders + 1)]
+        server = network.Host(server_addr, 'binary')
+        router = network.Router('Q', senders, 0, {server_addr: 0})
+        link_layer = link_3.LinkLayer()
+        for i, h in enumerate(host_L):
+            link_layer.add_link(link_3.Link(h, 0, router, i, 50))
+        qdisc.attach(router, 0, make_qdisc())
+        link_layer.add_link(link_3.Link(router, 0, server, 0, 50, bandwidth))
+        sim = runtimes.EventRuntime()
+        latency_L_L = [[] for _ in host_L]
+        sent_D, received_D = {}, {}  # (sender, period) -> packets
+        def deliver(data_B):
+            stamp_S, sender_S, period_S = data_B.decode().split()
+            latency_L_L[int(sender_S)].append(sim.now - float(stamp_S))
+            key = int(sender_S), int(period_S)
+            received_D[key] = received_D.get(key, 0) + 1
+        server.deliver = deliver
+        window_L = [1] * senders
+        def send(sender, p):
+            # packets of two periods ago have arrived or are lost by now
+            if p >= 2:
+                lost = sent_D[sender, p - 2] > received_D.get((sender, p - 2), 0)
+                window_L[sender] = max(1, window_L[sender] // 2) if lost else window_L[sender] + 1
+            sent_D[sender, p] = window_L[sender]
+            for _ in range(window_L[sender]):
+                host_L[sender].udt_send(server_addr, '%020.9f %02d %04d' % (sim.now, sender, p))
+        rng = random.Random(1)
+        for sender in range(senders):
+            phase = rng.uniform(0, period)
+            for p in range(periods):
+                sim.schedule(phase + p * period, lambda sender=sender, p=p: send(sender, p))
+        with quiet():
+            sim.start(host_L + [server, router, link_layer])
+            sim.wait()
+            sim.stop()
+        loss_L = [[sent_D[s, p] > received_D.get((s, p), 0) for s in range(senders)] for p in range(periods)]
+        loss_periods = sum(any(l) for l in loss_L)
+        all_L = sorted(sum(latency_L_L, []))
+        line = ('qdisc %-9s: delay p50 %5.1f ms p99 %5.1f ms, %5.1f%% utilization, %4.1f%% lost, all senders lose in '
+                '%3d%% of loss periods, drops %s'
+                % (name, 1000 * percentile(all_L, 0.5), 1000 * percentile(all_L, 0.99),
+                   100 * len(all_L) * (payload_start + 28) / bandwidth / sim.now,
+                   100 * (1 - len(all_L) / sum(sent_D.values())), 100 * sum(all(l) for l in loss_L) // max(1, loss_periods),
+                   router.queue_drop_counts()))
+        if name == 'priority':
+            line += ', sender 0 delay p99 %.1f ms' % (1000 * percentile(sorted(latency_L_L[0]), 0.99))
+        print(line)
+
+
+## packets/sec enqueued by Host.udt_send vs udt_send_many, messages/sec of the traffic generator on its own, and
+# delivered packets/sec of Poisson, CBR and on/off many-to-many traffic on a grid on the event runtime
+# @param messages: messages enqueued per send method
+# @param side: routers per side of the grid
+# @param duration: seconds of generated traffic on the grid
+@benchmark
+def bench_traffic(messages=200000, side=6, duration=1.0):
+    data_B = traffic.payload(39, 'binary')  # one packet at a 50 byte MTU
+    for name in ('udt_send', 'udt_send_many'):
+        host = network.Host(1, 'binary')
+        host.out_intf_L[0].mtu = 50
+        with quiet():
+            start = time.perf_counter()
+            if name == 'udt_send':
+                for _ in range(messages):
+                    host.udt_send(2, data_B)
+            else:
+                for _ in range(messages // 1000):
+                    host.udt_send_many([(2, data_B)] * 1000)
+            wall = time.perf_counter() - start
+        print('traffic %-13s: %8.0f pkts/s enqueued' % (name, host.snd_pkt_count / wall))
+    host_L = [network.Host(addr, 'binary') for addr in range(1, 101)]
+    for h in host_L:
+        h.out_intf_L[0].mtu = 50
+    generator = traffic.TrafficGenerator(traffic.many_to_many(host_L, lambda: traffic.Poisson(100), 39, 'all'), 1.0)
+    with quiet():
+        start = time.perf_counter()
+        generator.send_due(1.0)
+        wall = time.perf_counter() - start
+    print('traffic generator    : %8.0f msgs/s generated by %d Poisson flows'
+          % (generator.sent_msg_count / wall, len(generator.flow_L)))
+    for name, make_process in (('CBR', lambda: traffic.CBR(200)), ('Poisson', lambda: traffic.Poisson(200)),
+                               ('on/off', lambda: traffic.OnOff(400, 0.05, 0.05))):
+        node_D, link_layer = topology.grid_topology(side, side).build()
+        host_L = [o for o in node_D.values() if isinstance(o, network.Host)]
+        generator = traffic.TrafficGenerator(traffic.many_to_many(host_L, make_process, 39, 'permutation', seed=1),
+                                             duration)
+        sim = runtimes.EventRuntime()
+        with quiet():
+            start = time.perf_counter()
+            sim.start(list(node_D.values()) + [link_layer])
+            generator.schedule(sim)
+            sim.wait()
+            wall = time.perf_counter() - start
+            sim.stop()
+        received = sum(h.rcv_pkt_count for h in host_L)
+        print('traffic %-7s grid %dx%d: %6d of %6d packets delivered, %7.0f pkts/s'
+              % (name, side, side, received, generator.sent_pkt_count, received / wall))
+
+
+## packets/s through an Interface put and a Link tx_pkt with and without capture, and packets/s read back
+# @param packets: number of packets put and transmitted
+# @param batch_size: packets per put_many and tx_pkt call, half of them to each of two destinations
+@benchmark
+def bench_capture(packets=200000, batch_size=32):
+    data_B = traffic.payload(39, 'binary')
+    pkt_L = [network.NetworkPacket(dst_addr, data_B, 1).to_byte_B() for dst_addr in (2, 3)] * (batch_size // 2)
+    with tempfile.TemporaryDirectory() as dir_S:
+        for captured in (False, True):
+            host = network.Host(1, 'binary')
+            router = network.Router('A', 1, 0, {})
+            link = link_3.Link(host, 0, router, 0, 50)
+            if captured:
+                intf_capture = capture.attach(host.out_intf_L[0], os.path.join(dir_S, 'intf.pcap'))
+                link_capture = capture.attach(link, os.path.join(dir_S, 'link.pcap'))
+            with quiet():
+                start = time.perf_counter()
+                for _ in range(packets // batch_size):
+                    host.out_intf_L[0].put_many(pkt_L)
+                    link.tx_pkt(batch_size)
+                    router.in_intf_L[0].get_many(batch_size)
+                wall = time.perf_counter() - start
+            print('capture %-3s: %8.0f pkts/s put and transmitted%s' % ('on' if captured else 'off', link.tx_pkt_count / wall,
+                  ', captured on the interface and the link' if captured else ''))
+        start = time.perf_counter()
+        intf_capture.close()
+        link_capture.close()
+        close_wall = time.perf_counter() - start
+        start = time.perf_counter()
+        count = sum(1 for _ in capture.read(os.path.join(dir_S, 'link.pcap')))
+        read_wall = time.perf_counter() - start
+        start = time.perf_counter()
+        matched = sum(1 for _ in capture.read(os.path.join(dir_S, 'link.pcap'), dst_addr=3))
+        filter_wall = time.perf_counter() - start
+        print('capture files: %.2f s to write both, %8.0f pkts/s read, %8.0f pkts/s filtered by dst_addr (%d matched)'
+              % (close_wall, count / read_wall, count / filter_wall, matched))
+
+
+## child process of bench_replay, replays a trace into hosts whose out interfaces are drained as it goes
+def _run_replay(path, host_count, window, result_q):
+    host_L = [network.Host(addr, 'binary') for addr in range(1, host_count + 1)]
+    for h in host_L:
+        h.out_intf_L[0].mtu = 50
+    replayer = replay.Replay(path, host_L, window=window)
+    with quiet():
+        start = time.perf_counter()
+        elapsed = 0
+        while replayer.send_due(elapsed):
+            elapsed += 0.01
+            for h in host_L:
+                h.out_intf_L[0].get_many(1 << 20)
+        wall = time.perf_counter() - start
+    result_q.put((replayer.sent_msg_count / wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+## records/s and peak memory replaying binary traces of growing size, to show memory does not grow with the trace
+# @param record_count_L: numbers of records of the traces
+# @param host_count: hosts sending the records
+# @param window: bytes of the trace mapped at a time
+@benchmark
+def bench_replay(record_count_L=(100000, 500000, 2000000), host_count=100, window=4 << 20):
+    ctx = multiprocessing.get_context('fork')  # fresh process per run, so peak memory is per run
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as dir_S:
+        for record_count in record_count_L:
+            path = os.path.join(dir_S, 'trace.bin')
+            with replay.TraceWriter(path) as writer:
+                for n in range(record_count):
+                    # 1000 records/s, a third of them with recorded payload bytes
+                    payload = rng.randrange(1, 40) if n % 3 else message_S[:rng.randrange(1, 40)]
+                    writer.write(n / 1000, rng.randrange(1, host_count + 1), rng.randrange(1, host_count + 1), payload)
+            result_q = ctx.Queue()
+            proc = ctx.Process(target=_run_replay, args=(path, host_count, window, result_q))
+            proc.start()
+            rate, max_rss = result_q.get()
+            proc.join()
+            print('replay %8d records (%6.1f MB trace): %7.0f records/s, peak rss %6.1f MB'
+                  % (record_count, os.path.getsize(path) / (1 << 20), rate, max_rss))
+
+
+## wall time of the simulation_3 workload waiting out simulation_time vs stopping on quiescence, and whether every
+# packet was delivered when it stopped
+# @param simulation_time: seconds the fixed wait lasts, and the upper bound of the quiescence wait
+# @param messages: messages sent by each client
+@benchmark
+def bench_quiescence(simulation_time=5, messages=100):
+    for runtime in ('threads', 'asyncio'):
+        for stop_when_quiescent in (False, True):
+            host_L, router_L, link_layer = simulation_3.build_network()
+            object_L = host_L + router_L + [link_layer]
+            client_1, client_2, server_1, server_2 = host_L
+            sim = runtimes.runtime_D[runtime]()
+            with quiet():
+                start = time.perf_counter()
+                sim.start(object_L)
+                for _ in range(messages):
+                    client_1.udt_send(3, message_S)
+                    client_2.udt_send(4, message_S)
+                detector = quiescence.QuiescenceDetector(object_L)
+                sim.wait(simulation_time, detector.idle if stop_when_quiescent else None)
+                waited = time.perf_counter() - start
+                sim.stop()
+                wall = time.perf_counter() - start
+            print('quiescence %-7s %-16s: %6.3f s waited, %6.3f s with stop, %d of %d packets delivered'
+                  % (runtime, 'stop when quiet' if stop_when_quiescent else 'fixed wait', waited, wall,
+                     server_1.rcv_frag_count + server_2.rcv_frag_count,
+                     sum(r.fwd_pkt_count for r in router_L if r.name == 'D')))
+
+
+## topologies of the simulation scripts and parametric synthetic networks, for bench_suite
+# each builder returns host_L, router_L, link_layer and the flows as (source Host, destination address)
+
+## client -> router A -> server of simulation_1 (mtu 50) and simulation_2 (mtu 30 after the router)
+def build_simulation_1_2(out_mtu):
+    topo = topology.Topology()
+    client = topo.add_host(1, 'binary')
+    server = topo.add_host(2, 'binary')
+    router = topo.add_router('A', 1, {2: 0})
+    topo.add_link(client, 0, router, 0, 50)
+    topo.add_link(router, 0, server, 0, out_mtu)
+    node_D, link_layer = topo.build()
+    return [node_D[client], node_D[server]], [node_D[router]], link_layer, [(node_D[client], 2)]
+
+
+## the four hosts and routers A-D of simulation_3
+def build_simulation_3():
+    simulation_3.wire_format = 'binary'  # as the other topologies of the suite
+    host_L, router_L, link_layer = simulation_3.build_network()
+    return host_L, router_L, link_layer, [(host_L[0], 3), (host_L[1], 4)]
+
+
+## @return host_L, router_L, link_layer of topo, with the hosts in address order
+def _build(topo):
+    node_D, link_layer = topo.build()
+    host_L = sorted((o for o in node_D.values() if isinstance(o, network.Host)), key=lambda h: h.addr)
+    router_L = [o for o in node_D.values() if isinstance(o, network.Router)]
+    return host_L, router_L, link_layer
+
+
+## host 1 - router_count routers in a line - host 2, both hosts send to each other
+# interface 0 of every router faces host 1, interface 1 faces host 2
+def build_line(router_count, mtu=50):
+    topo = topology.Topology()
+    key_L = [topo.add_host(1, 'binary')]
+    key_L += [topo.add_router('L%d' % r, 2, {1: 0, 2: 1}) for r in range(router_count)]
+    key_L.append(topo.add_host(2, 'binary'))
+    for i, (left, right) in enumerate(zip(key_L, key_L[1:])):
+        topo.add_link(left, 0 if i == 0 else 1, right, 0, mtu)
+        topo.add_link(right, 0, left, 0 if i == 0 else 1, mtu)
+    host_L, router_L, link_layer = _build(topo)
+    return host_L, router_L, link_layer, [(host_L[0], 2), (host_L[1], 1)]
+
+
+## complete tree of routers with a host below every leaf router, every host sends to the host half way around
+# interface 0 of a router faces its parent, interfaces 1..fanout its children (or the host of a leaf)
+def build_tree(depth, fanout=2, mtu=50):
+    topo = topology.Topology()
+    host_count = fanout ** (depth - 1)
+    leaf_size = 1  # hosts below a router of the current level
+    level_L = []  # (router key, first host address below it) of the level built last
+    for level in range(depth - 1, -1, -1):
+        key_L = []
+        for r in range(fanout ** level):
+            low = r * leaf_size * fanout + 1 if level < depth - 1 else r + 1
+            table = routing.RoutingTable()
+            if level > 0:
+                table.set_default(0)
+            if level == depth - 1:
+                table[low] = 1
+            else:
+                for c in range(fanout):
+                    child_low = low + c * leaf_size
+                    table.add_range(child_low, child_low + leaf_size - 1, c + 1)
+            key = topo.add_router('T%d.%d' % (level, r), fanout + 1, table)
+            if level == depth - 1:
+                host = topo.add_host(low, 'binary')
+                topo.add_link(host, 0, key, 1, mtu)
+                topo.add_link(key, 1, host, 0, mtu)
+            else:
+                for c in range(fanout):
+                    child = level_L[r * fanout + c][0]
+                    topo.add_link(child, 0, key, c + 1, mtu)
+                    topo.add_link(key, c + 1, child, 0, mtu)
+            key_L.append((key, low))
+        if level < depth - 1:
+            leaf_size *= fanout
+        level_L = key_L
+    host_L, router_L, link_layer = _build(topo)
+    return host_L, router_L, link_layer, [(h, (h.addr - 1 + host_count // 2) % host_count + 1) for h in host_L]
+
+
+## side x side grid of routers with a host on every router, routed X first then Y
+# every host sends to the host at the mirrored position
+# interfaces 0-3 of a router face north, south, west and east, interface 4 its host
+def build_mesh(side, mtu=50):
+    topo = topology.Topology()
+    def addr(x, y):
+        return y * side + x + 1
+    key_D = {}
+    for y in range(side):
+        for x in range(side):
+            table = {}
+            for dy in range(side):
+                for dx in range(side):
+                    table[addr(dx, dy)] = 3 if dx > x else 2 if dx < x else 1 if dy > y else 0 if dy < y else 4
+            key_D[x, y] = topo.add_router('M%d.%d' % (x, y), 5, table)
+            host = topo.add_host(addr(x, y), 'binary')
+            topo.add_link(host, 0, key_D[x, y], 4, mtu)
+            topo.add_link(key_D[x, y], 4, host, 0, mtu)
+    for (x, y), key in key_D.items():
+        for intf, neighbor in ((0, (x, y - 1)), (1, (x, y + 1)), (2, (x - 1, y)), (3, (x + 1, y))):
+            if neighbor in key_D:
+                topo.add_link(key, intf, key_D[neighbor], intf ^ 1, mtu)  # the neighbor sees us from the opposite side
+    host_L, router_L, link_layer = _build(topo)
+    return host_L, router_L, link_layer, [(h, addr(side - 1 - (h.addr - 1) % side, side - 1 - (h.addr - 1) // side))
+                                          for h in host_L]
+
+
+## workloads of bench_suite: name -> (builder, arguments)
+suite_D = {
+    'simulation_1': (build_simulation_1_2, (50,)),
+    'simulation_2': (build_simulation_1_2, (30,)),
+    'simulation_3': (build_simulation_3, ()),
+    'line_200': (build_line, (200,)),
+    'tree_255': (build_tree, (8,)),
+    'mesh_256': (build_mesh, (16,)),
+}
+
+
+## @return the q-quantile of the non-empty sorted list value_L
+def percentile(value_L, q):
+    return value_L[min(len(value_L) - 1, int(q * len(value_L)))]
+
+
+## child process of bench_suite, runs one workload and puts its measurements on result_q
+# every message carries its send time, which the receiving host turns into a latency sample
+def _run_suite(name, runtime, messages, timeout, result_q):
+    builder, args = suite_D[name]
+    host_L, router_L, link_layer, flow_L = builder(*args)
+    object_L = host_L + router_L + [link_layer]
+    latency_L = []
+    rcv_bytes = [0]
+    def deliver(data_B):
+        rcv_bytes[0] += len(data_B)
+        if data_B[:1] == b'T' and len(data_B) >= 20:
+            latency_L.append(time.perf_counter() - float(data_B[1:20]))
+    for h in host_L:
+        h.deliver = deliver
+    sim = runtimes.runtime_D[runtime]()
+    with quiet():
+        cpu_start, start = time.process_time(), time.perf_counter()
+        sim.start(object_L)
+        for _ in range(messages):
+            for host, dst_addr in flow_L:
+                stamp_S = 'T%019.9f' % time.perf_counter()
+                host.udt_send(dst_addr, stamp_S + message_S)  # the first packet of the message carries the stamp
+        expected = sum(h.snd_pkt_count for h in host_L)
+        deadline = start + timeout
+        while sum(h.rcv_pkt_count for h in host_L) < expected and time.perf_counter() < deadline:
+            sim.wait(0.01)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        received = sum(h.rcv_pkt_count for h in host_L)
+        sim.stop()
+    snap_D = telemetry.snapshot(object_L)
+    drops = (sum(r['drop_pkt_count'] + r['no_route_count'] + r['mtu_drop_count'] for r in snap_D['routers'].values())
+             + sum(l['drop_pkt_count'] + l['mtu_drop_count'] for l in snap_D['links'].values()))
+    latency_L.sort()
+    result_q.put({
+        'benchmark': 'suite', 'topology': name, 'runtime': runtime, 'hosts': len(host_L), 'routers': len(router_L),
+        'links': len(link_layer.link_L), 'sent_pkts': expected, 'received_pkts': received,
+        'lost_pkts': expected - received, 'drops': drops, 'wall_s': wall, 'cpu_s': cpu,
+        'pps': received / wall, 'bytes_per_s': rcv_bytes[0] / wall,
+        'latency_s': {q: percentile(latency_L, float(q[1:]) / 100) if latency_L else None
+                      for q in ('p50', 'p90', 'p99', 'p100')},
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+## fixed workload on the simulation topologies and on line, tree and mesh networks of hundreds of routers
+# prints one JSON object per topology, so runs can be compared for regressions
+# @param name_L: topologies to run, see suite_D
+# @param runtime: runtime driving the objects, see runtimes.runtime_D
+# @param messages: messages sent on every flow
+# @param timeout: seconds a workload may take before the missing packets count as lost
+@benchmark
+def bench_suite(name_L=None, runtime='threads', messages=50, timeout=120):
+    ctx = multiprocessing.get_context('fork')  # fresh process per run, so peak memory and CPU time are per run
+    for name in name_L or suite_D:
+        result_q = ctx.Queue()
+        proc = ctx.Process(target=_run_suite, args=(name, runtime, messages, timeout, result_q))
+        proc.start()
+        result_D = result_q.get()
+        proc.join()
+        print(json.dumps(result_D, sort_keys=True))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmark_D:
+        benchmark_D[name]()
@@ -0,0 +1,140 @@
+'''
+Packet capture of Interfaces and Links to pcap files, and a reader filtering captures by dst_addr and pkt_id.
+
+A Capture writes every packet into the next fixed size slot of a preallocated, memory-mapped ring file, which
+costs a timestamp per batch and a header pack and a slice copy per packet on the put/tx_pkt path. When the ring is
+full the oldest packets are overwritten. close() turns the ring into a pcap file of the captured packets, oldest
+first, with link type LINKTYPE_USER0: every record holds one byte giving the wire format of the packet (0 for
+text, 1 for binary) followed by the packet, truncated to snaplen bytes.
+
+Read a capture with
+    python capture.py capture.pcap [--dst DST_ADDR] [--id PKT_ID]
+'''
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import network_3 as network
+
+## pcap file header: magic number, version 2.4, UTC offset, timestamp accuracy, snaplen, link type
+file_header_struct = struct.Struct('<IHHiIII')
+## pcap record header: seconds, microseconds, captured length, original length
+record_header_struct = struct.Struct('<IIII')
+## ring slot header: a record header followed by the wire format byte, which starts the captured bytes
+slot_header_struct = struct.Struct('<IIIIB')
+pcap_magic = 0xa1b2c3d4
+linktype_user0 = 147
+
+
+## Captures packets into a memory-mapped ring and writes them to a pcap file on close
+# Several interfaces and links, in several threads, may share a capture.
+class Capture:
+
+    ##@param path: pcap file written by close(); the ring lives in path + '.ring' until then
+    # @param capacity: number of ring slots, the most recent packets kept
+    # @param snaplen: most bytes kept of a packet
+    def __init__(self, path, capacity=65536, snaplen=256):
+        self.path = path
+        self.capacity = capacity
+        self.snaplen = snaplen
+        self.slot_size = slot_header_struct.size + snaplen
+        self.pack_into = slot_header_struct.pack_into
+        self.ring_path = path + '.ring'
+        with open(self.ring_path, 'wb') as f:
+            f.truncate(capacity * self.slot_size)  # preallocate the ring
+        self.ring_file = open(self.ring_path, 'r+b')
+        self.buf = mmap.mmap(self.ring_file.fileno(), capacity * self.slot_size)
+        self.count = 0  # packets ever written, the next one goes to slot count % capacity
+        self.lock = threading.Lock()  # claims slots for a batch, so concurrent writers never share one
+        self.clock = time.time  # seconds, replaced by runtimes with a virtual clock
+
+    ## record packets, as Interface.put, Interface.put_many and Link.tx_pkt do when capture is enabled
+    def write_many(self, pkt_L):
+        with self.lock:
+            n = self.count
+            self.count = n + len(pkt_L)
+        now = self.clock()
+        sec = int(now)
+        usec = int((now - sec) * 1000000)
+        capacity, slot_size, snaplen, buf, pack_into = self.capacity, self.slot_size, self.snaplen, self.buf, self.pack_into
+        for pkt in pkt_L:
+            if pkt.__class__ is str:
+                pkt, kind = pkt.encode(), 0
+            else:
+                kind = 1
+            length = len(pkt)
+            offset = n % capacity * slot_size
+            n += 1
+            if length > snaplen:
+                pack_into(buf, offset, sec, usec, snaplen + 1, length + 1, kind)
+                pkt, length = pkt[:snaplen], snaplen
+            else:
+                pack_into(buf, offset, sec, usec, length + 1, length + 1, kind)
+            offset += slot_header_struct.size
+            buf[offset:offset + length] = pkt
+
+    ## write the captured packets to path as a pcap file, oldest first, and remove the ring
+    def close(self):
+        count = self.count
+        first = max(0, count - self.capacity)
+        with open(self.path, 'wb') as f:
+            f.write(file_header_struct.pack(pcap_magic, 2, 4, 0, 0, self.snaplen + 1, linktype_user0))
+            for n in range(first, count):
+                offset = n % self.capacity * self.slot_size
+                length = record_header_struct.unpack_from(self.buf, offset)[2]
+                f.write(self.buf[offset:offset + record_header_struct.size + length])
+        self.buf.close()
+        self.ring_file.close()
+        os.remove(self.ring_path)
+
+
+## capture the packets put on an Interface, or transmitted by a Link
+# @return the Capture, to be closed when done
+def attach(obj, path, capacity=65536, snaplen=256):
+    obj.capture = Capture(path, capacity, snaplen)
+    return obj.capture
+
+
+## iterate over the packets of a pcap file written by Capture, mapping it rather than reading it into memory
+# @param dst_addr: only packets to this address, None for all
+# @param pkt_id: only packets (and their fragments) with this id, None for all
+# @return iterator of (timestamp, NetworkPacket, wire format, original length)
+def read(path, dst_addr=None, pkt_id=None):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        magic, _, _, _, _, _, linktype = file_header_struct.unpack_from(buf)
+        if magic != pcap_magic or linktype != linktype_user0:
+            raise ValueError('%s is not a packet capture of this simulator' % path)
+        offset = file_header_struct.size
+        while offset < len(buf):
+            sec, usec, length, orig_length = record_header_struct.unpack_from(buf, offset)
+            offset += record_header_struct.size
+            kind, pkt_B = buf[offset], buf[offset + 1:offset + length]
+            offset += length
+            pkt = pkt_B if kind else pkt_B.decode()
+            # peek first, so records of other destinations are not parsed
+            if dst_addr is not None and network.NetworkPacket.peek_dst_addr(pkt) != dst_addr:
+                continue
+            if length < orig_length:
+                continue  # truncated, the header may still be read but the payload is incomplete
+            p = network.NetworkPacket.decode(pkt)
+            if pkt_id is not None and p.pkt_id != pkt_id:
+                continue
+            yield sec + usec / 1000000, p, 'binary' if kind else 'text', orig_length - 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the packets of a capture.')
+    parser.add_argument('path')
+    parser.add_argument('--dst', type=int, help='only packets to this destination address')
+    parser.add_argument('--id', type=int, help='only packets with this packet id')
+    args = parser.parse_args()
+    for timestamp, p, wire_format, length in read(args.path, args.dst, args.id):
+        data = p.data_S if isinstance(p.data_S, str) else bytes(p.data_S)
+        print('%.6f %-6s dst %d id %d flag %d offset %d length %d: %r'
+              % (timestamp, wire_format, p.dst_addr, p.pkt_id, p.frag_flag, p.frag_offset, length, data))
+    sys.stdout.flush()
@@ -4,9 +4,16 @@ Created on Oct 12, 2016
 @author: mwittie
 '''
 
+import collections
+import heapq
+import itertools
 import queue
 import threading
-from rprint import print
+import time
+import log
+
+## longest time (in seconds) an idle link layer sleeps before re-checking its stop flag
+idle_timeout = 0.1
 
 
 ## An abstraction of a link between router interfaces
@@ -18,7 +25,10 @@ class Link:
     # @param to_node: node to which data will be transfered
     # @param to_intf_num: number of the interface on that node
     # @param mtu: link maximum transmission unit
-    def __init__(self, from_node, from_intf_num, to_node, to_intf_num, mtu):
+    # @param bandwidth: bytes per second the link carries, None for no limit
+    # @param delay: seconds a packet takes to cross the link, None for none
+    # @param burst: bytes the link may send back to back after being idle, one mtu by default
+    def __init__(self, from_node, from_intf_num, to_node, to_intf_num, mtu, bandwidth=None, delay=None, burst=None):
         self.from_node = from_node
         self.from_intf_num = from_intf_num
         self.to_node = to_node
@@ -26,41 +36,165 @@ class Link:
         self.in_intf = from_node.out_intf_L[from_intf_num]
         self.out_intf = to_node.in_intf_L[to_intf_num]
 
+        # counters
+        self.tx_pkt_count = 0 # packets transmitted
+        self.mtu_drop_count = 0 # packets rejected for exceeding an interface MTU
+        self.drop_pkt_count = 0 # packets lost on a full to interface
+
+        # traffic shaping by a token bucket and a delay line, skipped entirely if neither bandwidth nor delay is set
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.burst = burst or mtu
+        self.shaped = bandwidth is not None or delay is not None
+        self.tokens = self.burst # bytes the link may send now, negative while paying off an oversized packet
+        self.last_time = None # clock time of the last token bucket refill
+        self.delay_line = collections.deque() # (arrival time, packet) of the packets in flight, in arrival order
+        self.clock = time.monotonic # seconds, replaced by runtimes with a virtual clock
+        self.capture = None # capture.Capture recording the packets transmitted, set by capture.attach
+
         # configure the MTUs of linked interfaces
         self.in_intf.mtu = mtu
         self.out_intf.mtu = mtu
+        self.in_intf.link = self
+        if hasattr(from_node, 'invalidate_fib'):
+            from_node.invalidate_fib()  # its forwarding records hold the out interface MTUs
         
     ## called when printing the object
     def __str__(self):
         return 'Link %s-%d to %s-%d' % (self.from_node, self.from_intf_num, self.to_node, self.to_intf_num)
+
+    ## change the MTU of the link and its interfaces
+    def set_mtu(self, mtu):
+        self.in_intf.mtu = mtu
+        self.out_intf.mtu = mtu
+        if hasattr(self.from_node, 'invalidate_fib'):
+            self.from_node.invalidate_fib()
         
-    ## transmit a packet from the 'from' to the 'to' interface
-    def tx_pkt(self):
-        pkt_S = self.in_intf.get()
-        if pkt_S is None:
-            return # return if no packet to transfer
-        if len(pkt_S) > self.in_intf.mtu:
-            print('%s: packet "%s" length greater than the from interface MTU (%d)' % (self, pkt_S, self.in_intf.mtu))
-            return  # return without transmitting if packet too big
-        if len(pkt_S) > self.out_intf.mtu:
-            print('%s: packet "%s" length greater than the to interface MTU (%d)' % (self, pkt_S, self.out_intf.mtu))
-            return # return without transmitting if packet too big
-        # otherwise transmit the packet
-        try:
-            self.out_intf.put(pkt_S)
-            print('%s: transmitting packet "%s"' % (self, pkt_S))
-        except queue.Full:
-            print('%s: packet lost' % (self))
-            pass
+    ## transmit packets from the 'from' to the 'to' interface
+    # @param batch_size: max number of packets transmitted in one call
+    # @return True if a packet was taken off the from interface
+    def tx_pkt(self, batch_size=1):
+        if self.shaped:
+            return self.tx_shaped(batch_size)
+        pkt_L = self.in_intf.get_many(batch_size)
+        if not pkt_L:
+            return False # return if no packet to transfer
+        self.deliver(self.check_mtu(pkt_L))
+        return True
+
+    ## @return the packets of pkt_L that fit the MTUs of both interfaces
+    def check_mtu(self, pkt_L):
+        tx_pkt_L = []
+        for pkt_S in pkt_L:
+            if len(pkt_S) > self.in_intf.mtu:
+                self.mtu_drop_count += 1
+                log.warn('%s: packet "%s" length greater than the from interface MTU (%d)', self, pkt_S, self.in_intf.mtu)
+                continue  # skip without transmitting if packet too big
+            if len(pkt_S) > self.out_intf.mtu:
+                self.mtu_drop_count += 1
+                log.warn('%s: packet "%s" length greater than the to interface MTU (%d)', self, pkt_S, self.out_intf.mtu)
+                continue # skip without transmitting if packet too big
+            tx_pkt_L.append(pkt_S)
+        return tx_pkt_L
+
+    ## put packets on the to interface
+    def deliver(self, tx_pkt_L):
+        sent = self.out_intf.put_many(tx_pkt_L, partial=True)
+        self.tx_pkt_count += sent
+        self.drop_pkt_count += len(tx_pkt_L) - sent
+        if self.capture is not None:
+            self.capture.write_many(tx_pkt_L[:sent])
+        if log.enabled(log.TRACE):
+            for pkt_S in tx_pkt_L[:sent]:
+                log.trace('%s: transmitting packet "%s"', self, pkt_S)
+        for pkt_S in tx_pkt_L[sent:]:
+            log.warn('%s: packet lost', self)
+
+    ## tx_pkt of a link with a bandwidth or delay
+    # A packet leaves the from interface while the token bucket is not in debt, spending its length in tokens, and
+    # arrives at the to interface delay seconds later.
+    # @return True if a packet left the from interface or arrived at the to interface
+    def tx_shaped(self, batch_size):
+        now = self.clock()
+        busy = False
+        if self.delay_line and self.delay_line[0][0] <= now:
+            arrived_L = []
+            while self.delay_line and self.delay_line[0][0] <= now:
+                arrived_L.append(self.delay_line.popleft()[1])
+            self.deliver(arrived_L)
+            busy = True
+        if self.bandwidth is None:
+            pkt_L = self.in_intf.get_many(batch_size)
+        else:
+            if self.last_time is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.bandwidth)
+            self.last_time = now
+            pkt_L = []
+            while len(pkt_L) < batch_size and self.tokens >= 0:
+                pkt_S = self.in_intf.get()
+                if pkt_S is None:
+                    break
+                self.tokens -= len(pkt_S)
+                pkt_L.append(pkt_S)
+        if not pkt_L:
+            return busy
+        tx_pkt_L = self.check_mtu(pkt_L)
+        if self.delay is None:
+            self.deliver(tx_pkt_L)
+        else:
+            self.delay_line.extend((now + self.delay, pkt_S) for pkt_S in tx_pkt_L)
+        return True
+
+    ## @return packets taken off the from interface and neither transmitted nor dropped yet, e.g. in the delay line
+    def in_flight(self):
+        # read the counters of the packets that left the link first, so a concurrent tx_pkt cannot make it look empty
+        left = self.tx_pkt_count + self.drop_pkt_count + self.mtu_drop_count
+        return self.in_intf.get_count - left
+
+    ## @return seconds until a shaped link can move a packet again, 0 if it can now, None if it has no packets
+    def wait_time(self):
+        now = self.clock()
+        wait_L = []
+        if self.delay_line:
+            wait_L.append(self.delay_line[0][0] - now)
+        if self.in_intf.qsize():
+            if self.bandwidth is None or self.last_time is None:
+                wait_L.append(0.0)
+            else:
+                wait_L.append(-self.tokens / self.bandwidth - (now - self.last_time))
+        return max(0.0, min(wait_L)) if wait_L else None
+
+
+## Queues a link for the link layer's transmit workers, set() is called on every put to its from interface
+class _LinkReady:
+
+    def __init__(self, link_layer, link):
+        self.link_layer = link_layer
+        self.link = link
+
+    def set(self):
+        self.link_layer.schedule(self.link)
         
         
 ## An abstraction of the link layer
 class LinkLayer:
     
-    def __init__(self):
+    ##@param workers: number of transmit threads serving the links with pending packets, 0 to sweep all links
+    #  from the run thread (len(link_L) gives every link its own worker)
+    def __init__(self, workers=0):
         ## list of links in the network
         self.link_L = []
         self.stop = False #for thread termination
+        self.batch_size = 1 # max packets moved across each link per transfer
+        self.busy_poll = False # if True, spin on the links instead of sleeping while they are empty
+        self.wakeup = threading.Event()
+        self.workers = workers
+        self.ready_Q = queue.Queue() # links with pending packets, waiting for a transmit worker
+        self.scheduled_S = set() # links in ready_Q or being served by a worker
+        self.schedule_lock = threading.Lock()
+        self.shaped_L = [] # links with a bandwidth or delay, which have timed work
+        self.timer_L = [] # heap of (time.monotonic() due, sequence number, link) of links to schedule later
+        self.timer_seq = itertools.count()
        
     ## Return a name of the network layer
     def __str__(self):
@@ -69,19 +203,122 @@ class LinkLayer:
     ## add a Link to the network
     def add_link(self, link):
         self.link_L.append(link)
+        link.in_intf.ready = self.wakeup
+        if link.shaped:
+            self.shaped_L.append(link)
+
+    ## use clock instead of time.monotonic for the shaped links and the queue disciplines of their from interfaces,
+    # and instead of time.time for the captures of the links
+    # @param clock: function returning the current time in seconds
+    def set_clock(self, clock):
+        for link in self.link_L:
+            link.clock = clock
+            if hasattr(link.in_intf, 'clock'):
+                link.in_intf.clock = clock
+            if link.capture is not None:
+                link.capture.clock = clock
+
+    ## @return seconds until a shaped link has a packet to move, 0 if one has now, None if none has packets
+    def wait_time(self):
+        wait_L = [wait for wait in (link.wait_time() for link in self.shaped_L) if wait is not None]
+        return min(wait_L) if wait_L else None
+
+    ## route readiness notifications of the links' from interfaces to wakeup
+    # @param wakeup: object with a set() method, called whenever a packet is put on a from interface
+    def set_wakeup(self, wakeup):
+        self.wakeup = wakeup
+        for link in self.link_L:
+            link.in_intf.ready = wakeup
+
+    ## one unit of work, for runtimes that drive the link layer without run()
+    # @return True if any work was done
+    def step(self):
+        return self.transfer()
         
-    ## transfer a packet across all links
+    ## transfer up to batch_size packets across all links
+    # @return True if a packet was taken off any link
     def transfer(self):
+        busy = False
         for link in self.link_L:
-                link.tx_pkt()
+                if link.tx_pkt(self.batch_size):
+                    busy = True
+        return busy
                 
+    ## queue a link for the transmit workers, unless it is queued or being served already
+    def schedule(self, link):
+        with self.schedule_lock:
+            if link in self.scheduled_S:
+                return
+            self.scheduled_S.add(link)
+        self.ready_Q.put(link)
+
+    ## queue a link for the transmit workers after delay seconds
+    def schedule_later(self, link, delay):
+        with self.schedule_lock:
+            heapq.heappush(self.timer_L, (time.monotonic() + delay, next(self.timer_seq), link))
+
+    ## queue the links whose timers have expired
+    # @return seconds until the next timer expires, at most idle_timeout
+    def schedule_due(self):
+        now = time.monotonic()
+        due_L = []
+        with self.schedule_lock:
+            while self.timer_L and self.timer_L[0][0] <= now:
+                due_L.append(heapq.heappop(self.timer_L)[2])
+            timeout = min(idle_timeout, self.timer_L[0][0] - now) if self.timer_L else idle_timeout
+        for link in due_L:
+            self.schedule(link)
+        return timeout
+
+    ## transmit worker, serves one batch of a ready link at a time so busy links cannot starve the others
+    def serve_links(self):
+        while not self.stop:
+            try:
+                link = self.ready_Q.get(timeout=self.schedule_due() if self.timer_L else idle_timeout)
+            except queue.Empty:
+                continue
+            link.tx_pkt(self.batch_size)
+            with self.schedule_lock:
+                self.scheduled_S.discard(link)
+            if link.shaped:
+                # a shaped link waits for tokens or for packets in flight to arrive
+                wait = link.wait_time()
+                if wait:
+                    self.schedule_later(link, wait)
+                elif wait is not None:
+                    self.schedule(link)
+            # a put during tx_pkt found the link still scheduled, so queue it again if packets are left
+            elif link.in_intf.qsize():
+                self.schedule(link)
+
     ## thread target for the network to keep transmitting data across links
     def run(self):
-        print (threading.currentThread().getName() + ': Starting')
+        log.info('%s: Starting', threading.currentThread().getName())
+        if self.workers:
+            # each link signals its own readiness, and only links with pending packets get scheduled
+            for link in self.link_L:
+                link.in_intf.ready = _LinkReady(self, link)
+                if link.in_intf.qsize():
+                    self.schedule(link)
+            worker_L = [threading.Thread(name='%s-tx-%d' % (self, n), target=self.serve_links)
+                        for n in range(1, self.workers)]
+            for w in worker_L:
+                w.start()
+            self.serve_links()
+            for w in worker_L:
+                w.join()
+            log.info('%s: Ending', threading.currentThread().getName())
+            return
         while True:
-            #transfer one packet on all the links
-            self.transfer()
+            #clear before transferring, so a packet put while we work wakes up the next wait
+            self.wakeup.clear()
+            #transfer a batch of packets on all the links
+            busy = self.transfer()
             #terminate
             if self.stop:
-                print (threading.currentThread().getName() + ': Ending')
-                return
\ No newline at end of file
+                log.info('%s: Ending', threading.currentThread().getName())
+                return
+            #sleep until a packet is put on one of the links, or a shaped link has a packet to move
+            if not busy and not self.busy_poll:
+                wait = self.wait_time() if self.shaped_L else None
+                self.wakeup.wait(idle_timeout if wait is None else min(idle_timeout, wait))
\ No newline at end of file
@@ -0,0 +1,113 @@
+'''
+Level filtered, asynchronous logging for the simulation.
+
+Records are appended to a deque, which needs no lock in CPython, and a background writer thread formats
+and writes them, so nodes never wait on console I/O. Messages are %-format strings with their arguments,
+formatted by the writer and only for records whose level is enabled.
+
+    log.trace('%s: forwarding packet "%s"', self, pkt_S)
+    log.level = log.INFO  # turn off per packet tracing at runtime
+'''
+
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+## log levels
+TRACE = 10  # every packet sent, forwarded, transmitted or received
+INFO = 20  # thread start and end, end of simulation
+WARN = 30  # dropped packets, missing routes
+OFF = 100
+
+level_name_D = {TRACE: 'TRACE', INFO: 'INFO', WARN: 'WARN'}
+
+## records of this level and above are logged
+level = TRACE
+## if True the writer emits JSON lines with time, level, thread and message instead of plain messages
+json_output = False
+## stream the writer writes to, None for the current sys.stdout
+stream = None
+## seconds the writer sleeps when there are no records
+write_interval = 0.01
+
+_record_Q = collections.deque()  # (time, level, thread name, format string, args)
+_writer = None
+_writer_lock = threading.Lock()  # only taken to start the writer and to flush
+
+
+## @return True if records of level lvl are logged, to guard loops that only produce log records
+def enabled(lvl):
+    return lvl >= level
+
+
+## log a message at level lvl, formatted as fmt % args by the writer
+def log(lvl, fmt, *args):
+    if lvl < level:
+        return
+    _record_Q.append((time.time(), lvl, threading.current_thread().name, fmt, args))
+    if _writer is None:
+        _start_writer()
+
+
+def trace(fmt, *args):
+    log(TRACE, fmt, *args)
+
+
+def info(fmt, *args):
+    log(INFO, fmt, *args)
+
+
+def warn(fmt, *args):
+    log(WARN, fmt, *args)
+
+
+## write out all queued records
+def flush():
+    with _writer_lock:
+        _drain()
+
+
+def _drain():
+    out = stream or sys.stdout
+    while _record_Q:
+        t, lvl, thread_name, fmt, args = _record_Q.popleft()
+        msg = fmt % args if args else fmt
+        if json_output:
+            out.write(json.dumps({'time': t, 'level': level_name_D.get(lvl, lvl), 'thread': thread_name,
+                                  'msg': msg}) + '\n')
+        else:
+            out.write(msg + '\n')
+    out.flush()
+
+
+def _write_forever():
+    while True:
+        if _record_Q:
+            with _writer_lock:
+                _drain()
+        else:
+            time.sleep(write_interval)
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(name='log writer', target=_write_forever, daemon=True)
+            _writer.start()
+
+
+## a forked child has no writer thread and must not write the parent's pending records
+def _after_fork():
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+    _record_Q.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
@@ -167,22 +167,19 @@ class Router:
                     # calculate max load of data interface can handle
                     max_load = self.out_intf_L[i].mtu - NetworkPacket.header_length
                     frag_flag = 1
-                    frag_offset = 0
                     buffer = p.data_S
 
-                    # iterates over buffer sending packet fragments until end of packet
-                    while len(buffer) > 0:
-                        if len(buffer) <= max_load:  # checks if last fragment in packet
+                    # walks the buffer by offset sending packet fragments until end of packet
+                    for frag_offset in range(0, len(buffer), max_load):
+                        if frag_offset + max_load >= len(buffer):  # checks if last fragment in packet
                             frag_flag = 0
                         # creates fragment packet and forwards fragment
-                        frag_pkt = NetworkPacket(p.dst_addr, buffer[:max_load], p.pkt_id, frag_flag, frag_offset)
+                        frag_pkt = NetworkPacket(p.dst_addr, buffer[frag_offset:frag_offset + max_load], p.pkt_id,
+                                                 frag_flag, frag_offset)
                         print('%s: forwarding packet "%s" from interface %d to %d with mtu %d' \
                               % (self, frag_pkt, i, i, self.out_intf_L[i].mtu))
                         self.out_intf_L[i].put(frag_pkt.to_byte_S())
 
-                        buffer = buffer[max_load:]
-                        frag_offset += len(buffer[:max_load])
-
             except queue.Full:
                 print('%s: packet "%s" lost on interface %d' % (self, p, i))
                 pass
@@ -3,41 +3,247 @@ Created on Oct 12, 2016
 
 @author: mwittie
 '''
+import bisect
+import collections
+import itertools
+import math
 import queue
+import struct
 import threading
-from rprint import print
+import time
+import log
+
+## longest time (in seconds) an idle node sleeps before re-checking its stop flag
+idle_timeout = 0.1
+
+## changes the routes, out interfaces or MTUs of any node went through, so hosts can tell their path MTUs are stale
+path_version = 0
+path_version_counter = itertools.count(1)
+
+
+## record a change that may alter the path MTU to any destination
+def invalidate_paths():
+    global path_version
+    path_version = next(path_version_counter)  # a fresh value even if two threads change paths at once
 
 
 ## wrapper class for a queue of packets
+# The packets are kept in a deque guarded by one lock, with conditions for the rare blocking get or put.
 class Interface:
     ## @param max_queue_size - the maximum size of the queue storing packets
     #  @param mtu - the maximum transmission unit on this interface
     def __init__(self, max_queue_size=0):
         self.mtu = None
-        self.queue = queue.Queue(max_queue_size)
+        self.max_queue_size = max_queue_size  # 0 for no limit
+        self.queue = collections.deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)  # notified on every put, for blocking gets
+        self.not_full = threading.Condition(self.lock)  # notified on every get, for blocking puts
+        self.link = None  # Link transmitting from this interface, set by the link
+        self.ready = None  # readiness notification of the consumer (e.g. threading.Event), set on every put
+        self.capture = None  # capture.Capture recording the packets enqueued, set by capture.attach
+        self.put_count = 0  # packets enqueued, counted with the queue locked
+        self.get_count = 0  # packets dequeued, counted with the queue locked so qsize() and get_count agree
+        self.drop_count = 0  # packets refused because the queue was full
 
     ## get packet from the queue interface
-    def get(self):
-        try:
-            return self.queue.get(False)
-        except queue.Empty:
-            return None
+    # @param block - if True, wait for a packet to arrive, if False return None right away when empty
+    # @param timeout - when blocking, give up and return None after timeout seconds
+    def get(self, block=False, timeout=None):
+        q = self.queue
+        with self.lock:
+            if not q and not (block and self.not_empty.wait_for(q.__len__, timeout)):
+                return None
+            pkt = q.popleft()
+            self.get_count += 1
+            self.not_full.notify()
+        return pkt
 
     ## put the packet into the interface queue
     # @param pkt - Packet to be inserted into the queue
     # @param block - if True, block until room in queue, if False may throw queue.Full exception
     def put(self, pkt, block=False):
-        self.queue.put(pkt, block)
+        q = self.queue
+        with self.lock:
+            if self.max_queue_size and len(q) >= self.max_queue_size:
+                if not block:
+                    self.drop_count += 1
+                    raise queue.Full
+                self.not_full.wait_for(lambda: len(q) < self.max_queue_size)
+            q.append(pkt)
+            self.put_count += 1
+            self.not_empty.notify()
+        if self.capture is not None:
+            self.capture.write_many((pkt,))
+        if self.ready is not None:
+            self.ready.set()
+
+    ## get up to max_count packets from the queue interface with a single lock acquisition
+    # @return list of packets in queue order, empty if there are none
+    def get_many(self, max_count):
+        q = self.queue
+        with self.lock:
+            count = min(max_count, len(q))
+            pkt_L = [q.popleft() for _ in range(count)]
+            self.get_count += count
+            if count:
+                self.not_full.notify(count)
+        return pkt_L
+
+    ## put a batch of packets into the interface queue with a single lock acquisition
+    # @param pkt_L - list of packets to be inserted into the queue in order
+    # @param partial - if False, throw queue.Full without enqueueing any packet if the batch does not fit,
+    #   if True enqueue as many leading packets as fit
+    # @return number of packets enqueued
+    def put_many(self, pkt_L, partial=False):
+        q = self.queue
+        count = len(pkt_L)
+        with self.lock:
+            if 0 < self.max_queue_size < len(q) + count:
+                if not partial:
+                    self.drop_count += count
+                    raise queue.Full
+                count = max(0, self.max_queue_size - len(q))
+                self.drop_count += len(pkt_L) - count
+                pkt_L = pkt_L[:count]
+            q.extend(pkt_L)
+            self.put_count += count
+            self.not_empty.notify(count)
+        if self.capture is not None:
+            self.capture.write_many(pkt_L)
+        if count and self.ready is not None:
+            self.ready.set()
+        return count
+
+    ## @return number of packets in the queue
+    def qsize(self):
+        return len(self.queue)
+
+
+## Interface backed by a preallocated single producer/single consumer ring buffer
+# Only one thread may put and only one thread may get. The producer alone advances tail and the consumer
+# alone advances head, so neither takes a lock; queue.Full is raised when the ring is full, as for Interface.
+class RingInterface:
+    ## ring size used when max_queue_size is 0, which means unlimited for Interface
+    default_capacity = 4096
+
+    ## @param max_queue_size - the maximum size of the queue storing packets, 0 for default_capacity
+    def __init__(self, max_queue_size=0):
+        self.mtu = None
+        self.capacity = max_queue_size or self.default_capacity
+        self.slot_L = [None] * self.capacity
+        self.head = 0  # number of packets ever taken out, only written by the consumer
+        self.tail = 0  # number of packets ever put in, only written by the producer
+        self.link = None  # Link transmitting from this interface, set by the link
+        self.ready = None  # readiness notification of the consumer (e.g. threading.Event), set on every put
+        self.capture = None  # capture.Capture recording the packets enqueued, set by capture.attach
+        self.drop_count = 0  # packets refused because the ring was full
+
+    ## get packet from the ring
+    # @param block - if True, poll for a packet to arrive, if False return None right away when empty
+    # @param timeout - when blocking, give up and return None after timeout seconds
+    def get(self, block=False, timeout=None):
+        head = self.head
+        if head == self.tail:
+            if not block:
+                return None
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while head == self.tail:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                time.sleep(0.0001)
+        i = head % self.capacity
+        pkt = self.slot_L[i]
+        self.slot_L[i] = None
+        self.head = head + 1  # publish only after the slot has been read
+        return pkt
+
+    ## get up to max_count packets from the ring
+    def get_many(self, max_count):
+        head = self.head
+        count = min(max_count, self.tail - head)
+        pkt_L = []
+        for n in range(head, head + count):
+            i = n % self.capacity
+            pkt_L.append(self.slot_L[i])
+            self.slot_L[i] = None
+        self.head = head + count
+        return pkt_L
+
+    ## put the packet into the ring
+    # @param block - if True, poll until there is room in the ring, if False may throw queue.Full exception
+    def put(self, pkt, block=False):
+        tail = self.tail
+        while tail - self.head >= self.capacity:
+            if not block:
+                self.drop_count += 1
+                raise queue.Full
+            time.sleep(0.0001)
+        self.slot_L[tail % self.capacity] = pkt
+        self.tail = tail + 1  # publish only after the slot has been written
+        if self.capture is not None:
+            self.capture.write_many((pkt,))
+        if self.ready is not None:
+            self.ready.set()
+
+    ## put a batch of packets into the ring
+    # @param partial - if False, throw queue.Full without enqueueing any packet if the batch does not fit,
+    #   if True enqueue as many leading packets as fit
+    # @return number of packets enqueued
+    def put_many(self, pkt_L, partial=False):
+        tail = self.tail
+        count = min(len(pkt_L), self.capacity - (tail - self.head))
+        if count < len(pkt_L) and not partial:
+            self.drop_count += len(pkt_L)
+            raise queue.Full
+        self.drop_count += len(pkt_L) - count
+        for n in range(count):
+            self.slot_L[(tail + n) % self.capacity] = pkt_L[n]
+        self.tail = tail + count
+        if self.capture is not None:
+            self.capture.write_many(pkt_L[:count])
+        if count and self.ready is not None:
+            self.ready.set()
+        return count
+
+    ## @return number of packets in the ring
+    def qsize(self):
+        return self.tail - self.head
+
+    ## number of packets enqueued
+    @property
+    def put_count(self):
+        return self.tail
+
+    ## number of packets dequeued
+    @property
+    def get_count(self):
+        return self.head
+
+
+## class of the interfaces created by hosts and routers, Interface or RingInterface
+interface_class = Interface
+
+
+## use clock instead of time.time for the captures of the interfaces in intf_L
+def set_capture_clock(intf_L, clock):
+    for intf in intf_L:
+        if intf.capture is not None:
+            intf.capture.clock = clock
 
 
 ## Implements a network layer packet
 class NetworkPacket:
     ## packet encoding lengths
     dst_addr_S_length = 2
-    pkt_id_S_length = 3
+    pkt_id_S_length = 6  # the sending host's address in dst_addr_S_length digits, then a count
     frag_flag_S_length = 1
     frag_offset_S_length = 3
     header_length = dst_addr_S_length + pkt_id_S_length + frag_flag_S_length + frag_offset_S_length
+    ## binary encoding: dst_addr, pkt_id, frag_flag and frag_offset as network order unsigned integers
+    header_struct = struct.Struct('!HIBI')
+    dst_addr_struct = struct.Struct('!H')
+    header_length_B = header_struct.size
 
     ##@param dst_addr: address of the destination host
     # @param data_S: packet payload
@@ -50,17 +256,29 @@ class NetworkPacket:
 
     ## called when printing the object
     def __str__(self):
-        return self.to_byte_S()
+        if isinstance(self.data_S, str):
+            return self.to_byte_S()
+        return str(self.to_byte_B())
 
     ## convert packet to a byte string for transmission over links
+    # throws ValueError if a header field does not fit its width
     def to_byte_S(self):
-        byte_S = str(self.dst_addr).zfill(self.dst_addr_S_length)
-        byte_S += str(self.pkt_id).zfill(self.pkt_id_S_length)
-        byte_S += str(self.frag_flag).zfill(self.frag_flag_S_length)
-        byte_S += str(self.frag_offset).zfill(self.frag_offset_S_length)
+        byte_S = self.field_S(self.dst_addr, self.dst_addr_S_length, 'dst_addr')
+        byte_S += self.field_S(self.pkt_id, self.pkt_id_S_length, 'pkt_id')
+        byte_S += self.field_S(self.frag_flag, self.frag_flag_S_length, 'frag_flag')
+        byte_S += self.field_S(self.frag_offset, self.frag_offset_S_length, 'frag_offset')
         byte_S += self.data_S
         return byte_S
 
+    ## @return value zero padded to a text header field of length digits
+    # throws ValueError if value is longer, since the rest of the header would shift into the payload
+    @staticmethod
+    def field_S(value, length, name):
+        value_S = str(value).zfill(length)
+        if len(value_S) > length:
+            raise ValueError('%s %s does not fit the %d digit text header field' % (name, value, length))
+        return value_S
+
     ## extract a packet object from a byte string
     # @param byte_S: byte string representation of the packet
     @classmethod
@@ -73,144 +291,603 @@ class NetworkPacket:
         frag_offset = byte_S[(
                                          NetworkPacket.dst_addr_S_length + NetworkPacket.pkt_id_S_length + NetworkPacket.frag_flag_S_length):NetworkPacket.header_length]
         data_S = byte_S[NetworkPacket.header_length:]
-        return self(dst_addr, data_S, pkt_id, frag_flag, frag_offset)
+        return self(dst_addr, data_S, int(pkt_id), int(frag_flag), int(frag_offset))
+
+    ## convert packet to a binary string for transmission over links
+    def to_byte_B(self):
+        data_B = self.data_S.encode() if isinstance(self.data_S, str) else self.data_S
+        return self.header_struct.pack(int(self.dst_addr), int(self.pkt_id), int(self.frag_flag),
+                                       int(self.frag_offset)) + data_B
+
+    ## extract a packet object from a binary string without copying the payload
+    # @param byte_B: binary string representation of the packet
+    # @return packet whose data_S is a memoryview into byte_B
+    @classmethod
+    def from_byte_B(self, byte_B):
+        view = memoryview(byte_B)
+        dst_addr, pkt_id, frag_flag, frag_offset = NetworkPacket.header_struct.unpack_from(view)
+        return self(dst_addr, view[NetworkPacket.header_length_B:], pkt_id, frag_flag, frag_offset)
+
+    ## convert packet to the given wire format
+    # @param wire_format: 'text' (to_byte_S) or 'binary' (to_byte_B)
+    def encode(self, wire_format):
+        if wire_format == 'binary':
+            return self.to_byte_B()
+        return self.to_byte_S()
+
+    ## extract a packet object from a packet in either wire format
+    @classmethod
+    def decode(self, pkt):
+        if isinstance(pkt, str):
+            return self.from_byte_S(pkt)
+        return self.from_byte_B(pkt)
+
+    ## @return wire format of an encoded packet
+    @staticmethod
+    def wire_format_of(pkt):
+        return 'text' if isinstance(pkt, str) else 'binary'
+
+    ## @return header length of the given wire format
+    @classmethod
+    def header_length_of(self, wire_format):
+        if wire_format == 'binary':
+            return self.header_length_B
+        return self.header_length
+
+    ## read the destination address of an encoded packet without parsing the rest of it
+    @classmethod
+    def peek_dst_addr(self, pkt):
+        if isinstance(pkt, str):
+            return int(pkt[:self.dst_addr_S_length])
+        return self.dst_addr_struct.unpack_from(pkt)[0]
+
+    ## split the payload into encoded fragments of at most max_load bytes, walking it by offset
+    # The fragments of a packet that is itself a fragment keep their offsets relative to the original packet, and
+    # the last of them inherits its frag_flag, so reassembly sees the same fragments as if the original packet had
+    # been split at max_load.
+    # @param max_load: largest payload carried by one fragment
+    # @param wire_format: encoding of the fragments, 'text' or 'binary'
+    # @return list of encoded fragments in offset order
+    def fragment(self, max_load, wire_format):
+        if wire_format == 'binary':
+            data_B = self.data_S.encode() if isinstance(self.data_S, str) else self.data_S
+            return self.fragment_B(int(self.dst_addr), int(self.pkt_id), int(self.frag_flag),
+                                   int(self.frag_offset), memoryview(data_B), max_load)
+        # the address and id part of the text header is the same for every fragment
+        prefix_S = (self.field_S(self.dst_addr, self.dst_addr_S_length, 'dst_addr')
+                    + self.field_S(self.pkt_id, self.pkt_id_S_length, 'pkt_id'))
+        return self.fragment_S(prefix_S, str(self.frag_flag), int(self.frag_offset), self.data_S, max_load)
+
+    ## fragment an encoded packet or fragment without parsing it into a NetworkPacket
+    # Only the flag and offset fields are read; the address and id are copied into the fragments as they are.
+    # @return list of encoded fragments in offset order, as fragment
+    @classmethod
+    def fragment_encoded(self, pkt, max_load):
+        if isinstance(pkt, str):
+            flag_start = self.dst_addr_S_length + self.pkt_id_S_length
+            return self.fragment_S(pkt[:flag_start], pkt[flag_start], int(pkt[flag_start + 1:self.header_length]),
+                                   pkt[self.header_length:], max_load)
+        dst_addr, pkt_id, frag_flag, frag_offset = self.header_struct.unpack_from(pkt)
+        return self.fragment_B(dst_addr, pkt_id, frag_flag, frag_offset, memoryview(pkt)[self.header_length_B:],
+                               max_load)
+
+    ## binary fragments of data_B, a memoryview the fragments slice instead of copying it
+    @classmethod
+    def fragment_B(self, dst_addr, pkt_id, frag_flag, frag_offset, data_B, max_load):
+        last_offset = len(data_B) - max_load  # fragments starting after this one carry the end of the payload
+        pack = self.header_struct.pack
+        return [pack(dst_addr, pkt_id, 1 if offset < last_offset else frag_flag, frag_offset + offset)
+                + data_B[offset:offset + max_load] for offset in range(0, len(data_B), max_load)]
+
+    ## text fragments of data_S, whose headers start with the address and id part prefix_S
+    # throws ValueError if the offset of the last fragment does not fit the frag_offset field
+    @classmethod
+    def fragment_S(self, prefix_S, frag_flag_S, frag_offset, data_S, max_load):
+        self.field_S(frag_offset + (len(data_S) - 1) // max_load * max_load, self.frag_offset_S_length, 'frag_offset')
+        last_offset = len(data_S) - max_load  # fragments starting after this one carry the end of the payload
+        return [prefix_S + ('1' if offset < last_offset else frag_flag_S)
+                + str(frag_offset + offset).zfill(self.frag_offset_S_length) + data_S[offset:offset + max_load]
+                for offset in range(0, len(data_S), max_load)]
+
+
+## Fragments received so far of one packet
+class PartialPacket:
+    __slots__ = ('buffer', 'total', 'start_L', 'end_L', 'received', 'last_time')
+
+    ##@param size: bytes to preallocate for the payload
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.total = None  # payload length, known once the last fragment arrived
+        self.start_L = []  # sorted, disjoint [start, end) byte ranges received so far
+        self.end_L = []
+        self.received = 0  # bytes covered by the ranges
+        self.last_time = 0
+
+    ## copy a fragment into place
+    # @return number of bytes the buffer grew by
+    def add(self, frag_offset, frag_flag, data_B):
+        start, end = frag_offset, frag_offset + len(data_B)
+        grown = 0
+        if end > len(self.buffer):
+            grown = max(end, 2 * len(self.buffer)) - len(self.buffer)
+            self.buffer.extend(bytes(grown))
+        self.buffer[start:end] = data_B
+        if not frag_flag:
+            self.total = end
+        # merge [start, end) with the ranges it overlaps or touches, counting only newly covered bytes
+        start_L, end_L = self.start_L, self.end_L
+        lo = bisect.bisect_right(start_L, start)
+        if lo and end_L[lo - 1] >= start:
+            lo -= 1
+        hi = lo
+        overlap = 0
+        while hi < len(start_L) and start_L[hi] <= end:
+            overlap += max(0, min(end_L[hi], end) - max(start_L[hi], start))
+            hi += 1
+        self.received += end - start - overlap
+        if hi > lo:
+            start, end = min(start, start_L[lo]), max(end, end_L[hi - 1])
+        start_L[lo:hi] = [start]
+        end_L[lo:hi] = [end]
+        return grown
+
+    ## @return True once every byte up to the last fragment has been received
+    def complete(self):
+        return self.total is not None and self.received == self.total
+
+
+## Reassembles fragmented packets by frag_offset into preallocated buffers
+# Fragments may arrive in any order and more than once. Incomplete packets expire after timeout seconds
+# without a new fragment, and the least recently updated ones are evicted while more than max_bytes are
+# buffered.
+class Reassembler:
+    initial_size = 256  # bytes preallocated per packet, doubled when a fragment lands beyond the buffer
+
+    ##@param timeout: seconds an incomplete packet is kept after its last fragment arrived
+    # @param max_bytes: cap on the buffer memory of all incomplete packets
+    # @param clock: time source
+    def __init__(self, timeout=10.0, max_bytes=1 << 20, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.pkt_D = collections.OrderedDict()  # pkt_id -> PartialPacket, least recently updated first
+        self.buffered_bytes = 0
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    ## @return number of incomplete packets
+    def __len__(self):
+        return len(self.pkt_D)
+
+    ## add a fragment
+    # @return the packet payload as bytes once all its fragments have arrived, else None
+    def add(self, pkt_id, frag_offset, frag_flag, data_B):
+        if not frag_offset and not frag_flag and pkt_id not in self.pkt_D:
+            return bytes(data_B)  # not fragmented
+        now = self.clock()
+        self.expire(now)
+        partial = self.pkt_D.get(pkt_id)
+        if partial is None:
+            partial = self.pkt_D[pkt_id] = PartialPacket(max(self.initial_size, frag_offset + len(data_B)))
+            self.buffered_bytes += len(partial.buffer)
+        else:
+            self.pkt_D.move_to_end(pkt_id)
+        partial.last_time = now
+        self.buffered_bytes += partial.add(frag_offset, frag_flag, data_B)
+        if partial.complete():
+            self.discard(pkt_id)
+            return bytes(partial.buffer[:partial.total])
+        # evict the least recently updated packets, which may be this one if it is larger than the cap
+        while self.buffered_bytes > self.max_bytes:
+            self.discard(next(iter(self.pkt_D)))
+            self.evicted_count += 1
+        return None
+
+    ## drop incomplete packets that got no fragment for timeout seconds
+    def expire(self, now=None):
+        if now is None:
+            now = self.clock()
+        while self.pkt_D:
+            pkt_id, partial = next(iter(self.pkt_D.items()))
+            if now - partial.last_time < self.timeout:
+                return
+            self.discard(pkt_id)
+            self.expired_count += 1
+
+    ## drop an incomplete packet
+    def discard(self, pkt_id):
+        self.buffered_bytes -= len(self.pkt_D.pop(pkt_id).buffer)
 
 
 ## Implements a network host for receiving and transmitting data
 class Host:
 
     ##@param addr: address of this node represented as an integer
-    # @param mtu: MTU for all interfaces
-    def __init__(self, addr):
+    # @param wire_format: encoding of the packets sent by this host, 'text' or 'binary'
+    def __init__(self, addr, wire_format='text'):
         self.addr = addr
+        self.wire_format = wire_format
         self.id_count = 0
-        self.in_intf_L = [Interface()]
-        self.out_intf_L = [Interface()]
+        self.in_intf_L = [interface_class()]
+        self.out_intf_L = [interface_class()]
         self.stop = False  # for thread termination
-        self.frag_pkt_buffer = {}
+        self.reassembler = Reassembler()
+        self.snd_pkt_count = 0  # number of packets sent
+        self.rcv_frag_count = 0  # number of packets and fragments taken off the in interface and handled
+        self.rcv_pkt_count = 0  # number of fully reassembled packets received
+        self.path_mtu_discovery = False  # if True, size packets by the smallest MTU on the path to the destination
+        self.path_mtu_D = {}  # destination address -> path MTU learned by discover_path_mtu
+        self.path_mtu_version = path_version  # path_version when path_mtu_D was last cleared
+        self.deliver = None  # optional callable, given the payload bytes of every fully reassembled packet
+        self.busy_poll = False  # if True, spin on the in interface instead of sleeping while it is empty
+        self.wakeup = threading.Event()
+        self.set_wakeup(self.wakeup)
 
     ## called when printing the object
     def __str__(self):
         return 'Host_%s' % (self.addr)
 
-    ## create a packet and enqueue for transmission
+    ## route readiness notifications of the in interfaces to wakeup
+    # @param wakeup: object with a set() method, called whenever a packet is put on an in interface
+    def set_wakeup(self, wakeup):
+        for intf in self.in_intf_L:
+            intf.ready = wakeup
+
+    ## use clock instead of time.monotonic to expire incomplete packets in the reassembler, and instead of time.time
+    # for the captures of the interfaces
+    # @param clock: function returning the current time in seconds
+    def set_clock(self, clock):
+        self.reassembler.clock = clock
+        set_capture_clock(self.in_intf_L + self.out_intf_L, clock)
+
+    ## one unit of work, for runtimes that drive the host without run()
+    # @return True if any work was done
+    def step(self):
+        return self.udt_receive()
+
+    ## drop the path MTUs learned so far, after a change of the out interface or its MTU (e.g. by Link.set_mtu)
+    # Hosts keep no forwarding information base, but their path MTUs depend on the same routes and MTUs as one.
+    def invalidate_fib(self):
+        invalidate_paths()
+
+    ## learn the smallest MTU on the path to a destination by following the links and routing tables from the out
+    # interface, and cache it in path_mtu_D
+    # The walk ends at the destination, at a node without a route or link, or after max_hops routers.
+    # @return the path MTU, or None if the out interface is not linked
+    def discover_path_mtu(self, dst_addr, max_hops=255):
+        # a link sets the MTU of the interfaces at both of its ends, so the out interfaces on the path cover all links
+        intf = self.out_intf_L[0]
+        path_mtu = intf.mtu
+        for _ in range(max_hops):
+            if intf.link is None:
+                break
+            node = intf.link.to_node
+            routing_table = getattr(node, 'routing_table', None)  # None for hosts and remote nodes
+            out_intf_num = None if routing_table is None else routing_table.get(dst_addr)
+            if out_intf_num is None:
+                break
+            intf = node.out_intf_L[out_intf_num]
+            if intf.mtu is not None:
+                path_mtu = min(path_mtu, intf.mtu)
+        self.path_mtu_D[dst_addr] = path_mtu
+        return path_mtu
+
+    ## @return id of the next packet sent, made of the host address and a count, so the ids of different hosts
+    # differ and reassembly by pkt_id cannot mix up their fragments
+    # In the text format the address fills the first dst_addr_S_length digits of the pkt_id field and the count the
+    # others; in the binary format they are the high and low 16 bits. The count wraps once it fills its part.
+    def next_pkt_id(self):
+        count = self.id_count
+        self.id_count += 1
+        if self.wire_format == 'binary':
+            return (self.addr << 16) | (count & 0xFFFF)
+        count_range = 10 ** (NetworkPacket.pkt_id_S_length - NetworkPacket.dst_addr_S_length)
+        return self.addr * count_range + count % count_range
+
+    ## split data into packets that fit the out interface MTU, or the path MTU with path_mtu_discovery
     # @param dst_addr: destination address for the packet
     # @param data_S: data being transmitted to the network layer
+    # @return list of encoded packets
+    def packetize(self, dst_addr, data_S):
+        mtu = self.out_intf_L[0].mtu
+        if self.path_mtu_discovery:
+            if self.path_mtu_version != path_version:
+                # a route or MTU changed somewhere, learn the path MTUs again
+                self.path_mtu_D.clear()
+                self.path_mtu_version = path_version
+            mtu = self.path_mtu_D.get(dst_addr) or self.discover_path_mtu(dst_addr)
+        if self.wire_format == 'binary' and isinstance(data_S, str):
+            data_S = data_S.encode()  # size binary packets in bytes
+        max_load = (len(data_S) or 1) if mtu is None else mtu - NetworkPacket.header_length_of(self.wire_format)
+        if max_load <= 0:
+            raise ValueError('%s: mtu %d cannot hold a packet header' % (self, mtu))
+        trace = log.enabled(log.TRACE)
+        pkt_L = []
+        for offset in range(0, len(data_S) or 1, max_load):
+            p = NetworkPacket(dst_addr, data_S[offset:offset + max_load], self.next_pkt_id())
+            if trace:
+                log.trace('%s: sending packet "%s" on the out interface with mtu=%s', self, p, mtu)
+            pkt_L.append(p.encode(self.wire_format))
+        return pkt_L
+
+    ## create packets and enqueue them for transmission
+    # An unbounded Interface takes every packet; a bounded out interface (e.g. a RingInterface) drops the packets of
+    # a burst that do not fit, counted in its drop_count, rather than raising queue.Full.
+    # @param dst_addr: destination address for the packet
+    # @param data_S: data being transmitted to the network layer
+    # @return number of packets enqueued
     def udt_send(self, dst_addr, data_S):
+        return self.send_pkts(self.packetize(dst_addr, data_S))
 
-        # splits up packet into two pieces to be able to forward them through the host's out interface
-        packet_len = len(data_S) // 2
-        pkt_id = str(self.addr) + str(self.id_count)
-        p = NetworkPacket(dst_addr, data_S[:packet_len], pkt_id)
-        print('%s: sending packet "%s" on the out interface with mtu=%d' % (self, p, self.out_intf_L[0].mtu))
-        self.out_intf_L[0].put(p.to_byte_S())  # send packets always enqueued successfully
-        self.id_count += 1
-        pkt_id = str(self.addr) + str(self.id_count)
-        p = NetworkPacket(dst_addr, data_S[packet_len:], pkt_id)
-        print('%s: sending packet "%s" on the out interface with mtu=%d' % (self, p, self.out_intf_L[0].mtu))
-        self.out_intf_L[0].put(p.to_byte_S())  # send packets always enqueued successfully
+    ## create the packets of many messages and enqueue all of them with one put_many, so with one lock acquisition
+    # of the out interface
+    # @param msg_L: iterable of (dst_addr, data_S); the same data object may be passed for many messages
+    # @return number of packets enqueued
+    def udt_send_many(self, msg_L):
+        pkt_L = []
+        for dst_addr, data_S in msg_L:
+            pkt_L.extend(self.packetize(dst_addr, data_S))
+        return self.send_pkts(pkt_L)
+
+    ## enqueue encoded packets on the out interface, as many as fit
+    # @return number of packets enqueued
+    def send_pkts(self, pkt_L):
+        sent = self.out_intf_L[0].put_many(pkt_L, partial=True)
+        self.snd_pkt_count += sent
+        if sent < len(pkt_L):
+            log.warn('%s: %d of %d packets lost on the full out interface', self, len(pkt_L) - sent, len(pkt_L))
+        return sent
 
 
     ## receive packet from the network layer
+    # @return True if a packet was taken off the in interface
     def udt_receive(self):
         pkt_S = self.in_intf_L[0].get()
-        # if there's an incoming packet start building up fragmented packets into a buffer until all fragments have
-        # been received, then print packet that and clear said buffer
+        # if there's an incoming packet place the fragment by its offset until all fragments of the packet
+        # have been received, then print the packet
         if pkt_S is not None:
-            frag_pkt = NetworkPacket.from_byte_S(pkt_S)
-            pkt_id = int(frag_pkt.pkt_id)
-            if pkt_id in self.frag_pkt_buffer.keys():
-                self.frag_pkt_buffer[pkt_id].append(frag_pkt.data_S)
-            else:
-                self.frag_pkt_buffer[pkt_id] = [frag_pkt.data_S]
-            if frag_pkt.frag_flag == "0":
-                frag_list = self.frag_pkt_buffer[pkt_id]
-                del self.frag_pkt_buffer[pkt_id]
-                print('%s: received packet "%s" on the in interface' % (self, ''.join(frag_list)))
+            frag_pkt = NetworkPacket.decode(pkt_S)
+            data_B = frag_pkt.data_S
+            if isinstance(data_B, str):
+                data_B = data_B.encode()  # text payloads are ASCII, so character offsets are byte offsets
+            data_B = self.reassembler.add(frag_pkt.pkt_id, frag_pkt.frag_offset, frag_pkt.frag_flag, data_B)
+            if data_B is not None:
+                self.rcv_pkt_count += 1
+                if log.enabled(log.TRACE):  # skip decoding the payload when tracing is off
+                    log.trace('%s: received packet "%s" on the in interface', self, data_B.decode())
+                if self.deliver is not None:
+                    self.deliver(data_B)
+            # counted once handled, like Router.rcv_pkt_count
+            self.rcv_frag_count += 1
+            return True
+        return False
 
     ## thread target for the host to keep receiving data
     def run(self):
-        print(threading.currentThread().getName() + ': Starting')
+        log.info('%s: Starting', threading.currentThread().getName())
         while True:
+            # clear before receiving, so a packet put while we work wakes up the next wait
+            self.wakeup.clear()
             # receive data arriving to the in interface
-            self.udt_receive()
+            busy = self.udt_receive()
             # terminate
             if (self.stop):
-                print(threading.currentThread().getName() + ': Ending')
+                log.info('%s: Ending', threading.currentThread().getName())
                 return
+            # sleep until a packet arrives
+            if not busy and not self.busy_poll:
+                self.wakeup.wait(idle_timeout)
+
+
+## Forwarding record of a destination, prebuilt from the routing table and the out interface
+class FibEntry:
+    __slots__ = ('out_intf_num', 'out_intf', 'mtu', 'max_load_S', 'max_load_B')
+
+    def __init__(self, out_intf_num, out_intf):
+        self.out_intf_num = out_intf_num
+        self.out_intf = out_intf
+        self.mtu = math.inf if out_intf.mtu is None else out_intf.mtu  # longer packets are fragmented
+        # largest fragment payload of text and binary packets, not positive if the mtu cannot hold a header
+        self.max_load_S = self.mtu - NetworkPacket.header_length
+        self.max_load_B = self.mtu - NetworkPacket.header_length_B
 
 
 ## Implements a multi-interface router described in class
 class Router:
+    ## most records kept in the forwarding information base
+    fib_max_size = 1 << 16
 
     ##@param name: friendly router name for debugging
     # @param intf_count: the number of input and output interfaces
     # @param max_queue_size: max queue length (passed to Interface)
-    # @param routing_table: routing table for router
+    # @param routing_table: routing table for router, a dict of destination address -> out interface number
+    #   or a routing.RoutingTable for prefix, range and default routes
     def __init__(self, name, intf_count, max_queue_size, routing_table):
         self.stop = False  # for thread termination
         self.name = name
         # create a list of interfaces
-        self.in_intf_L = [Interface(max_queue_size) for _ in range(intf_count)]
-        self.out_intf_L = [Interface(max_queue_size) for _ in range(intf_count)]
+        self.in_intf_L = [interface_class(max_queue_size) for _ in range(intf_count)]
+        self.out_intf_L = [interface_class(max_queue_size) for _ in range(intf_count)]
+        self.fib_D = None  # forwarding information base, destination address -> FibEntry, None until compiled
+        self.fib_version = None  # version of the routing table the forwarding information base was compiled from
         self.routing_table = routing_table
+        self.batch_size = 1  # max packets taken off each in interface per forward call
+        # counters
+        self.rcv_pkt_count = 0  # packets taken off the in interfaces and forwarded, fragmented or dropped
+        self.fwd_pkt_count = 0  # packets and fragments enqueued on the out interfaces
+        self.frag_pkt_count = 0  # packets that had to be fragmented
+        self.frag_count = 0  # fragments produced
+        self.drop_pkt_count = 0  # packets and fragments lost on a full out interface
+        self.no_route_count = 0  # packets without forwarding information
+        self.mtu_drop_count = 0  # packets dropped since the out mtu cannot hold a header
+        self.busy_poll = False  # if True, spin on the in interfaces instead of sleeping while they are empty
+        self.wakeup = threading.Event()
+        self.set_wakeup(self.wakeup)
 
     ## called when printing the object
     def __str__(self):
         return 'Router_%s' % (self.name)
 
+    ## routing table of the router, replacing it invalidates the forwarding information base
+    @property
+    def routing_table(self):
+        return self._routing_table
+
+    @routing_table.setter
+    def routing_table(self, routing_table):
+        self._routing_table = routing_table
+        self.invalidate_fib()
+
+    ## add or replace the route to dst_addr, invalidating the forwarding information base
+    # Changes made to a dict routing table directly must be followed by invalidate_fib(); a routing.RoutingTable
+    # counts its changes, so the router notices them by itself.
+    def set_route(self, dst_addr, out_intf_num):
+        self.routing_table[dst_addr] = out_intf_num
+        self.invalidate_fib()
+
+    ## remove the route to dst_addr, invalidating the forwarding information base
+    def remove_route(self, dst_addr):
+        del self.routing_table[dst_addr]
+        self.invalidate_fib()
+
+    ## have the next forward call compile the forwarding information base again, after a change of the routes,
+    # of an out interface MTU or of the out interfaces themselves (e.g. by a link or qdisc.attach), and have hosts
+    # learn their path MTUs again
+    def invalidate_fib(self):
+        self.fib_D = None
+        invalidate_paths()
+
+    ## compile the forwarding information base from the routing table and the out interfaces
+    # Every destination of a dict routing table gets its record now; the destinations of a routing.RoutingTable,
+    # which may route whole address ranges, get theirs when first looked up.
+    # @return the new forwarding information base
+    def compile_fib(self):
+        self.fib_D = {}
+        version = getattr(self.routing_table, 'version', None)
+        if version != self.fib_version:
+            invalidate_paths()  # the routes of a routing.RoutingTable changed, which calls no invalidate_fib
+        self.fib_version = version
+        if isinstance(self.routing_table, dict):
+            for dst_addr in self.routing_table:
+                self.fib_lookup(dst_addr)
+        return self.fib_D
+
+    ## look up the route to dst_addr and record it in the forwarding information base
+    # @return the FibEntry, None if there is no route
+    def fib_lookup(self, dst_addr):
+        out_intf_num = self.routing_table.get(dst_addr)
+        if out_intf_num is None:
+            return None
+        if len(self.fib_D) >= self.fib_max_size:
+            self.fib_D.clear()  # many destinations of a range route, start over rather than grow without bound
+        entry = self.fib_D[dst_addr] = FibEntry(out_intf_num, self.out_intf_L[out_intf_num])
+        return entry
+
+    ## route readiness notifications of the in interfaces to wakeup
+    # @param wakeup: object with a set() method, called whenever a packet is put on an in interface
+    def set_wakeup(self, wakeup):
+        for intf in self.in_intf_L:
+            intf.ready = wakeup
+
+    ## use clock instead of time.time for the captures of the interfaces
+    # @param clock: function returning the current time in seconds
+    def set_clock(self, clock):
+        set_capture_clock(self.in_intf_L + self.out_intf_L, clock)
+
+    ## @return dict of drop reason -> packets dropped by the out interfaces, at enqueue or (for queue disciplines
+    # such as qdisc.CoDel) at dequeue; full plain interfaces count as 'tail_drop'
+    def queue_drop_counts(self):
+        drop_D = collections.Counter()
+        for intf in self.out_intf_L:
+            if hasattr(intf, 'drop_D'):
+                drop_D.update(intf.drop_D)
+            elif intf.drop_count:
+                drop_D['tail_drop'] += intf.drop_count
+        return dict(drop_D)
+
+    ## one unit of work, for runtimes that drive the router without run()
+    # @return True if any work was done
+    def step(self):
+        return self.forward()
+
     ## look through the content of incoming interfaces and forward to
     # appropriate outgoing interfaces
+    # @return True if a packet was taken off any in interface
     def forward(self):
+        busy = False
+        fib_D = self.fib_D
+        if fib_D is None or self.fib_version != getattr(self.routing_table, 'version', None):
+            fib_D = self.compile_fib()
+        trace = log.enabled(log.TRACE)
         for i in range(len(self.in_intf_L)):
-            pkt_S = None
-            try:
-                # get packet from interface i
-                pkt_S = self.in_intf_L[i].get()
-                # if packet exists make a forwarding decision
-                if pkt_S is not None:
-                    p = NetworkPacket.from_byte_S(pkt_S)  # parse a packet out
-                    fwd_out_intf = self.routing_table.get(int(p.dst_addr))  # lookup forwarding out interface num
-                    if fwd_out_intf is None:
-                        print("There is no forwarding information for such destination.")
+            # get up to batch_size packets from interface i, so a busy interface cannot starve the others
+            pkt_L = self.in_intf_L[i].get_many(self.batch_size)
+            if not pkt_L:
+                continue
+            busy = True
+            out_pkt_D = {}  # out interface -> packets to enqueue on it
+            # make a forwarding decision for every packet of the batch
+            for pkt_S in pkt_L:
+                # lookup the forwarding record from the header only
+                dst_addr = NetworkPacket.peek_dst_addr(pkt_S)
+                entry = fib_D.get(dst_addr)
+                if entry is None:
+                    entry = self.fib_lookup(dst_addr)
+                    if entry is None:
+                        self.no_route_count += 1
+                        log.warn("There is no forwarding information for such destination.")
+                        continue
+                # begin fragmentation if current packet exceeds the out interface mtu
+                if len(pkt_S) > entry.mtu:
+                    # max load of data the out interface can handle
+                    max_load = entry.max_load_S if pkt_S.__class__ is str else entry.max_load_B
+                    if max_load <= 0:
+                        self.mtu_drop_count += 1
+                        log.warn('%s: packet "%s" dropped, mtu %d too small for the header', self, pkt_S, entry.mtu)
+                        continue
+                    # split the encoded packet, which may be a fragment already, keeping its offset and flag
+                    try:
+                        frag_L = NetworkPacket.fragment_encoded(pkt_S, max_load)
+                    except ValueError as e:  # a fragment offset outgrows the text header field
+                        self.mtu_drop_count += 1
+                        log.warn('%s: packet "%s" dropped, cannot be fragmented for mtu %d: %s',
+                                 self, pkt_S, entry.mtu, e)
                         continue
-                    # calculate max load of data interface can handle
-                    max_load = self.out_intf_L[fwd_out_intf].mtu - NetworkPacket.header_length
-                    buffer = p.data_S
-                    # begin fragmentation if current packet's data length exceeds max load
-                    if len(buffer) > max_load:
-                        frag_flag = 1
-                        frag_offset = 0
-                        buffer = p.data_S
-
-                        # iterates over buffer sending packet fragments until end of packet
-                        while len(buffer) > 0:
-                            if len(buffer) <= max_load:  # checks if last fragment in packet
-                                frag_flag = 0
-                            # creates fragment packet and forwards fragment
-                            frag_pkt = NetworkPacket(p.dst_addr, buffer[:max_load], p.pkt_id, frag_flag, frag_offset)
-                            print('%s: forwarding packet "%s" from interface %d to %d with mtu %d' \
-                                  % (self, frag_pkt, i, fwd_out_intf, self.out_intf_L[fwd_out_intf].mtu))
-                            self.out_intf_L[fwd_out_intf].put(frag_pkt.to_byte_S())
-
-                            buffer = buffer[max_load:]
-                            frag_offset += len(buffer[:max_load])
-
-                    # otherwise just forward packet
-                    else:
-                        print('%s: forwarding packet "%s" from interface %d to %d with mtu %d' \
-                              % (self, p, i, fwd_out_intf, self.out_intf_L[fwd_out_intf].mtu))
-                        self.out_intf_L[fwd_out_intf].put(p.to_byte_S())
-
-            except queue.Full:
-                print('%s: packet "%s" lost on interface %d' % (self, p, i))
-                pass
+                    self.frag_pkt_count += 1
+                    self.frag_count += len(frag_L)
+                # otherwise just forward packet as it came in
+                else:
+                    frag_L = [pkt_S]
+                if trace:
+                    for frag_S in frag_L:
+                        log.trace('%s: forwarding packet "%s" from interface %d to %d with mtu %s',
+                                  self, frag_S, i, entry.out_intf_num, entry.mtu)
+                out_pkt = out_pkt_D.get(entry.out_intf)
+                if out_pkt is None:
+                    out_pkt_D[entry.out_intf] = frag_L
+                else:
+                    out_pkt.extend(frag_L)
+            # enqueue everything headed for the same out interface as one batch, dropping what does not fit
+            for out_intf, out_pkt_L in out_pkt_D.items():
+                sent = out_intf.put_many(out_pkt_L, partial=True)
+                self.fwd_pkt_count += sent
+                self.drop_pkt_count += len(out_pkt_L) - sent
+                for pkt_S in out_pkt_L[sent:]:
+                    log.warn('%s: packet "%s" lost on interface %d', self, pkt_S, i)
+            # counted once handled, so the packets put on the in interfaces but not counted yet are still in the router
+            self.rcv_pkt_count += len(pkt_L)
+        return busy
 
     ## thread target for the host to keep forwarding data
     def run(self):
-        print(threading.currentThread().getName() + ': Starting')
+        log.info('%s: Starting', threading.currentThread().getName())
         while True:
-            self.forward()
+            # clear before forwarding, so a packet put while we work wakes up the next wait
+            self.wakeup.clear()
+            busy = self.forward()
             if self.stop:
-                print(threading.currentThread().getName() + ': Ending')
+                log.info('%s: Ending', threading.currentThread().getName())
                 return
+            # sleep until a packet arrives
+            if not busy and not self.busy_poll:
+                self.wakeup.wait(idle_timeout)
@@ -0,0 +1,305 @@
+'''
+Queue disciplines for router out interfaces: tail drop FIFO with packet and byte limits, RED, CoDel and strict
+priority classes.
+
+A discipline decides which packets to queue and which to drop, and counts its drops by reason in drop_D, so the
+router owning the interface can report them (Router.queue_drop_counts). QdiscInterface wraps a discipline in the
+Interface API; attach() puts one on an out interface of a Host or Router.
+'''
+
+import collections
+import math
+import queue
+import random
+import threading
+import time
+
+import network_3 as network
+
+
+## First in first out queue that drops arriving packets beyond limit packets or max_bytes bytes
+class FIFO:
+
+    ##@param limit: most packets queued, 0 for no limit
+    # @param max_bytes: most bytes queued, 0 for no limit
+    def __init__(self, limit=0, max_bytes=0):
+        self.limit = limit
+        self.max_bytes = max_bytes
+        self.pkt_Q = collections.deque()  # (enqueue time, packet)
+        self.byte_count = 0
+        self.drop_D = collections.Counter()  # drop reason -> packets dropped
+
+    def __len__(self):
+        return len(self.pkt_Q)
+
+    ## count a dropped packet under reason
+    def drop(self, pkt, reason):
+        self.drop_D[reason] += 1
+
+    ## @return reason for tail dropping a packet of length size arriving now, None if it fits
+    def full(self, size):
+        if self.limit and len(self.pkt_Q) >= self.limit:
+            return 'tail_drop'
+        if self.max_bytes and self.byte_count + size > self.max_bytes:
+            return 'byte_limit'
+        return None
+
+    ## queue pkt unless the discipline drops it
+    # @param now: current time in seconds
+    # @return True if pkt was queued
+    def enqueue(self, pkt, now):
+        reason = self.full(len(pkt))
+        if reason is not None:
+            self.drop(pkt, reason)
+            return False
+        self.pkt_Q.append((now, pkt))
+        self.byte_count += len(pkt)
+        return True
+
+    ## @return the next packet to transmit, or None if the queue is empty
+    def dequeue(self, now):
+        if not self.pkt_Q:
+            return None
+        pkt = self.pkt_Q.popleft()[1]
+        self.byte_count -= len(pkt)
+        return pkt
+
+
+## Random early detection: drops arriving packets with a probability growing with the average queue length, so
+# that flows back off one at a time instead of all at once when the queue overflows
+class RED(FIFO):
+
+    ##@param min_th: average queue length (packets) from which packets are dropped early
+    # @param max_th: average queue length from which every arriving packet is dropped
+    # @param max_p: drop probability at an average queue length of max_th
+    # @param weight: weight of the current queue length in the moving average
+    # @param seed: seed of the random generator deciding early drops
+    def __init__(self, min_th=5, max_th=15, max_p=0.1, weight=0.002, limit=0, max_bytes=0, seed=None):
+        super().__init__(limit, max_bytes)
+        self.min_th = min_th
+        self.max_th = max_th
+        self.max_p = max_p
+        self.weight = weight
+        self.avg = 0.0  # moving average of the queue length
+        self.count = 0  # packets queued since the last early drop
+        self.rng = random.Random(seed)
+
+    def enqueue(self, pkt, now):
+        self.avg += self.weight * (len(self.pkt_Q) - self.avg)
+        if self.avg >= self.max_th:
+            self.count = 0
+            self.drop(pkt, 'red_forced')
+            return False
+        if self.avg >= self.min_th:
+            self.count += 1
+            p_b = self.max_p * (self.avg - self.min_th) / (self.max_th - self.min_th)
+            # spread early drops evenly instead of letting them cluster
+            p_a = 1.0 if self.count * p_b >= 1 else p_b / (1 - self.count * p_b)
+            if self.rng.random() < p_a:
+                self.count = 0
+                self.drop(pkt, 'red_early')
+                return False
+        else:
+            self.count = 0
+        return super().enqueue(pkt, now)
+
+
+## Controlled delay (RFC 8289): drops packets at dequeue once they have been queued longer than target for a whole
+# interval, at a rate rising with the square root of the drop count until the queueing delay is back under target
+class CoDel(FIFO):
+
+    ##@param target: acceptable queueing delay in seconds
+    # @param interval: seconds the delay may stay above target before dropping starts, about a round trip time
+    def __init__(self, target=0.005, interval=0.1, limit=0, max_bytes=0):
+        super().__init__(limit, max_bytes)
+        self.target = target
+        self.interval = interval
+        self.first_above_time = 0.0  # time at which the delay has been above target for an interval, 0 if below
+        self.drop_next = 0.0  # time of the next drop while dropping
+        self.count = 0  # drops since dropping started
+        self.last_count = 0
+        self.dropping = False
+
+    ## @return time of the next drop, closer together the more drops there have been
+    def control_law(self, t):
+        return t + self.interval / math.sqrt(self.count)
+
+    ## dequeue and tell whether the packet may be dropped, which it may if the delay stayed above target
+    # @return packet or None, and True if it may be dropped
+    def dequeue_checked(self, now):
+        if not self.pkt_Q:
+            self.first_above_time = 0.0
+            return None, False
+        enqueue_time, pkt = self.pkt_Q.popleft()
+        self.byte_count -= len(pkt)
+        if now - enqueue_time < self.target or not self.pkt_Q:
+            self.first_above_time = 0.0
+            return pkt, False
+        if self.first_above_time == 0.0:
+            self.first_above_time = now + self.interval
+            return pkt, False
+        return pkt, now >= self.first_above_time
+
+    def dequeue(self, now):
+        pkt, ok_to_drop = self.dequeue_checked(now)
+        if pkt is None:
+            self.dropping = False
+            return None
+        if self.dropping:
+            if not ok_to_drop:
+                self.dropping = False
+            while self.dropping and now >= self.drop_next:
+                self.drop(pkt, 'codel')
+                self.count += 1
+                pkt, ok_to_drop = self.dequeue_checked(now)
+                if pkt is None:
+                    self.dropping = False
+                    return None
+                if not ok_to_drop:
+                    self.dropping = False
+                else:
+                    self.drop_next = self.control_law(self.drop_next)
+        elif ok_to_drop:
+            self.drop(pkt, 'codel')
+            pkt, _ = self.dequeue_checked(now)
+            self.dropping = True
+            # resume near the last drop rate if dropping stopped only a short while ago
+            delta = self.count - self.last_count
+            self.count = delta if delta > 1 and now - self.drop_next < 16 * self.interval else 1
+            self.drop_next = self.control_law(now)
+            self.last_count = self.count
+        return pkt
+
+
+## Strict priority between bands, each a queue discipline of its own: a packet is only sent while all bands of
+# higher priority are empty
+class StrictPriority:
+
+    ##@param band_L: queue disciplines, highest priority first
+    # @param classify: function of an encoded packet returning the index of its band in band_L
+    def __init__(self, band_L, classify):
+        self.band_L = band_L
+        self.classify = classify
+
+    def __len__(self):
+        return sum(len(band) for band in self.band_L)
+
+    ## drop reason -> packets dropped by all bands
+    @property
+    def drop_D(self):
+        return sum((band.drop_D for band in self.band_L), collections.Counter())
+
+    def enqueue(self, pkt, now):
+        return self.band_L[self.classify(pkt)].enqueue(pkt, now)
+
+    def dequeue(self, now):
+        for band in self.band_L:
+            if len(band):
+                return band.dequeue(now)
+        return None
+
+
+## @return StrictPriority classifier putting packets to the addresses in band_D (address -> band) in their band,
+# and all other packets in band default
+def classify_by_dst(band_D, default):
+    peek_dst_addr = network.NetworkPacket.peek_dst_addr
+    return lambda pkt: band_D.get(peek_dst_addr(pkt), default)
+
+
+## Interface whose packets are queued by a queue discipline
+# It has the API of network_3.Interface; a lock serializes the discipline between the producer and consumer.
+class QdiscInterface:
+
+    ##@param qdisc: queue discipline, e.g. FIFO, RED, CoDel or StrictPriority
+    def __init__(self, qdisc):
+        self.mtu = None
+        self.qdisc = qdisc
+        self.lock = threading.Lock()
+        self.link = None  # Link transmitting from this interface, set by the link
+        self.ready = None  # readiness notification of the consumer (e.g. threading.Event), set on every put
+        self.clock = time.monotonic  # seconds, replaced by runtimes with a virtual clock
+        self.capture = None  # capture.Capture recording the packets offered, set by capture.attach
+        self.put_count = 0  # packets enqueued
+        self.get_count = 0  # packets dequeued, counted with the lock held so qsize() and get_count agree
+
+    ## drop reason -> packets dropped by the queue discipline
+    @property
+    def drop_D(self):
+        return self.qdisc.drop_D
+
+    ## packets dropped by the queue discipline, at enqueue or dequeue
+    @property
+    def drop_count(self):
+        return sum(self.qdisc.drop_D.values())
+
+    ## get the next packet the discipline sends
+    # @param block - if True, poll for a packet to arrive, if False return None right away when empty
+    # @param timeout - when blocking, give up and return None after timeout seconds
+    def get(self, block=False, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                pkt = self.qdisc.dequeue(self.clock())
+                if pkt is not None:
+                    self.get_count += 1
+            if pkt is not None or not block or (deadline is not None and time.monotonic() >= deadline):
+                return pkt
+            time.sleep(0.0001)
+
+    ## get up to max_count packets with a single lock acquisition
+    def get_many(self, max_count):
+        pkt_L = []
+        with self.lock:
+            now = self.clock()
+            while len(pkt_L) < max_count:
+                pkt = self.qdisc.dequeue(now)
+                if pkt is None:
+                    break
+                pkt_L.append(pkt)
+            self.get_count += len(pkt_L)
+        return pkt_L
+
+    ## offer the packet to the discipline
+    # @param block - ignored, a discipline decides right away
+    # throws queue.Full if the discipline drops the packet
+    def put(self, pkt, block=False):
+        if not self.put_many([pkt], partial=True):
+            raise queue.Full
+
+    ## offer a batch of packets to the discipline with a single lock acquisition
+    # @param partial - if False, throw queue.Full if the discipline dropped any packet of the batch; unlike
+    #   Interface the others stay queued, since disciplines drop by their own rules rather than for lack of room
+    # @return number of packets queued
+    def put_many(self, pkt_L, partial=False):
+        with self.lock:
+            now = self.clock()
+            count = sum(self.qdisc.enqueue(pkt, now) for pkt in pkt_L)
+        self.put_count += count
+        if self.capture is not None:
+            self.capture.write_many(pkt_L)  # as offered, dropped packets included
+        if count and self.ready is not None:
+            self.ready.set()
+        if count < len(pkt_L) and not partial:
+            raise queue.Full
+        return count
+
+    ## @return number of packets queued
+    def qsize(self):
+        with self.lock:
+            return len(self.qdisc)
+
+
+## queue the packets of out interface intf_num of a Host or Router by qdisc
+# The interface is replaced by a QdiscInterface, which takes over its MTU, Link, readiness notification and capture.
+# @return the new interface
+def attach(node, intf_num, qdisc):
+    old_intf = node.out_intf_L[intf_num]
+    intf = QdiscInterface(qdisc)
+    intf.mtu, intf.link, intf.ready = old_intf.mtu, old_intf.link, old_intf.ready
+    intf.capture = getattr(old_intf, 'capture', None)
+    if intf.link is not None:
+        intf.link.in_intf = intf
+    node.out_intf_L[intf_num] = intf
+    if hasattr(node, 'invalidate_fib'):
+        node.invalidate_fib()  # its forwarding records hold the replaced interface
+    return intf
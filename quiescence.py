@@ -0,0 +1,79 @@
+'''
+Detection of network quiescence, so a simulation can end as soon as every packet has been delivered or dropped.
+
+The network is quiescent when no packet is queued on an interface, held by a Host, Router or Link between taking
+it off an interface and passing it on (a Link also holds the packets in its delay line), or buffered for
+reassembly, and no traffic source has sends pending. Once quiescent it stays so, since nothing but a source can
+put a packet. Packets held by an object are counted from its input interfaces' get_count and the counters it
+updates once a packet is handled, so a packet is never missed while it moves between objects.
+'''
+
+import log
+
+
+## Tells whether the objects of a simulation have gone quiet, to be polled by the runtimes' wait(until=...)
+class QuiescenceDetector:
+
+    ##@param object_L: Hosts, Routers and LinkLayers of the simulation
+    # @param source_L: traffic sources, e.g. traffic.TrafficGenerator or replay.Replay, whose finished attribute
+    #   is True once they have nothing left to send
+    def __init__(self, object_L, source_L=()):
+        self.host_L = [o for o in object_L if hasattr(o, 'reassembler')]
+        self.router_L = [o for o in object_L if hasattr(o, 'routing_table')]
+        self.in_intf_S = {intf for o in self.host_L + self.router_L for intf in o.in_intf_L}
+        self.link_L = [l for o in object_L for l in getattr(o, 'link_L', [])]
+        self.intf_L = [intf for o in self.host_L + self.router_L for intf in o.in_intf_L + o.out_intf_L]
+        # out interfaces without a link are never drained, so what is queued there stays for good
+        self.drained_intf_L = [intf for intf in self.intf_L if intf in self.in_intf_S or intf.link is not None]
+        self.source_L = list(source_L)
+        self.last_progress = None  # progress count of the previous quiet check, None if it was not quiet
+
+    ## @return total packets ever put on an interface, which grows with any movement of packets
+    def progress(self):
+        return sum(intf.put_count for intf in self.intf_L)
+
+    ## @return True if nothing is queued, held or buffered right now
+    def quiet(self):
+        if not all(source.finished for source in self.source_L):
+            return False
+        # each object's handled counters are read before its queues, so a packet moving on cannot hide
+        for link in self.link_L:
+            if link.in_flight():
+                return False
+        for host in self.host_L:
+            rcv_frag_count = host.rcv_frag_count
+            if sum(intf.get_count for intf in host.in_intf_L) != rcv_frag_count:
+                return False
+            if not self.reassembly_done(host.reassembler):
+                return False
+        for router in self.router_L:
+            rcv_pkt_count = router.rcv_pkt_count
+            if sum(intf.get_count for intf in router.in_intf_L) != rcv_pkt_count:
+                return False
+        return not any(intf.qsize() for intf in self.drained_intf_L)
+
+    ## @return True if no packet is being reassembled, or all are waiting for fragments that can no longer
+    # arrive: the most recently updated one has passed the reassembler's timeout
+    @staticmethod
+    def reassembly_done(reassembler):
+        try:
+            if not reassembler.pkt_D:
+                return True
+            partial = next(reversed(reassembler.pkt_D.values()))
+        except (RuntimeError, StopIteration):
+            return False  # changed while looking, so not idle
+        return reassembler.clock() - partial.last_time >= reassembler.timeout
+
+    ## @return True once quiet twice in a row with no packet put in between
+    # The repeated check lets packets in the middle of a put_many, before it counted them, show up.
+    def idle(self):
+        before = self.progress()
+        if not self.quiet():
+            self.last_progress = None
+            return False
+        progress = self.progress()
+        if progress != before or progress != self.last_progress:
+            self.last_progress = progress
+            return False
+        log.info('Network quiescent after %d packets put on interfaces', progress)
+        return True
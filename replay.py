@@ -0,0 +1,248 @@
+'''
+Replay of recorded traffic traces into Hosts.
+
+A trace is a sequence of records (timestamp in seconds, source host address, destination address, payload), the
+payload being either a length, replayed with a synthetic payload of that many bytes, or the recorded bytes. Two
+file formats are read:
+- binary, written by TraceWriter: a magic header followed by records of a fixed size header and the payload bytes
+- text: one record per line, "timestamp,src_addr,dst_addr,length" or "timestamp,src_addr,dst_addr,length,payload"
+  with the payload in hex; commas or blanks separate the fields, lines starting with # are skipped
+
+TraceReader maps a window of the file at a time and moves it along as records are read, so a trace of any size is
+streamed with memory bounded by the window. Replay injects the records into the Hosts with the matching addresses
+at their recorded times, or scaled by speed, in a thread of its own on the wall clock or as events of a
+runtimes.EventRuntime on its virtual clock. Like traffic.TrafficGenerator it enqueues the messages due on a host
+with one Host.udt_send_many call. Text format hosts carry ASCII payloads only, so recorded payloads with other bytes
+are skipped for them.
+'''
+
+import mmap
+import struct
+import threading
+import time
+
+import log
+import traffic
+
+## first bytes of a binary trace
+magic_B = b'SIMTRACE'
+## binary record header: timestamp, source address, destination address, payload length, 1 if payload bytes follow
+record_struct = struct.Struct('<dIIIB')
+
+
+## Writes a binary trace record by record
+class TraceWriter:
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(magic_B)
+        self.pack = record_struct.pack
+
+    ## append a record
+    # @param payload: length of a synthetic payload, or the payload as bytes or str
+    def write(self, timestamp, src_addr, dst_addr, payload):
+        if isinstance(payload, int):
+            self.f.write(self.pack(timestamp, src_addr, dst_addr, payload, 0))
+            return
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.f.write(self.pack(timestamp, src_addr, dst_addr, len(payload), 1))
+        self.f.write(payload)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+## Iterates over the records of a binary or text trace through a sliding memory-mapped window
+# Yields (timestamp, src_addr, dst_addr, payload) with payload an int length or bytes.
+class TraceReader:
+
+    ##@param window: bytes of the file mapped at a time from the start of a record, rounded up to the allocation
+    #   granularity; every record (every line of a text trace) must fit in it. The mapping starts up to one granule
+    #   earlier, at the aligned offset mmap requires.
+    def __init__(self, path, window=64 << 20):
+        self.path = path
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.window = max(granularity, -(-window // granularity) * granularity)
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            self.f = f
+            self.size = f.seek(0, 2)
+            self.start, self.buf = 0, None
+            try:
+                if self.size >= len(magic_B) and self.buf_at(0, len(magic_B)) == magic_B:
+                    yield from self.read_binary()
+                else:
+                    yield from self.read_text()
+            finally:
+                if self.buf is not None:
+                    self.buf.close()
+                self.buf = None
+
+    ## map the window holding the length bytes at file position pos, moving it if needed
+    # @return offset of pos in self.buf
+    def map(self, pos, length):
+        if self.buf is None or pos < self.start or pos + length > self.start + len(self.buf):
+            if self.buf is not None:
+                self.buf.close()
+            self.start = pos - pos % mmap.ALLOCATIONGRANULARITY
+            # a full window from pos on, plus the bytes between the aligned start and pos
+            self.buf = mmap.mmap(self.f.fileno(), min(pos - self.start + self.window, self.size - self.start),
+                                 access=mmap.ACCESS_READ, offset=self.start)
+            if hasattr(self.buf, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                self.buf.madvise(mmap.MADV_SEQUENTIAL)  # let the kernel read ahead and drop pages behind
+            if pos + length > self.start + len(self.buf):
+                raise ValueError('%s: record at byte %d does not fit a %d byte window or is truncated'
+                                 % (self.path, pos, self.window))
+        return pos - self.start
+
+    ## @return the length bytes at file position pos
+    def buf_at(self, pos, length):
+        i = self.map(pos, length)
+        return self.buf[i:i + length]
+
+    def read_binary(self):
+        unpack_from, header_size = record_struct.unpack_from, record_struct.size
+        pos = len(magic_B)
+        while pos < self.size:
+            i = self.map(pos, header_size)
+            timestamp, src_addr, dst_addr, length, has_bytes = unpack_from(self.buf, i)
+            pos += header_size
+            if has_bytes:
+                yield timestamp, src_addr, dst_addr, self.buf_at(pos, length)
+                pos += length
+            else:
+                yield timestamp, src_addr, dst_addr, length
+
+    def read_text(self):
+        pos = 0
+        while pos < self.size:
+            i = self.map(pos, 1)
+            end = self.buf.find(b'\n', i)
+            if end < 0 and self.start + len(self.buf) < self.size:
+                # the line runs past the window, move the window to the start of the line
+                i = self.map(pos, min(self.window, self.size - pos))
+                end = self.buf.find(b'\n', i)
+                if end < 0 and self.start + len(self.buf) < self.size:
+                    raise ValueError('%s: line at byte %d does not fit a %d byte window' % (self.path, pos, self.window))
+            if end < 0:
+                end = len(self.buf)  # last line without a newline
+            line = self.buf[i:end].strip()
+            line_pos, pos = pos, self.start + end + 1
+            if not line or line.startswith(b'#'):
+                continue
+            field_L = line.replace(b',', b' ').split()
+            try:
+                timestamp, src_addr, dst_addr, length = float(field_L[0]), int(field_L[1]), int(field_L[2]), \
+                    int(field_L[3])
+                payload = bytes.fromhex(field_L[4].decode()) if len(field_L) > 4 else length
+            except (IndexError, ValueError):
+                raise ValueError('%s: malformed record at byte %d: %r' % (self.path, line_pos, line)) from None
+            yield timestamp, src_addr, dst_addr, payload
+
+
+## Injects the records of a trace into Hosts
+class Replay:
+
+    ##@param path: binary or text trace
+    # @param host_L: hosts sending the records, by address
+    # @param speed: replay speed relative to the recorded times, e.g. 2 for twice as fast
+    # @param tick: seconds between batches when replaying in a thread
+    # @param window: bytes of the trace mapped at a time
+    def __init__(self, path, host_L, speed=1.0, tick=0.001, window=64 << 20):
+        self.path = path
+        self.host_D = {host.addr: host for host in host_L}
+        self.speed = speed
+        self.tick = tick
+        self.record_I = iter(TraceReader(path, window))
+        self.next_record = next(self.record_I, None)
+        self.first_time = None if self.next_record is None else self.next_record[0]
+        self.stop = False
+        self.thread = None
+        self.sent_msg_count = 0
+        self.sent_pkt_count = 0
+        self.unknown_src_count = 0  # records of source addresses without a host
+        self.non_ascii_count = 0  # records of text format hosts skipped for payload bytes outside ASCII
+
+    ## @return seconds after the start at which the next record is due, None once the trace is exhausted
+    def next_due(self):
+        if self.next_record is None:
+            return None
+        return (self.next_record[0] - self.first_time) / self.speed
+
+    ## send the records due by elapsed seconds since the start
+    # @return False once the trace is exhausted
+    def send_due(self, elapsed):
+        due = elapsed * self.speed + self.first_time if self.next_record is not None else None
+        msg_L_D = {}  # host -> messages due
+        record = self.next_record
+        while record is not None and record[0] <= due:
+            timestamp, src_addr, dst_addr, payload = record
+            host = self.host_D.get(src_addr)
+            if host is None:
+                self.unknown_src_count += 1
+                log.warn('%s: no host with address %d, record at %f skipped', self, src_addr, timestamp)
+            elif isinstance(payload, int):
+                msg_L_D.setdefault(host, []).append((dst_addr, traffic.payload(payload, host.wire_format)))
+            elif host.wire_format == 'binary':
+                msg_L_D.setdefault(host, []).append((dst_addr, payload))
+            else:
+                # text packets are fragmented and reassembled by character offsets that must equal byte offsets
+                try:
+                    payload = bytes(payload).decode('ascii')
+                except UnicodeDecodeError:
+                    self.non_ascii_count += 1
+                    log.warn('%s: payload of the record at %f is not ASCII, skipped for text format %s',
+                             self, timestamp, host)
+                else:
+                    msg_L_D.setdefault(host, []).append((dst_addr, payload))
+            record = next(self.record_I, None)
+        for host, msg_L in msg_L_D.items():
+            self.sent_msg_count += len(msg_L)
+            self.sent_pkt_count += host.udt_send_many(msg_L)
+        self.next_record = record  # only now, so the replay does not look finished while sending
+        return record is not None
+
+    ## True once nothing is left to send, see quiescence.QuiescenceDetector
+    @property
+    def finished(self):
+        return self.next_record is None or self.stop
+
+    ## called when printing the object
+    def __str__(self):
+        return 'Replay of %s' % self.path
+
+    ## thread target, sends on the wall clock until the trace is exhausted or stop is set
+    def run(self):
+        start = time.monotonic()
+        while not self.stop and self.send_due(time.monotonic() - start):
+            time.sleep(max(self.tick, self.next_due() - (time.monotonic() - start)))
+
+    ## send from a thread of its own
+    def start(self):
+        self.stop = False
+        self.thread = threading.Thread(name='Replay', target=self.run, daemon=True)
+        self.thread.start()
+
+    ## wait for the trace to be exhausted, @param stop: if True, stop sending right away instead
+    def join(self, stop=False):
+        self.stop = stop
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    ## send as events of a runtimes.EventRuntime, every record at its virtual time from the current time
+    def schedule(self, event_runtime):
+        start = event_runtime.now
+        def send():
+            if not self.stop and self.send_due(event_runtime.now - start):
+                event_runtime.schedule(max(0, self.next_due() - (event_runtime.now - start)), send)
+        if self.next_record is not None:
+            event_runtime.schedule(0, send)
@@ -0,0 +1,98 @@
+'''
+Longest prefix match routing table, a drop-in replacement for the dict routing tables passed to network_3.Router
+'''
+
+
+## Routing table mapping destination addresses to out interface numbers by longest prefix match
+# Routes are kept in one hash table per prefix length, so a lookup probes at most addr_bits + 1 tables,
+# longest prefix first.
+class RoutingTable:
+
+    ##@param route_D: optional dict of destination host address -> out interface, as used by Router so far
+    # @param addr_bits: width of the destination addresses in bits
+    def __init__(self, route_D=None, addr_bits=16):
+        self.addr_bits = addr_bits
+        self.prefix_D_L = [{} for _ in range(addr_bits + 1)]  # per prefix length: network number -> out interface
+        self.length_L = []  # prefix lengths with at least one route, longest first
+        self.version = 0  # number of route changes, so routers know when to recompile their forwarding information
+        if route_D is not None:
+            for addr, out_intf in route_D.items():
+                self[addr] = out_intf
+
+    ## called when printing the object
+    def __str__(self):
+        return 'RoutingTable(%s)' % ', '.join('%d/%d: %d' % (prefix, prefix_len, out_intf)
+                                              for prefix, prefix_len, out_intf in self.routes())
+
+    ## add a route, replacing an existing route for the same prefix
+    # @param prefix: address whose first prefix_len bits select the routed destinations
+    # @param prefix_len: number of significant bits of prefix, 0 for a default route
+    # @param out_intf: out interface number for matching destinations
+    def add_route(self, prefix, prefix_len, out_intf):
+        if not 0 <= prefix_len <= self.addr_bits:
+            raise ValueError('prefix length %d outside 0..%d' % (prefix_len, self.addr_bits))
+        self.prefix_D_L[prefix_len][prefix >> (self.addr_bits - prefix_len)] = out_intf
+        self.version += 1
+        if prefix_len not in self.length_L:
+            self.length_L = sorted(self.length_L + [prefix_len], reverse=True)
+
+    ## remove the route for a prefix
+    # throws KeyError if there is no such route
+    def remove_route(self, prefix, prefix_len):
+        prefix_D = self.prefix_D_L[prefix_len]
+        del prefix_D[prefix >> (self.addr_bits - prefix_len)]
+        self.version += 1
+        if not prefix_D:
+            self.length_L.remove(prefix_len)
+
+    ## route the inclusive address range low..high, split into the fewest aligned prefixes covering it
+    def add_range(self, low, high, out_intf):
+        while low <= high:
+            # grow the prefix while low stays aligned to it and it does not pass high
+            size_bits = 0
+            while size_bits < self.addr_bits and low % (2 << size_bits) == 0 and low + (2 << size_bits) - 1 <= high:
+                size_bits += 1
+            self.add_route(low, self.addr_bits - size_bits, out_intf)
+            low += 1 << size_bits
+
+    ## route every destination not matched by a longer prefix to out_intf
+    def set_default(self, out_intf):
+        self.add_route(0, 0, out_intf)
+
+    ## @return out interface of the longest prefix matching addr, or default if no route matches
+    def get(self, addr, default=None):
+        if addr < 0 or addr >> self.addr_bits:
+            return default
+        for prefix_len in self.length_L:
+            out_intf = self.prefix_D_L[prefix_len].get(addr >> (self.addr_bits - prefix_len))
+            if out_intf is not None:
+                return out_intf
+        return default
+
+    ## @return list of (prefix, prefix_len, out_intf) of all routes, longest prefixes first
+    def routes(self):
+        return [(network << (self.addr_bits - prefix_len), prefix_len, out_intf)
+                for prefix_len in self.length_L for network, out_intf in sorted(self.prefix_D_L[prefix_len].items())]
+
+    ## dict style access, routing_table[addr] looks up like get and routing_table[addr] = intf adds a host route
+    def __getitem__(self, addr):
+        out_intf = self.get(addr)
+        if out_intf is None:
+            raise KeyError(addr)
+        return out_intf
+
+    def __setitem__(self, addr, out_intf):
+        self.add_route(addr, self.addr_bits, out_intf)
+
+    def __delitem__(self, addr):
+        self.remove_route(addr, self.addr_bits)
+
+    def __contains__(self, addr):
+        return self.get(addr) is not None
+
+    def __len__(self):
+        return sum(len(self.prefix_D_L[prefix_len]) for prefix_len in self.length_L)
+
+    ## not iterable: routes are prefixes rather than the addresses [] takes, list them with routes()
+    # Without this, iteration would probe __getitem__ with 0, 1, ... which a default route answers forever.
+    __iter__ = None
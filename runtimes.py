@@ -0,0 +1,386 @@
+'''
+Runtimes that drive the Host, Router and LinkLayer objects of a simulation.
+
+ThreadRuntime runs every object in its own thread, as the simulation scripts always did.
+EventRuntime is a single threaded discrete event engine: it steps objects from a priority queue of
+events on a virtual clock and ends when no events are left.
+AsyncRuntime runs every object as a coroutine on one asyncio event loop.
+PoolRuntime runs the steps of the objects with pending input on a small fixed pool of worker threads.
+'''
+
+import asyncio
+import collections
+import functools
+import heapq
+import itertools
+import threading
+import time
+import log
+
+## seconds between polls of the until callable of wait
+poll_interval = 0.01
+## seconds an idle PoolRuntime worker waits before checking for timers and stop again
+idle_timeout = 0.1
+
+
+## wait of the runtimes whose threads run on their own: sleep simulation_time seconds of wall time
+# @param until: callable polled every poll_interval seconds; returning True ends the wait early
+def wait_wall_clock(simulation_time, until=None):
+    if until is None:
+        time.sleep(simulation_time)
+        return
+    deadline = time.monotonic() + simulation_time
+    while not until() and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+
+
+## Runs each object's run() in a dedicated thread
+class ThreadRuntime:
+
+    def __init__(self):
+        self.object_L = []
+        self.thread_L = []
+
+    ## start a thread for every object
+    def start(self, object_L):
+        self.object_L = list(object_L)
+        self.thread_L = [threading.Thread(name=object.__str__(), target=object.run) for object in self.object_L]
+        for t in self.thread_L:
+            t.start()
+
+    ## give the network simulation_time seconds to transfer all packets
+    # @param until: callable polled while waiting, e.g. quiescence.QuiescenceDetector.idle; returning True ends the
+    #   wait early
+    def wait(self, simulation_time, until=None):
+        wait_wall_clock(simulation_time, until)
+
+    ## stop and join all threads, waking the idle ones so they need not wait out idle_timeout
+    def stop(self):
+        for o in self.object_L:
+            o.stop = True
+        for o in self.object_L:
+            if hasattr(o, 'wakeup'):
+                o.wakeup.set()
+        for t in self.thread_L:
+            t.join()
+        log.info("All simulation threads joined")
+        log.flush()
+
+
+## Schedules an object's step() whenever one of its input interfaces becomes ready
+class _StepEvent:
+
+    def __init__(self, runtime, object):
+        self.runtime = runtime
+        self.object = object
+        self.scheduled = False
+        self.timer_time = None  # virtual time of the pending timer step, None if there is none
+
+    ## called by Interface.put, schedule a step unless one is already pending
+    def set(self):
+        if not self.scheduled:
+            self.scheduled = True
+            self.runtime.schedule(self.runtime.step_time, self.fire)
+
+    ## run one step, and keep stepping while the object finds work
+    # An idle object with timed work (wait_time(), as of shaped links) gets a step when the wait is over.
+    def fire(self):
+        self.scheduled = False
+        if self.object.step():
+            self.set()
+            return
+        wait = self.object.wait_time() if hasattr(self.object, 'wait_time') else None
+        if wait is not None and (self.timer_time is None or self.runtime.now + wait < self.timer_time):
+            self.timer_time = self.runtime.now + wait
+            self.runtime.schedule(wait, self.fire_timer)
+
+    ## step of a timer set by fire
+    def fire_timer(self):
+        if self.timer_time is not None and self.runtime.now >= self.timer_time:
+            self.timer_time = None
+            self.set()
+
+
+## Single threaded discrete event runtime with a virtual clock
+class EventRuntime:
+
+    ##@param step_time: virtual time in seconds one step of an object takes
+    def __init__(self, step_time=1e-6):
+        self.step_time = step_time
+        self.now = 0.0  # virtual time
+        self.event_L = []  # heap of (time, sequence number, callback)
+        self.seq = itertools.count()  # breaks ties between simultaneous events in scheduling order
+
+    ## call callback after delay virtual seconds
+    def schedule(self, delay, callback):
+        heapq.heappush(self.event_L, (self.now + delay, next(self.seq), callback))
+
+    ## route readiness of every object's inputs to step events, and step each object once at the start
+    def start(self, object_L):
+        for o in object_L:
+            if hasattr(o, 'set_clock'):
+                o.set_clock(lambda: self.now)
+            step_event = _StepEvent(self, o)
+            o.set_wakeup(step_event)
+            step_event.set()
+
+    ## process events in time order until none are left
+    # @param simulation_time: virtual time limit, None to run until the event queue is empty
+    # @param until: callable polled every poll_interval virtual seconds; returning True ends the wait early, e.g.
+    #   while sources keep scheduling events that send nothing
+    def wait(self, simulation_time=None, until=None):
+        next_poll = self.now + poll_interval
+        while self.event_L:
+            if simulation_time is not None and self.event_L[0][0] > simulation_time:
+                return
+            self.now, _, callback = heapq.heappop(self.event_L)
+            callback()
+            if until is not None and self.now >= next_poll:
+                if until():
+                    return
+                next_poll = self.now + poll_interval
+
+    ## drop pending events
+    def stop(self):
+        self.event_L = []
+        log.info("Event queue empty at virtual time %.6f s", self.now)
+        log.flush()
+
+
+## Readiness notification of a coroutine of AsyncRuntime, which may be set from any thread
+# Interface.put sets it on the event loop for the simulated objects, but also in the threads of traffic sources
+# (traffic.TrafficGenerator, replay.Replay) and sharding readers, which must not touch the asyncio.Event directly.
+class _AsyncWakeup:
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def set(self):
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False  # no loop runs in this thread
+        if on_loop:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass  # the loop was closed by stop, nothing waits any more
+
+
+## Runs each object as a coroutine on a single asyncio event loop
+class AsyncRuntime:
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.object_L = []
+        self.wakeup_L = []
+        self.task_L = []
+
+    ## coroutine equivalent of the objects' run(), awaiting input while the object is idle
+    async def run(self, object, wakeup):
+        while not object.stop:
+            # clear before stepping, so a packet put while we work wakes up the next wait
+            wakeup.event.clear()
+            if object.step():
+                await asyncio.sleep(0)  # let the other objects run
+                continue
+            wait = object.wait_time() if hasattr(object, 'wait_time') else None
+            try:
+                # an object with timed work (wait_time(), as of shaped links) is stepped when the wait is over
+                await asyncio.wait_for(wakeup.event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    ## create a coroutine for every object, woken by an asyncio.Event set on every put to its inputs
+    def start(self, object_L):
+        self.object_L = list(object_L)
+        for o in self.object_L:
+            wakeup = _AsyncWakeup(self.loop)
+            o.set_wakeup(wakeup)
+            self.wakeup_L.append(wakeup)
+            self.task_L.append(self.loop.create_task(self.run(o, wakeup)))
+
+    ## run the event loop for simulation_time seconds
+    # @param until: callable polled while waiting; returning True ends the wait early
+    def wait(self, simulation_time, until=None):
+        self.loop.run_until_complete(self.wait_until(simulation_time, until))
+
+    async def wait_until(self, simulation_time, until):
+        if until is None:
+            await asyncio.sleep(simulation_time)
+            return
+        deadline = self.loop.time() + simulation_time
+        while not until() and self.loop.time() < deadline:
+            await asyncio.sleep(poll_interval)
+
+    ## stop all coroutines and close the event loop
+    def stop(self):
+        for o in self.object_L:
+            o.stop = True
+        for wakeup in self.wakeup_L:
+            wakeup.set()
+        self.loop.run_until_complete(asyncio.gather(*self.task_L))
+        self.loop.close()
+        log.info("All simulation coroutines finished")
+        log.flush()
+
+
+## A unit of work of PoolRuntime: a Host or Router, or one Link of a LinkLayer
+# set() is called by Interface.put whenever an input of the task gets a packet.
+class _PoolTask:
+    idle, queued, running, rerun = range(4)
+
+    ##@param step: function doing one unit of work, returning True if it found any
+    # @param wait_time: function returning seconds until timed work is due, None if there is none
+    def __init__(self, runtime, name, step, wait_time=None):
+        self.runtime = runtime
+        self.name = name
+        self.step = step
+        self.wait_time = wait_time
+        self.state = _PoolTask.idle  # changed with runtime.lock held
+        self.timer_time = None  # time.monotonic() of the pending timer, None if there is none
+
+    def set(self):
+        self.runtime.submit(self)
+
+
+## Runs the step functions of many objects on a small fixed pool of worker threads
+# Only tasks with pending input are queued. Each worker serves its own queue in FIFO order and steals from the
+# back of another worker's queue when its own is empty. A task readied by a worker goes to that worker's queue,
+# so packets tend to follow their path on one worker. A task is never stepped by two workers at once, and is
+# queued again as long as its steps find work. Links of a LinkLayer are tasks of their own, stepped by
+# Link.tx_pkt, so a packet on one link does not make a worker sweep them all.
+class PoolRuntime:
+
+    ##@param workers: number of worker threads
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.object_L = []
+        self.task_L = []
+        self.thread_L = []
+        self.queue_L = [collections.deque() for _ in range(workers)]  # ready tasks of every worker
+        self.lock = threading.Lock()  # guards the task states, the queues and the timers
+        self.work_ready = threading.Condition(self.lock)
+        self.idle_count = 0  # workers waiting for work
+        self.timer_L = []  # heap of (time.monotonic() due, sequence number, task) of timed work
+        self.timer_seq = itertools.count()
+        self.next_queue = itertools.count()  # round robin queue for tasks readied outside the workers
+        self.local = threading.local()  # queue index of the current worker thread
+        self.stopping = False
+        self.step_count = 0  # steps run, approximate as workers update it without the lock
+        self.steal_count = 0  # tasks taken from another worker's queue
+
+    ## create a task for every Host and Router and every Link of a LinkLayer, and start the workers
+    def start(self, object_L):
+        self.object_L = list(object_L)
+        for o in self.object_L:
+            if hasattr(o, 'link_L'):
+                for link in o.link_L:
+                    task = _PoolTask(self, str(link), functools.partial(link.tx_pkt, o.batch_size),
+                                     link.wait_time if link.shaped else None)
+                    link.in_intf.ready = task
+                    self.task_L.append(task)
+            else:
+                task = _PoolTask(self, str(o), o.step, getattr(o, 'wait_time', None))
+                o.set_wakeup(task)
+                self.task_L.append(task)
+        for task in self.task_L:
+            self.submit(task)  # step every task once, as the objects' run() would
+        self.thread_L = [threading.Thread(name='Worker-%d' % n, target=self.run, args=(n,))
+                         for n in range(self.workers)]
+        for t in self.thread_L:
+            t.start()
+
+    ## queue a task readied by a put, unless it is queued already; a running task is queued again once its step ends
+    def submit(self, task):
+        with self.lock:
+            if task.state == _PoolTask.idle:
+                task.state = _PoolTask.queued
+                n = getattr(self.local, 'n', None)
+                if n is None:
+                    n = next(self.next_queue) % self.workers
+                self.queue_L[n].append(task)
+                if self.idle_count:
+                    self.work_ready.notify()
+            elif task.state == _PoolTask.running:
+                task.state = _PoolTask.rerun
+
+    ## @return the next task for worker n, marked running, from its own queue, a due timer or another worker's queue, None to stop
+    def next_task(self, n):
+        own_Q = self.queue_L[n]
+        with self.lock:
+            while not self.stopping:
+                now = time.monotonic()
+                while self.timer_L and self.timer_L[0][0] <= now:
+                    _, _, task = heapq.heappop(self.timer_L)
+                    task.timer_time = None
+                    if task.state == _PoolTask.idle:
+                        task.state = _PoolTask.queued
+                        own_Q.append(task)
+                task = None
+                if own_Q:
+                    task = own_Q.popleft()
+                else:
+                    for i in range(1, self.workers):
+                        victim_Q = self.queue_L[(n + i) % self.workers]
+                        if victim_Q:
+                            self.steal_count += 1
+                            task = victim_Q.pop()
+                            break
+                if task is not None:
+                    task.state = _PoolTask.running
+                    return task
+                self.idle_count += 1
+                self.work_ready.wait(min(idle_timeout, self.timer_L[0][0] - now) if self.timer_L else idle_timeout)
+                self.idle_count -= 1
+        return None
+
+    ## worker thread target, steps ready tasks until stopped
+    def run(self, n):
+        self.local.n = n
+        log.info('Worker-%d: Starting', n)
+        while True:
+            task = self.next_task(n)
+            if task is None:
+                break
+            busy = task.step()
+            self.step_count += 1
+            wait = None if busy or task.wait_time is None else task.wait_time()
+            with self.lock:
+                if busy or task.state == _PoolTask.rerun or wait == 0:
+                    task.state = _PoolTask.queued
+                    self.queue_L[n].append(task)
+                    continue
+                task.state = _PoolTask.idle
+                # an idle task with timed work (wait_time(), as of shaped links) is queued when the wait is over
+                if wait is not None:
+                    due = time.monotonic() + wait
+                    if task.timer_time is None or due < task.timer_time:
+                        task.timer_time = due
+                        heapq.heappush(self.timer_L, (due, next(self.timer_seq), task))
+                        self.work_ready.notify()  # so a waiting worker wakes up for the new timer
+        log.info('Worker-%d: Ending', n)
+
+    ## give the network simulation_time seconds to transfer all packets
+    # @param until: callable polled while waiting; returning True ends the wait early
+    def wait(self, simulation_time, until=None):
+        wait_wall_clock(simulation_time, until)
+
+    ## stop and join the workers
+    def stop(self):
+        for o in self.object_L:
+            o.stop = True
+        with self.lock:
+            self.stopping = True
+            self.work_ready.notify_all()
+        for t in self.thread_L:
+            t.join()
+        log.info("All workers joined after %d steps, %d stolen", self.step_count, self.steal_count)
+        log.flush()
+
+
+## runtimes by name, as selected by the simulation scripts
+runtime_D = {'threads': ThreadRuntime, 'events': EventRuntime, 'asyncio': AsyncRuntime, 'pool': PoolRuntime}
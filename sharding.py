@@ -0,0 +1,328 @@
+'''
+Multi-process simulation of a Topology.
+
+The nodes are partitioned across worker processes so that few links cross partitions. Links within a
+partition are ordinary Links; a link that crosses partitions becomes a SharedInterface, a single
+producer/single consumer ring buffer in shared memory that the sending partition's Link puts into and the
+receiving node reads as its in interface.
+'''
+
+import multiprocessing
+import queue
+import struct
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import link_3 as link
+
+
+## Interface whose queue is a ring buffer in shared memory, for links between processes
+# Exactly one process puts and one process gets: the producer only writes the tail index and the slots,
+# the consumer only writes the head index, so no lock is needed.
+class SharedInterface:
+    index_struct = struct.Struct('q')  # head at offset 0, tail at offset 8
+    slot_struct = struct.Struct('IB')  # packet length, 0 for a text (str) or 1 for a binary packet
+    data_offset = 16
+
+    ##@param name: name of the shared memory block, None to create a new one
+    # @param capacity: number of packets the ring holds
+    # @param slot_size: largest encoded packet in bytes, usually the link mtu
+    def __init__(self, name=None, capacity=1024, slot_size=64):
+        self.capacity = capacity
+        self.slot_size = slot_size + self.slot_struct.size
+        size = self.data_offset + capacity * self.slot_size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        if name is None:
+            self.buf[:self.data_offset] = bytes(self.data_offset)
+        self.mtu = None
+        self.link = None  # Link transmitting from this interface in this process
+        self.ready = None  # readiness notification of a consumer in this process, set on every put here
+        self.capture = None  # capture.Capture recording the packets enqueued in this process
+        self.drop_count = 0  # packets refused because the ring was full
+
+    def _head(self):
+        return self.index_struct.unpack_from(self.buf, 0)[0]
+
+    def _tail(self):
+        return self.index_struct.unpack_from(self.buf, 8)[0]
+
+    ## @return number of packets in the ring
+    def qsize(self):
+        return self._tail() - self._head()
+
+    ## number of packets enqueued
+    @property
+    def put_count(self):
+        return self._tail()
+
+    ## number of packets dequeued
+    @property
+    def get_count(self):
+        return self._head()
+
+    ## get packet from the ring
+    # @param block - if True, poll for a packet to arrive, if False return None right away when empty
+    # @param timeout - when blocking, give up and return None after timeout seconds
+    def get(self, block=False, timeout=None):
+        pkt_L = self.get_many(1)
+        if pkt_L or not block:
+            return pkt_L[0] if pkt_L else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.0001)
+            pkt_L = self.get_many(1)
+            if pkt_L:
+                return pkt_L[0]
+        return None
+
+    ## get up to max_count packets from the ring
+    def get_many(self, max_count):
+        head = self._head()
+        count = min(max_count, self._tail() - head)
+        pkt_L = []
+        for i in range(head, head + count):
+            offset = self.data_offset + (i % self.capacity) * self.slot_size
+            length, kind = self.slot_struct.unpack_from(self.buf, offset)
+            start = offset + self.slot_struct.size
+            pkt_B = bytes(self.buf[start:start + length])
+            pkt_L.append(pkt_B if kind else pkt_B.decode())
+        if count:
+            # publish the new head only after the slots have been read
+            self.index_struct.pack_into(self.buf, 0, head + count)
+        return pkt_L
+
+    ## put the packet into the ring
+    # @param block - if True, poll until there is room in the ring, if False may throw queue.Full exception
+    def put(self, pkt, block=False):
+        while not self.put_many([pkt], partial=True):
+            if not block:
+                raise queue.Full
+            self.drop_count -= 1  # retried, not lost
+            time.sleep(0.0001)
+
+    ## put a batch of packets into the ring
+    # @param partial - if False, throw queue.Full without enqueueing any packet if the batch does not fit,
+    #   if True enqueue as many leading packets as fit
+    # @return number of packets enqueued
+    def put_many(self, pkt_L, partial=False):
+        tail = self._tail()
+        count = min(len(pkt_L), self.capacity - (tail - self._head()))
+        if count < len(pkt_L) and not partial:
+            self.drop_count += len(pkt_L)
+            raise queue.Full
+        self.drop_count += len(pkt_L) - count
+        for i in range(count):
+            pkt = pkt_L[i]
+            kind = not isinstance(pkt, str)
+            pkt_B = pkt if kind else pkt.encode()
+            if len(pkt_B) + self.slot_struct.size > self.slot_size:
+                raise ValueError('packet of %d bytes does not fit a ring slot' % len(pkt_B))
+            offset = self.data_offset + ((tail + i) % self.capacity) * self.slot_size
+            self.slot_struct.pack_into(self.buf, offset, len(pkt_B), kind)
+            start = offset + self.slot_struct.size
+            self.buf[start:start + len(pkt_B)] = pkt_B
+        if count:
+            # publish the new tail only after the slots have been written
+            self.index_struct.pack_into(self.buf, 8, tail + count)
+            if self.capture is not None:
+                self.capture.write_many(pkt_L[:count])
+            if self.ready is not None:
+                self.ready.set()
+        return count
+
+    ## detach from the shared memory, and free it if unlink
+    def close(self, unlink=False):
+        self.buf.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+## Stands in for a node of another partition as the 'to' end of a Link
+class RemoteNode:
+
+    def __init__(self, key):
+        self.key = key
+        self.in_intf_L = {}  # in interface num -> SharedInterface
+
+    def __str__(self):
+        return self.key
+
+
+## split the nodes of a topology into part_count balanced partitions with few links between them
+# Partitions are grown one at a time by breadth first search from a node far from the previous partition,
+# then boundary nodes are moved to the neighbouring partition they share most links with while that cuts
+# links and keeps the partitions within 10% of the average size.
+# @return dict of node key -> partition number
+def partition(topology, part_count, passes=4):
+    neighbor_D = {key: {} for key in topology.node_keys()}  # node key -> {neighbor key: link count}
+    for from_key, _, to_key, _, _ in topology.link_L:
+        neighbor_D[from_key][to_key] = neighbor_D[from_key].get(to_key, 0) + 1
+        neighbor_D[to_key][from_key] = neighbor_D[to_key].get(from_key, 0) + 1
+    node_count = len(neighbor_D)
+    part_D = {}
+    seed = min(neighbor_D, key=lambda key: len(neighbor_D[key]))
+    for part in range(part_count):
+        target = (node_count * (part + 1)) // part_count - len(part_D)
+        frontier = deque([seed])
+        size = 0
+        while size < target:
+            if not frontier:
+                # disconnected topology, continue from any unassigned node
+                frontier.append(next(key for key in neighbor_D if key not in part_D))
+            key = frontier.popleft()
+            if key in part_D:
+                continue
+            part_D[key] = part
+            size += 1
+            frontier.extend(n for n in neighbor_D[key] if n not in part_D)
+        # next partition starts from the frontier, which is adjacent to this one, or any unassigned node
+        seed = next((key for key in frontier if key not in part_D), None) or \
+            next((key for key in neighbor_D if key not in part_D), None)
+    # refinement
+    size_L = [0] * part_count
+    for part in part_D.values():
+        size_L[part] += 1
+    max_size = int(1.1 * node_count / part_count) + 1
+    min_size = max(1, int(0.9 * node_count / part_count))
+    for _ in range(passes):
+        moved = False
+        for key, neighbors in neighbor_D.items():
+            part = part_D[key]
+            link_D = {}  # partition -> links between key and that partition
+            for n, count in neighbors.items():
+                link_D[part_D[n]] = link_D.get(part_D[n], 0) + count
+            best = max(link_D, key=link_D.get, default=part)
+            if best != part and link_D[best] > link_D.get(part, 0) \
+                    and size_L[best] < max_size and size_L[part] > min_size:
+                part_D[key] = best
+                size_L[part] -= 1
+                size_L[best] += 1
+                moved = True
+        if not moved:
+            break
+    return part_D
+
+
+## Marks an object runnable in its partition's loop, set() is called by Interface.put
+class _ReadyFlag:
+
+    def __init__(self, ready_Q, object):
+        self.ready_Q = ready_Q
+        self.object = object
+        self.queued = False
+
+    def set(self):
+        if not self.queued:
+            self.queued = True
+            self.ready_Q.append(self)
+
+
+## worker process target: build one partition and step its objects until stop_event is set
+def _run_partition(topology, part, part_D, ring_D, send_L, stop_event, rcv_count, poll_interval):
+    local_keys = [key for key in topology.node_keys() if part_D[key] == part]
+    node_D, link_layer = topology.build(local_keys)
+    remote_D = {}
+    shared_in_L = []  # rings this partition consumes, polled since puts from other processes are not signalled
+    for link_id, (from_key, from_intf_num, to_key, to_intf_num, mtu) in enumerate(topology.link_L):
+        if link_id not in ring_D:
+            continue
+        ring = ring_D[link_id]
+        ring.mtu = mtu
+        if from_key in node_D:
+            # the sending side keeps a Link, so its mtu checks still apply
+            remote = remote_D.setdefault(to_key, RemoteNode(to_key))
+            remote.in_intf_L[to_intf_num] = ring
+            link_layer.add_link(link.Link(node_D[from_key], from_intf_num, remote, to_intf_num, mtu))
+        elif to_key in node_D:
+            node_D[to_key].in_intf_L[to_intf_num] = ring
+            shared_in_L.append(ring)
+    ready_Q = deque()
+    object_L = list(node_D.values()) + [link_layer]
+    for o in object_L:
+        flag = _ReadyFlag(ready_Q, o)
+        o.set_wakeup(flag)
+        flag.set()
+    host_L = [o for o in node_D.values() if hasattr(o, 'udt_send')]
+    host_D = {o.addr: o for o in host_L}
+    for src_addr, dst_addr, data_S in send_L:
+        if src_addr in host_D:
+            host_D[src_addr].udt_send(dst_addr, data_S)
+    report_time = 0
+    while not stop_event.is_set():
+        # step every object that was ready at the start of the round
+        for _ in range(len(ready_Q)):
+            flag = ready_Q.popleft()
+            flag.queued = False
+            if flag.object.step():
+                flag.set()
+        for ring in shared_in_L:
+            if ring.qsize():
+                ring.ready.set()
+        if time.monotonic() >= report_time:
+            rcv_count.value = sum(h.rcv_pkt_count for h in host_L)
+            report_time = time.monotonic() + 0.001
+        if not ready_Q:
+            time.sleep(poll_interval)
+    for ring in ring_D.values():
+        ring.close()
+
+
+## Runs a Topology partitioned across worker processes
+class ShardedRuntime:
+
+    ##@param topology: Topology to simulate
+    # @param part_count: number of worker processes
+    # @param ring_capacity: packets held by the ring buffer of a link between partitions, a Link drops packets
+    #   when its ring is full just as when a bounded Interface queue is full
+    # @param poll_interval: seconds an idle worker sleeps before polling its rings again
+    def __init__(self, topology, part_count, ring_capacity=65536, poll_interval=0.0002):
+        self.topology = topology
+        self.part_count = part_count
+        self.part_D = partition(topology, part_count)
+        self.ring_D = {}  # link index -> SharedInterface of links between partitions
+        for link_id, (from_key, _, to_key, _, mtu) in enumerate(topology.link_L):
+            if self.part_D[from_key] != self.part_D[to_key]:
+                self.ring_D[link_id] = SharedInterface(capacity=ring_capacity, slot_size=mtu)
+        self.poll_interval = poll_interval
+        self.ctx = multiprocessing.get_context('fork')
+        self.stop_event = self.ctx.Event()
+        self.rcv_count_L = []
+        self.proc_L = []
+
+    ## start the worker processes
+    # @param send_L: list of (src_addr, dst_addr, data_S) that the source hosts send once started
+    def start(self, send_L=()):
+        for part in range(self.part_count):
+            rcv_count = self.ctx.Value('q', 0, lock=False)
+            proc = self.ctx.Process(target=_run_partition, args=(
+                self.topology, part, self.part_D, self.ring_D, list(send_L), self.stop_event, rcv_count,
+                self.poll_interval))
+            proc.start()
+            self.rcv_count_L.append(rcv_count)
+            self.proc_L.append(proc)
+
+    ## @return number of packets reassembled by all hosts, as last reported by the workers
+    def received(self):
+        return sum(rcv_count.value for rcv_count in self.rcv_count_L)
+
+    ## wait for simulation_time seconds, or until expected packets have been received
+    def wait(self, simulation_time, expected=None):
+        deadline = time.monotonic() + simulation_time
+        while time.monotonic() < deadline and (expected is None or self.received() < expected):
+            time.sleep(0.001)
+
+    ## stop the workers and free the rings
+    def stop(self):
+        self.stop_event.set()
+        for proc in self.proc_L:
+            proc.join()
+        for ring in self.ring_D.values():
+            ring.close(unlink=True)
+
+    ## @return number of links between partitions
+    def cut_count(self):
+        return len(self.ring_D)
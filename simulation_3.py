@@ -6,72 +6,114 @@ Created on Oct 12, 2016
 
 import network_3 as network
 import link_3 as link
-import threading
-from time import sleep
-from rprint import print
+import runtimes
+import log
+import quiescence
+import replay
+import telemetry
 
 ## configuration parameters
 router_queue_size = 0  # 0 means unlimited
 simulation_time = 5  # give the network sufficient time to transfer all packets before quitting
+stop_when_quiescent = True  # end as soon as every packet is delivered or dropped, simulation_time is then an upper bound
+wire_format = 'text'  # packet encoding used by the hosts, 'text' or 'binary'
+batch_size = 1  # max packets routers and the link layer move per interface in one pass
+path_mtu_discovery = False  # size the packets of hosts by the smallest MTU on the path instead of the first hop
+link_bandwidth = None  # bytes/s every link carries, None for no limit
+link_delay = None  # seconds every packet takes to cross a link, None for none
+link_workers = 0  # transmit threads of the link layer, 0 to sweep all links from one thread
+interface_class = network.Interface  # network.Interface (locked deque) or network.RingInterface (lock-free ring)
+log_level = log.TRACE  # log.TRACE traces every packet, log.INFO only thread start and end, log.WARN only drops
+log_json = False  # write log records as JSON lines
+runtime = 'threads'  # 'threads' (thread per object), 'events' (discrete event engine), 'asyncio' (one event loop)
+                     # or 'pool' (pool_workers threads stepping the objects with pending input)
+pool_workers = 4  # worker threads of the 'pool' runtime
+telemetry_format = None  # print the counters after the simulation: None, 'dict' or 'prometheus'
+trace_path = None  # replay this traffic trace (see replay.py) instead of the send events below
+trace_speed = 1.0  # replay speed relative to the recorded times
 
-if __name__ == '__main__':
+
+## create the hosts, routers and links of the simulated topology
+# @return host_L, router_L, link_layer
+def build_network():
+    network.interface_class = interface_class  # class of the interfaces the nodes below create
     # routing tables that allow querying by destination address as the key, which stores router's out interface value
     routing_table_A = {3: 0, 4: 1}
     routing_table_B = {3: 0}
     routing_table_C = {4: 0}
     routing_table_D = {3: 0, 4: 1}
 
-    object_L = []  # keeps track of objects, so we can kill their threads
-
     # create network nodes
-    client_1 = network.Host(1)
-    object_L.append(client_1)
-    client_2 = network.Host(2)
-    object_L.append(client_2)
-    server_1 = network.Host(3)
-    object_L.append(server_1)
-    server_2 = network.Host(4)
-    object_L.append(server_2)
+    client_1 = network.Host(1, wire_format)
+    client_2 = network.Host(2, wire_format)
+    server_1 = network.Host(3, wire_format)
+    server_2 = network.Host(4, wire_format)
     router_a = network.Router(name='A', intf_count=2, max_queue_size=router_queue_size, routing_table=routing_table_A)
-    object_L.append(router_a)
     router_b = network.Router(name='B', intf_count=1, max_queue_size=router_queue_size, routing_table=routing_table_B)
-    object_L.append(router_b)
     router_c = network.Router(name='C', intf_count=1, max_queue_size=router_queue_size, routing_table=routing_table_C)
-    object_L.append(router_c)
     router_d = network.Router(name='D', intf_count=2, max_queue_size=router_queue_size, routing_table=routing_table_D)
-    object_L.append(router_d)
 
     # create a Link Layer to keep track of links between network nodes
-    link_layer = link.LinkLayer()
-    object_L.append(link_layer)
+    link_layer = link.LinkLayer(link_workers)
 
     # add all the links
-    # link parameters: from_node, from_intf_num, to_node, to_intf_num, mtu
-    link_layer.add_link(link.Link(client_1, 0, router_a, 0, 50))
-    link_layer.add_link(link.Link(client_2, 0, router_a, 1, 50))
-    link_layer.add_link(link.Link(router_a, 0, router_b, 0, 30))
-    link_layer.add_link(link.Link(router_a, 1, router_c, 0, 30))
-    link_layer.add_link(link.Link(router_b, 0, router_d, 0, 30))
-    link_layer.add_link(link.Link(router_c, 0, router_d, 1, 30))
-    link_layer.add_link(link.Link(router_d, 0, server_1, 0, 30))
-    link_layer.add_link(link.Link(router_d, 1, server_2, 0, 30))
+    # link parameters: from_node, from_intf_num, to_node, to_intf_num, mtu, bandwidth, delay
+    link_layer.add_link(link.Link(client_1, 0, router_a, 0, 50, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(client_2, 0, router_a, 1, 50, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_a, 0, router_b, 0, 30, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_a, 1, router_c, 0, 30, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_b, 0, router_d, 0, 30, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_c, 0, router_d, 1, 30, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_d, 0, server_1, 0, 30, link_bandwidth, link_delay))
+    link_layer.add_link(link.Link(router_d, 1, server_2, 0, 30, link_bandwidth, link_delay))
+
+    for o in [router_a, router_b, router_c, router_d, link_layer]:
+        o.batch_size = batch_size
+    for o in [client_1, client_2, server_1, server_2]:
+        o.path_mtu_discovery = path_mtu_discovery
+
+    return [client_1, client_2, server_1, server_2], [router_a, router_b, router_c, router_d], link_layer
+
+
+if __name__ == '__main__':
+    log.level = log_level
+    log.json_output = log_json
+    host_L, router_L, link_layer = build_network()
+    client_1, client_2 = host_L[0], host_L[1]
+    object_L = host_L + router_L + [link_layer]  # keeps track of objects, so we can stop them
 
     # start all the objects
-    thread_L = [threading.Thread(name=object.__str__(), target=object.run) for object in object_L]
-    for t in thread_L:
-        t.start()
+    sim = runtimes.PoolRuntime(pool_workers) if runtime == 'pool' else runtimes.runtime_D[runtime]()
+    sim.start(object_L)
+    sampler = telemetry.QueueSampler(object_L)
+    if telemetry_format is not None:
+        sampler.start()
 
     # create some send events
-    client_1.udt_send(3, "STARTC1-ABCDEFGHIJKLMNOPQRSTUVWXYZ-0123456789-ABCDEFGHIJKLMNOPQRSTUVWXYZ-ENDC1")
-    client_2.udt_send(4, "STARTC2-ABCDEFGHIJKLMNOPQRSTUVWXYZ-0123456789-ABCDEFGHIJKLMNOPQRSTUVWXYZ-ENDC2")
+    source_L = []  # traffic sources the quiescence detector waits for
+    if trace_path is not None:
+        replayer = replay.Replay(trace_path, host_L, trace_speed)
+        source_L.append(replayer)
+        if isinstance(sim, runtimes.EventRuntime):
+            replayer.schedule(sim)
+        else:
+            replayer.start()
+    else:
+        client_1.udt_send(3, "STARTC1-ABCDEFGHIJKLMNOPQRSTUVWXYZ-0123456789-ABCDEFGHIJKLMNOPQRSTUVWXYZ-ENDC1")
+        client_2.udt_send(4, "STARTC2-ABCDEFGHIJKLMNOPQRSTUVWXYZ-0123456789-ABCDEFGHIJKLMNOPQRSTUVWXYZ-ENDC2")
 
     # give the network sufficient time to transfer all packets before quitting
-    sleep(simulation_time)
+    if stop_when_quiescent:
+        sim.wait(simulation_time, quiescence.QuiescenceDetector(object_L, source_L).idle)
+    else:
+        sim.wait(simulation_time)
 
-    # join all threads
-    for o in object_L:
-        o.stop = True
-    for t in thread_L:
-        t.join()
+    # stop all the objects
+    if trace_path is not None:
+        replayer.join(stop=True)
+    sim.stop()
 
-    print("All simulation threads joined")
+    if telemetry_format is not None:
+        sampler.stop()
+        snap_D = telemetry.snapshot(object_L, sampler)
+        print(snap_D if telemetry_format == 'dict' else telemetry.to_prometheus(snap_D))
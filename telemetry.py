@@ -0,0 +1,123 @@
+'''
+Counters and queue-depth telemetry for the network_3 / link_3 objects of a simulation.
+
+snapshot() collects the counters every Host, Router, Link and Interface keeps into a plain dict,
+to_prometheus() renders such a snapshot in the Prometheus text exposition format, and
+QueueSampler tracks the depth of every interface queue over time from a background thread.
+'''
+
+import threading
+import time
+
+## counters read off each kind of object
+host_counter_L = ['snd_pkt_count', 'rcv_frag_count', 'rcv_pkt_count']
+router_counter_L = ['rcv_pkt_count', 'fwd_pkt_count', 'frag_pkt_count', 'frag_count',
+                    'drop_pkt_count', 'no_route_count', 'mtu_drop_count']
+link_counter_L = ['tx_pkt_count', 'mtu_drop_count', 'drop_pkt_count']
+interface_counter_L = ['put_count', 'drop_count']
+
+
+## @return list of the links of the link layers in object_L
+def links_of(object_L):
+    return [l for o in object_L for l in getattr(o, 'link_L', [])]
+
+
+## @return dict of interface name -> interface for every node in object_L
+def interfaces_of(object_L):
+    intf_D = {}
+    for o in object_L:
+        for direction, intf_L in (('in', getattr(o, 'in_intf_L', [])), ('out', getattr(o, 'out_intf_L', []))):
+            for i, intf in enumerate(intf_L):
+                intf_D['%s-%s-%d' % (o, direction, i)] = intf
+    return intf_D
+
+
+## @return dict with the counters of every object in object_L, grouped by kind and keyed by name
+# @param object_L: Hosts, Routers and LinkLayers of a simulation
+# @param sampler: optional QueueSampler whose depth statistics are added to the interfaces
+def snapshot(object_L, sampler=None):
+    def counters(o, counter_L):
+        return {c: getattr(o, c, 0) for c in counter_L}
+    snap_D = {'time': time.time(), 'hosts': {}, 'routers': {}, 'links': {}, 'interfaces': {}}
+    for o in object_L:
+        if hasattr(o, 'forward'):
+            snap_D['routers'][str(o)] = counters(o, router_counter_L)
+            for reason, count in o.queue_drop_counts().items():
+                snap_D['routers'][str(o)]['queue_drop_%s_count' % reason] = count
+        elif hasattr(o, 'udt_send'):
+            snap_D['hosts'][str(o)] = counters(o, host_counter_L)
+    for l in links_of(object_L):
+        snap_D['links'][str(l)] = counters(l, link_counter_L)
+    for name, intf in interfaces_of(object_L).items():
+        intf_D = counters(intf, interface_counter_L)
+        intf_D['depth'] = intf.qsize()
+        for reason, count in getattr(intf, 'drop_D', {}).items():
+            intf_D['drop_%s_count' % reason] = count  # queue discipline drops by reason
+        if sampler is not None and name in sampler.max_depth_D:
+            intf_D['max_depth'] = sampler.max_depth_D[name]
+            intf_D['mean_depth'] = sampler.mean_depth(name)
+        snap_D['interfaces'][name] = intf_D
+    return snap_D
+
+
+## @return snapshot rendered in the Prometheus text exposition format
+# @param prefix: prepended to every metric name
+def to_prometheus(snap_D, prefix='sim'):
+    line_L = []
+    for kind, label in (('hosts', 'host'), ('routers', 'router'), ('links', 'link'), ('interfaces', 'interface')):
+        metric_D = {}  # metric name -> list of (object name, value)
+        for name, value_D in snap_D[kind].items():
+            for counter, value in value_D.items():
+                metric_D.setdefault(counter, []).append((name, value))
+        for counter, sample_L in metric_D.items():
+            gauge = counter.endswith('depth')
+            metric = '%s_%s_%s%s' % (prefix, label, counter[:-len('_count')] if counter.endswith('_count') else counter,
+                                     '' if gauge else '_total')
+            line_L.append('# TYPE %s %s' % (metric, 'gauge' if gauge else 'counter'))
+            for name, value in sample_L:
+                line_L.append('%s{%s="%s"} %s' % (metric, label, name.replace('\\', '\\\\').replace('"', '\\"'), value))
+    return '\n'.join(line_L) + '\n'
+
+
+## Samples the depth of every interface queue at a fixed interval
+class QueueSampler:
+
+    ## @param object_L: Hosts and Routers whose interfaces are sampled
+    # @param interval: seconds between samples
+    def __init__(self, object_L, interval=0.01):
+        self.intf_D = interfaces_of(object_L)
+        self.interval = interval
+        self.sample_count = 0
+        self.max_depth_D = {name: 0 for name in self.intf_D}
+        self.sum_depth_D = {name: 0 for name in self.intf_D}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    ## record the current depth of every interface
+    def sample(self):
+        for name, intf in self.intf_D.items():
+            depth = intf.qsize()
+            self.sum_depth_D[name] += depth
+            if depth > self.max_depth_D[name]:
+                self.max_depth_D[name] = depth
+        self.sample_count += 1
+
+    ## @return mean sampled depth of the named interface
+    def mean_depth(self, name):
+        return self.sum_depth_D[name] / self.sample_count if self.sample_count else 0.0
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(name='QueueSampler', target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sample()
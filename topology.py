@@ -0,0 +1,297 @@
+'''
+Picklable description of a network topology, from which the Host, Router and Link objects are built.
+
+Topologies are described in code, loaded from JSON or YAML files (load), or generated (random_topology,
+fat_tree_topology, grid_topology) with shortest path routing tables computed by Topology.compute_routes.
+'''
+
+import json
+import random
+import re
+
+import network_3 as network
+import link_3 as link
+import routing
+
+
+## Description of hosts, routers and links that can build the network objects, in one process or split
+# across several
+class Topology:
+
+    def __init__(self):
+        self.host_D = {}  # node key -> (addr, wire_format)
+        self.router_D = {}  # node key -> (name, intf_count, max_queue_size, routing_table)
+        self.link_L = []  # (from_key, from_intf_num, to_key, to_intf_num, mtu)
+
+    ## add a host
+    # @return node key of the host, the same as str() of the built Host
+    def add_host(self, addr, wire_format='text'):
+        key = 'Host_%s' % addr
+        self.host_D[key] = (addr, wire_format)
+        return key
+
+    ## add a router, parameters as for network_3.Router
+    # @return node key of the router, the same as str() of the built Router
+    def add_router(self, name, intf_count, routing_table, max_queue_size=0):
+        key = 'Router_%s' % name
+        self.router_D[key] = (name, intf_count, max_queue_size, routing_table)
+        return key
+
+    ## add a link from an out interface of one node to an in interface of another
+    def add_link(self, from_key, from_intf_num, to_key, to_intf_num, mtu):
+        self.link_L.append((from_key, from_intf_num, to_key, to_intf_num, mtu))
+
+    ## add links in both directions between interface from_intf_num of one node and to_intf_num of another
+    def add_duplex_link(self, from_key, from_intf_num, to_key, to_intf_num, mtu):
+        self.add_link(from_key, from_intf_num, to_key, to_intf_num, mtu)
+        self.add_link(to_key, to_intf_num, from_key, from_intf_num, mtu)
+
+    ## replace the routing tables of routers by shortest path (fewest hops) routes to every host
+    # All destinations are searched at once by a breadth first search over the routers, in which every router keeps
+    # the set of destination routers it has reached as the bits of an int, so one pass over the links extends the
+    # search towards all destinations. Hosts behind the same router share its destination bit, and consecutive
+    # host addresses sharing an out interface become one address range. Ties between equally short paths go to
+    # the lowest out interface number.
+    # @param router_keys: routers whose routing tables are replaced, all of them by default
+    def compute_routes(self, router_keys=None):
+        router_L = list(self.router_D)
+        index_D = {key: i for i, key in enumerate(router_L)}
+        out_L = [[] for _ in router_L]  # per router: (out interface, neighbor router index)
+        deliver_L = [[] for _ in router_L]  # per router: (host address, out interface) of the hosts it reaches directly
+        for from_key, from_intf_num, to_key, to_intf_num, mtu in self.link_L:
+            if from_key in index_D:
+                if to_key in index_D:
+                    out_L[index_D[from_key]].append((from_intf_num, index_D[to_key]))
+                elif to_key in self.host_D:
+                    deliver_L[index_D[from_key]].append((self.host_D[to_key][0], from_intf_num))
+        for neighbor_L in out_L:
+            neighbor_L.sort()  # of equally short paths, take the one through the lowest interface number
+
+        # destination routers in the order of their host addresses, so that runs of destination bits are
+        # runs of addresses
+        dst_L = sorted((i for i in range(len(router_L)) if deliver_L[i]), key=lambda i: min(deliver_L[i]))
+        range_L_L = [_address_ranges(sorted(addr for addr, _ in deliver_L[i])) for i in dst_L]
+        # last destination index j' >= j such that destinations j..j' cover one contiguous address range
+        contiguous_L = list(range(len(dst_L)))
+        for j in range(len(dst_L) - 2, -1, -1):
+            if len(range_L_L[j]) == 1 and len(range_L_L[j + 1]) == 1 and range_L_L[j][0][1] + 1 == range_L_L[j + 1][0][0]:
+                contiguous_L[j] = contiguous_L[j + 1]
+
+        reached_L = [0] * len(router_L)  # per router: bits of the destinations with a known route
+        for j, i in enumerate(dst_L):
+            reached_L[i] |= 1 << j
+        frontier_L = list(reached_L)  # per router: bits of the destinations reached in the last round
+        hop_D_L = [{} for _ in router_L]  # per router: out interface -> bits of the destinations routed through it
+        while any(frontier_L):
+            next_L = [0] * len(router_L)
+            for i, neighbor_L in enumerate(out_L):
+                reached = reached_L[i]
+                for out_intf, n in neighbor_L:
+                    new = frontier_L[n]
+                    if new:
+                        new &= ~reached
+                        if new:
+                            hop_D_L[i][out_intf] = hop_D_L[i].get(out_intf, 0) | new
+                            reached |= new
+                next_L[i] = reached ^ reached_L[i]
+                reached_L[i] = reached
+            frontier_L = next_L
+
+        for key in (self.router_D if router_keys is None else router_keys):
+            i = index_D[key]
+            route_L = [(addr, addr, out_intf) for addr, out_intf in deliver_L[i]]
+            for out_intf, bits in hop_D_L[i].items():
+                for first, last in _bit_runs(bits):
+                    while first <= last:
+                        end = min(last, contiguous_L[first])
+                        if end > first:
+                            route_L.append((range_L_L[first][0][0], range_L_L[end][0][1], out_intf))
+                        else:
+                            route_L.extend((low, high, out_intf) for low, high in range_L_L[first])
+                        first = end + 1
+            table = routing.RoutingTable()
+            for low, high, out_intf in _merge_ranges(route_L):
+                table.add_range(low, high, out_intf)
+            name, intf_count, max_queue_size, _ = self.router_D[key]
+            self.router_D[key] = (name, intf_count, max_queue_size, table)
+
+    ## @return keys of all hosts and routers
+    def node_keys(self):
+        return list(self.host_D) + list(self.router_D)
+
+    ## create the network objects
+    # @param node_keys: nodes to create, all of them by default; only links between created nodes are added
+    # @return dict of node key -> Host or Router, and the LinkLayer
+    def build(self, node_keys=None):
+        if node_keys is None:
+            node_keys = self.node_keys()
+        node_D = {}
+        for key in node_keys:
+            if key in self.host_D:
+                addr, wire_format = self.host_D[key]
+                node_D[key] = network.Host(addr, wire_format)
+            else:
+                name, intf_count, max_queue_size, routing_table = self.router_D[key]
+                node_D[key] = network.Router(name=name, intf_count=intf_count, max_queue_size=max_queue_size,
+                                             routing_table=routing_table)
+        link_layer = link.LinkLayer()
+        for from_key, from_intf_num, to_key, to_intf_num, mtu in self.link_L:
+            if from_key in node_D and to_key in node_D:
+                link_layer.add_link(link.Link(node_D[from_key], from_intf_num, node_D[to_key], to_intf_num, mtu))
+        return node_D, link_layer
+
+
+## @return list of (low, high) of the runs of consecutive addresses in the sorted list addr_L
+def _address_ranges(addr_L):
+    range_L = []
+    for addr in addr_L:
+        if range_L and range_L[-1][1] + 1 == addr:
+            range_L[-1][1] = addr
+        else:
+            range_L.append([addr, addr])
+    return [tuple(r) for r in range_L]
+
+
+## @return list of (first, last) of the runs of set bits in bits
+def _bit_runs(bits):
+    bit_S = format(bits, 'b')[::-1]  # lowest bit first
+    return [(m.start(), m.end() - 1) for m in re.finditer('1+', bit_S)]
+
+
+## @return the (low, high, out_intf) routes sorted by address, with adjacent ranges to the same interface joined
+def _merge_ranges(route_L):
+    merged_L = []
+    for low, high, out_intf in sorted(route_L):
+        if merged_L and merged_L[-1][2] == out_intf and merged_L[-1][1] + 1 == low:
+            merged_L[-1][1] = high
+        else:
+            merged_L.append([low, high, out_intf])
+    return merged_L
+
+
+## create a topology from a description, as read from a JSON or YAML file
+# hosts: list of {addr, wire_format (optional)} or plain addresses
+# routers: list of {name, intf_count (optional), max_queue_size (optional), routing_table (optional)};
+#   intf_count defaults to one more than the highest interface number used by the links of the router,
+#   routers without a routing_table get shortest path routes
+# links: list of {from, from_intf, to, to_intf, mtu, duplex (optional)}, naming the nodes by their keys,
+#   e.g. Host_1 or Router_A; duplex links also carry packets from to_intf back to from_intf
+def from_dict(spec_D):
+    topo = Topology()
+    for host in spec_D.get('hosts', []):
+        if isinstance(host, dict):
+            topo.add_host(host['addr'], host.get('wire_format', 'text'))
+        else:
+            topo.add_host(host)
+    link_L = spec_D.get('links', [])
+    intf_count_D = {}  # node key -> interfaces used by its links
+    for l in link_L:
+        for key, intf_num in ((l['from'], l['from_intf']), (l['to'], l['to_intf'])):
+            intf_count_D[key] = max(intf_count_D.get(key, 0), intf_num + 1)
+    unrouted_L = []
+    for router in spec_D.get('routers', []):
+        key = 'Router_%s' % router['name']
+        table = router.get('routing_table')
+        if table is None:
+            unrouted_L.append(key)
+        else:
+            table = {int(addr): out_intf for addr, out_intf in table.items()}  # JSON object keys are strings
+        topo.add_router(router['name'], router.get('intf_count', intf_count_D.get(key, 0)), table,
+                        router.get('max_queue_size', 0))
+    for l in link_L:
+        if l.get('duplex', False):
+            topo.add_duplex_link(l['from'], l['from_intf'], l['to'], l['to_intf'], l['mtu'])
+        else:
+            topo.add_link(l['from'], l['from_intf'], l['to'], l['to_intf'], l['mtu'])
+    if unrouted_L:
+        topo.compute_routes(unrouted_L)
+    return topo
+
+
+## read a topology description from a .json, .yaml or .yml file, see from_dict
+def load(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # only needed for YAML descriptions
+            return from_dict(yaml.safe_load(f))
+        return from_dict(json.load(f))
+
+
+## random connected network: a random spanning tree of the routers plus random links until the routers have
+# degree links on average, with the hosts spread over random routers
+# @param seed: seed of the random generator, the same seed gives the same topology
+def random_topology(router_count, host_count, degree=3, mtu=50, wire_format='binary', seed=None):
+    rng = random.Random(seed)
+    edge_S = set()
+    for r in range(1, router_count):
+        edge_S.add((rng.randrange(r), r))
+    edge_count = max(router_count - 1, min(router_count * degree // 2, router_count * (router_count - 1) // 2))
+    while len(edge_S) < edge_count:
+        a, b = sorted(rng.sample(range(router_count), 2))
+        edge_S.add((a, b))
+    host_count_L = [0] * router_count
+    for _ in range(host_count):
+        host_count_L[rng.randrange(router_count)] += 1
+    neighbor_L_L = [[] for _ in range(router_count)]
+    for a, b in sorted(edge_S):
+        neighbor_L_L[a].append(b)
+        neighbor_L_L[b].append(a)
+    topo = Topology()
+    key_L = [topo.add_router('R%d' % r, len(neighbor_L_L[r]) + host_count_L[r], None) for r in range(router_count)]
+    for a in range(router_count):
+        for intf, b in enumerate(neighbor_L_L[a]):
+            if a < b:
+                topo.add_duplex_link(key_L[a], intf, key_L[b], neighbor_L_L[b].index(a), mtu)
+    _attach_hosts(topo, [(key_L[r], len(neighbor_L_L[r]), host_count_L[r]) for r in range(router_count)],
+                  mtu, wire_format)
+    topo.compute_routes()
+    return topo
+
+
+## k-ary fat-tree: k pods of k/2 edge and k/2 aggregation routers, (k/2)^2 core routers and k/2 hosts per edge
+# router, k^3/4 hosts in all
+# interfaces 0..k/2-1 of edge and aggregation routers face down, k/2..k-1 up
+def fat_tree_topology(k, mtu=50, wire_format='binary'):
+    half = k // 2
+    topo = Topology()
+    core_L = [topo.add_router('C%d' % c, k, None) for c in range(half * half)]
+    edge_L = []
+    for p in range(k):
+        agg_L = [topo.add_router('A%d.%d' % (p, a), k, None) for a in range(half)]
+        for e in range(half):
+            edge = topo.add_router('E%d.%d' % (p, e), k, None)
+            edge_L.append((edge, 0, half))
+            for a, agg in enumerate(agg_L):
+                topo.add_duplex_link(edge, half + a, agg, e, mtu)
+        for a, agg in enumerate(agg_L):
+            for c in range(half):
+                topo.add_duplex_link(agg, half + c, core_L[a * half + c], p, mtu)
+    _attach_hosts(topo, edge_L, mtu, wire_format)
+    topo.compute_routes()
+    return topo
+
+
+## width x height grid of routers with hosts_per_router hosts on every router
+# interfaces 0-3 of a router face north, south, west and east, the hosts follow
+def grid_topology(width, height, hosts_per_router=1, mtu=50, wire_format='binary'):
+    topo = Topology()
+    key_D = {(x, y): topo.add_router('G%d.%d' % (x, y), 4 + hosts_per_router, None)
+             for y in range(height) for x in range(width)}
+    for (x, y), key in key_D.items():
+        if (x, y + 1) in key_D:
+            topo.add_duplex_link(key, 1, key_D[x, y + 1], 0, mtu)
+        if (x + 1, y) in key_D:
+            topo.add_duplex_link(key, 3, key_D[x + 1, y], 2, mtu)
+    _attach_hosts(topo, [(key, 4, hosts_per_router) for key in key_D.values()], mtu, wire_format)
+    topo.compute_routes()
+    return topo
+
+
+## add hosts with consecutive addresses, starting at 1
+# @param attach_L: list of (router key, first free interface number, number of hosts to attach)
+def _attach_hosts(topo, attach_L, mtu, wire_format):
+    addr = 1
+    for router, first_intf, count in attach_L:
+        for intf in range(first_intf, first_intf + count):
+            topo.add_duplex_link(topo.add_host(addr, wire_format), 0, router, intf, mtu)
+            addr += 1
@@ -0,0 +1,175 @@
+'''
+Traffic generator driving Hosts with constant bit rate, Poisson and on/off flows.
+
+A Flow sends messages of a fixed size from a Host to a destination address at the times its arrival process
+gives. TrafficGenerator runs flows in a thread on the wall clock, or as events of a runtimes.EventRuntime on its
+virtual clock. Every tick it collects the messages due on each host and hands them to Host.udt_send_many, so a
+host's messages of one tick are enqueued with one lock acquisition. All messages of the same size share one
+payload object.
+'''
+
+import itertools
+import random
+import threading
+import time
+
+
+## payload size -> payload shared by all messages of that size
+payload_D = {}
+
+
+## @return the shared payload of size bytes, as str for text hosts and bytes for binary hosts
+def payload(size, wire_format='text'):
+    key = size, wire_format
+    if key not in payload_D:
+        payload_S = ''.join(itertools.islice(itertools.cycle('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'), size))
+        payload_D[key] = payload_S.encode() if wire_format == 'binary' else payload_S
+    return payload_D[key]
+
+
+## Arrival process with a fixed gap of 1 / rate seconds between messages
+class CBR:
+
+    ##@param rate: messages per second
+    def __init__(self, rate):
+        self.rate = rate
+
+    ## @return seconds until the next message
+    def next_gap(self):
+        return 1.0 / self.rate
+
+
+## Arrival process with exponentially distributed gaps, rate messages per second on average
+class Poisson:
+
+    def __init__(self, rate, seed=None):
+        self.rate = rate
+        self.rng = random.Random(seed)
+
+    def next_gap(self):
+        return self.rng.expovariate(self.rate)
+
+
+## Bursty arrival process: rate messages per second during on periods, none during off periods, with exponentially
+# distributed period lengths of mean on_time and off_time seconds
+class OnOff:
+
+    def __init__(self, rate, on_time, off_time, seed=None):
+        self.rate = rate
+        self.on_time = on_time
+        self.off_time = off_time
+        self.rng = random.Random(seed)
+        self.on_left = self.rng.expovariate(1.0 / on_time)  # seconds left in the current on period
+
+    def next_gap(self):
+        gap = 1.0 / self.rate
+        if gap <= self.on_left:
+            self.on_left -= gap
+            return gap
+        # no more messages fit in this on period, the next one starts the next on period after an off period
+        gap = self.on_left + self.rng.expovariate(1.0 / self.off_time)
+        self.on_left = self.rng.expovariate(1.0 / self.on_time)
+        return gap
+
+
+## Messages of size bytes from a Host to a destination address, at the times of an arrival process
+class Flow:
+
+    ##@param host: sending Host
+    # @param dst_addr: destination address of the messages
+    # @param process: arrival process, e.g. CBR, Poisson or OnOff
+    # @param size: message size in bytes
+    def __init__(self, host, dst_addr, process, size):
+        self.host = host
+        self.dst_addr = dst_addr
+        self.process = process
+        self.data_S = payload(size, host.wire_format)
+        self.next_time = 0.0  # seconds since the start of the generator
+        self.sent_msg_count = 0
+
+
+## @return flows between hosts, made with make_process() for their arrival processes
+# @param host_L: sending and receiving Hosts
+# @param pattern: 'all' for a flow from every host to every other host, 'permutation' for one flow from every host to
+#   another host, each receiving from exactly one, 'random' for one flow from every host to a random other host
+def many_to_many(host_L, make_process, size, pattern='all', seed=None):
+    rng = random.Random(seed)
+    if pattern == 'all':
+        return [Flow(src, dst.addr, make_process(), size) for src in host_L for dst in host_L if dst is not src]
+    if pattern == 'permutation':
+        # a random cyclic order sends every host to its successor, so no host sends to itself
+        order_L = rng.sample(host_L, len(host_L))
+        return [Flow(src, dst.addr, make_process(), size) for src, dst in zip(order_L, order_L[1:] + order_L[:1])]
+    if pattern == 'random':
+        return [Flow(src, rng.choice([h for h in host_L if h is not src]).addr, make_process(), size)
+                for src in host_L]
+    raise ValueError('unknown traffic pattern %r' % pattern)
+
+
+## Sends the messages of flows for duration seconds, in batches of the messages due every tick seconds
+class TrafficGenerator:
+
+    ##@param flow_L: flows to generate
+    # @param duration: seconds after which no more messages are sent, None to send until stopped
+    # @param tick: seconds between batches
+    def __init__(self, flow_L, duration=None, tick=0.001):
+        self.flow_L = list(flow_L)
+        self.duration = duration
+        self.tick = tick
+        self.stop = False
+        self.sent_all = False  # set once duration has passed and the last messages were sent
+        self.thread = None
+        self.sent_msg_count = 0
+        self.sent_pkt_count = 0
+
+    ## send the messages due by elapsed seconds since the start
+    # @return False once duration has passed
+    def send_due(self, elapsed):
+        if self.duration is not None:
+            elapsed = min(elapsed, self.duration)
+        msg_L_D = {}  # host -> messages due
+        for flow in self.flow_L:
+            if flow.next_time > elapsed:
+                continue
+            msg_L = msg_L_D.setdefault(flow.host, [])
+            while flow.next_time <= elapsed:
+                msg_L.append((flow.dst_addr, flow.data_S))
+                flow.next_time += flow.process.next_gap()
+                flow.sent_msg_count += 1
+        for host, msg_L in msg_L_D.items():
+            self.sent_msg_count += len(msg_L)
+            self.sent_pkt_count += host.udt_send_many(msg_L)
+        self.sent_all = self.duration is not None and elapsed >= self.duration
+        return not self.sent_all
+
+    ## True once nothing is left to send, see quiescence.QuiescenceDetector
+    @property
+    def finished(self):
+        return self.sent_all or self.stop
+
+    ## thread target, sends on the wall clock until duration has passed or stop is set
+    def run(self):
+        start = time.monotonic()
+        while not self.stop and self.send_due(time.monotonic() - start):
+            time.sleep(self.tick)
+
+    ## send from a thread of its own
+    def start(self):
+        self.stop = False
+        self.thread = threading.Thread(name='TrafficGenerator', target=self.run, daemon=True)
+        self.thread.start()
+
+    ## wait for duration to pass, @param stop: if True, stop sending right away instead
+    def join(self, stop=False):
+        self.stop = stop
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    ## send as events of a runtimes.EventRuntime, one batch every tick virtual seconds from its current time
+    def schedule(self, event_runtime):
+        start = event_runtime.now
+        def send():
+            if not self.stop and self.send_due(event_runtime.now - start):
+                event_runtime.schedule(self.tick, send)
+        event_runtime.schedule(0, send)